@@ -1,7 +1,8 @@
 # backend/wisdar_backend/src/auth_utils.py
 from functools import wraps
-from flask import request, jsonify
-from flask_jwt_extended import verify_jwt_in_request
+from flask import request, jsonify, current_app, g
+from flask_jwt_extended import verify_jwt_in_request, decode_token
+from jwt import ExpiredSignatureError
 
 def jwt_required_ws(fn):
     """
@@ -27,4 +28,56 @@ def jwt_required_ws(fn):
             pass
 
         return fn(*args, **kwargs)
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def jwt_identity_required(fn):
+    """
+    Validates the access token cookie like @jwt_required(), but without running
+    the user_lookup_loader, so no database session is opened for the request.
+    The token identity is stored on g.jwt_identity.
+
+    Use this for long-lived streaming responses, where a lazily opened session
+    would otherwise pin a pooled connection for the lifetime of the stream,
+    and for endpoints that can answer without MySQL (a 304 for an unchanged
+    list, resumable upload chunks kept in Redis and on disk).
+
+    The trade-off: the user row is not checked, so the still-valid access
+    token of a deleted user keeps working here until it expires. Views that
+    return user data from MySQL should call check_identity_user() on that
+    path; the list endpoints do so on the 200 path.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        cookie_name = current_app.config.get('JWT_ACCESS_COOKIE_NAME', 'access_token_cookie')
+        token = request.cookies.get(cookie_name)
+        if not token:
+            return jsonify(msg=f'Missing cookie "{cookie_name}"'), 401
+
+        try:
+            decoded = decode_token(token)
+        except ExpiredSignatureError:
+            return jsonify(msg="Token has expired"), 401
+        except Exception:
+            return jsonify(msg="Invalid token"), 401
+
+        if decoded.get('type') != 'access':
+            return jsonify(msg="Only access tokens are allowed"), 401
+
+        g.jwt_identity = decoded[current_app.config.get('JWT_IDENTITY_CLAIM', 'sub')]
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def check_identity_user():
+    """
+    For views behind @jwt_identity_required: returns a 401 response if the
+    user of g.jwt_identity no longer exists, like @jwt_required()'s user
+    lookup would, or None if it does. Costs one primary-key query.
+    """
+    from .database import db
+    from .models.user import User
+
+    if db.session.query(User.id).filter_by(id=g.jwt_identity).first() is None:
+        return jsonify(msg=f"Error loading the user {g.jwt_identity}"), 401
+    return None
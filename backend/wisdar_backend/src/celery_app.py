@@ -7,12 +7,15 @@ load_dotenv()
 
 # Get the Redis URL from the environment, with a fallback for safety
 redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# The broker and the result backend can each be moved to their own Redis.
+broker_url = os.getenv("CELERY_BROKER_URL", redis_url)
+result_backend_url = os.getenv("CELERY_RESULT_BACKEND", redis_url)
 
 # Create the Celery instance and configure it immediately
 celery_app = Celery(
     "wisdar_tasks",
-    broker=redis_url,
-    backend=redis_url,
+    broker=broker_url,
+    backend=result_backend_url,
     include=['src.tasks'] # Tell Celery where to find your task modules
 )
 
@@ -22,6 +25,14 @@ celery_app.conf.update(
     broker_connection_retry_on_startup=True
 )
 
+# Periodic maintenance, run by `celery -A src.celery_app.celery_app beat`.
+celery_app.conf.beat_schedule = {
+    'purge-unreferenced-media': {
+        'task': 'src.tasks.purge_unreferenced_media_task',
+        'schedule': 24 * 3600,
+    },
+}
+
 # This function is now only for compatibility with your main.py, it doesn't configure the broker
 def init_celery(app):
     """Links the Flask app context to Celery tasks."""
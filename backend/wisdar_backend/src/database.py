@@ -1,5 +1,92 @@
+import threading
+from contextlib import contextmanager
+
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 # Initialize the SQLAlchemy object here.
 # All model files will import this 'db' instance.
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+
+
+def get_pool_stats() -> dict:
+    """
+    Returns a snapshot of the SQLAlchemy connection pool of the current app.
+    'checked_out' is the number of connections currently held by sessions.
+    """
+    pool = db.engine.pool
+    return {
+        'size': pool.size(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': pool.overflow(),
+    }
+
+
+# ==============================================================================
+#  SQL STATEMENT COUNTING (tests and debugging)
+# ==============================================================================
+class QueryCounter:
+    """
+    Counts the SQL statements the current thread/greenlet executes while active.
+    Use it to pin down how many queries a code path issues:
+
+        with QueryCounter() as counter:
+            client.get('/api/chat/conversations/1/messages?limit=50')
+        assert counter.count == 3
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+        self._ident = None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self._ident:
+            self.count += 1
+            self.statements.append(statement)
+
+    def __enter__(self):
+        self._ident = threading.get_ident()
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        return False
+
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """Fails with AssertionError if the block executes more than `limit` SQL statements."""
+    with QueryCounter() as counter:
+        yield counter
+    if counter.count > limit:
+        raise AssertionError(
+            f"Expected at most {limit} SQL statements, got {counter.count}:\n" + "\n".join(counter.statements)
+        )
+
+
+def init_query_count_header(app):
+    """
+    Adds an 'X-SQL-Query-Count' header to every response, so a fixed query
+    budget per endpoint can be checked from tests or the browser dev tools.
+    Enabled with the SQL_QUERY_COUNT_HEADER config flag; off in production.
+    """
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        if has_app_context() and 'sql_query_count' in g:
+            g.sql_query_count += 1
+
+    @app.before_request
+    def _start_query_count():
+        g.sql_query_count = 0
+
+    @app.after_request
+    def _add_query_count_header(response):
+        if 'sql_query_count' in g:
+            response.headers['X-SQL-Query-Count'] = str(g.sql_query_count)
+        return response
+
+    event.listen(Engine, 'before_cursor_execute', _count)
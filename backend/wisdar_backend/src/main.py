@@ -6,6 +6,7 @@ import os
 import sys
 import logging
 import redis
+from redis.cluster import RedisCluster
 from dotenv import load_dotenv
 from datetime import timedelta
 from flask_migrate import Migrate 
@@ -21,7 +22,11 @@ from flask_jwt_extended import JWTManager
 from flask_sse import sse
 
 # --- Local Module Imports ---
-from src.database import db
+from src.database import db, init_query_count_header
+from src.services.list_versions import register_list_version_hooks
+from src.services.context_cache import register_context_cache_hooks
+from src.utils.upload_utils import init_streaming_uploads
+from src.services.storage import init_storage
 from src.models.user import User
 from src.models.service_cost import ServiceCost # Import ServiceCost 
 from src.models.agent import Agent
@@ -33,9 +38,11 @@ from src.routes.chat import chat_bp
 from src.routes.stream import stream_bp 
 from src.routes.admin import admin_bp # Import new admin blueprint
 from src.celery_app import init_celery
+from src.services.sse_broker import SSEBroker
 from src.routes.providers import providers_bp
 from src.routes.team import team_bp
 from src.routes.agents import agents_bp
+from src.routes.uploads import uploads_bp
 
 # ==============================================================================
 # 1. FLASK APPLICATION CREATION
@@ -68,6 +75,49 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = os.path.join(app.static_folder, 'uploads')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Resumable uploads (/api/uploads) are sent in ranges, so they may exceed
+# MAX_CONTENT_LENGTH; sessions expire after a day without progress.
+app.config['UPLOAD_SESSION_MAX_BYTES'] = int(os.getenv('UPLOAD_SESSION_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+app.config['UPLOAD_SESSION_TTL_SECONDS'] = int(os.getenv('UPLOAD_SESSION_TTL_SECONDS', 24 * 3600))
+# How /api/chat/uploads sends file bytes: 'flask' (default), 'x-accel' (nginx
+# serves them from the internal location UPLOAD_ACCEL_PREFIX) or 'x-sendfile'.
+app.config['UPLOAD_DELIVERY_MODE'] = os.getenv('UPLOAD_DELIVERY_MODE', 'flask').lower()
+app.config['UPLOAD_ACCEL_PREFIX'] = os.getenv('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+app.config['USE_X_SENDFILE'] = app.config['UPLOAD_DELIVERY_MODE'] == 'x-sendfile'
+# Stored media no attachment uses any more is kept this long (so re-uploads still
+# deduplicate) before purge_unreferenced_media_task deletes it.
+app.config['MEDIA_BLOB_GRACE_SECONDS'] = int(os.getenv('MEDIA_BLOB_GRACE_SECONDS', 7 * 24 * 3600))
+# Prompt-token budget for the chat history sent with each turn; a model's
+# 'context_token_budget' capability overrides it.
+app.config['CONTEXT_TOKEN_BUDGET'] = int(os.getenv('CONTEXT_TOKEN_BUDGET', 16000))
+# Most recent messages per conversation kept in the Redis context cache.
+app.config['CONTEXT_CACHE_MAX_MESSAGES'] = int(os.getenv('CONTEXT_CACHE_MAX_MESSAGES', 300))
+# Rolling summaries: once the messages after a conversation's summary reach the
+# trigger (or overflow the budget), a background run summarizes all but the
+# newest KEEP tokens, SEGMENT tokens per model call.
+app.config['CONVERSATION_SUMMARY_TRIGGER_TOKENS'] = int(os.getenv('CONVERSATION_SUMMARY_TRIGGER_TOKENS', 8000))
+app.config['CONVERSATION_SUMMARY_KEEP_TOKENS'] = int(os.getenv('CONVERSATION_SUMMARY_KEEP_TOKENS', 3000))
+app.config['CONVERSATION_SUMMARY_SEGMENT_TOKENS'] = int(os.getenv('CONVERSATION_SUMMARY_SEGMENT_TOKENS', 6000))
+app.config['CONVERSATION_SUMMARY_MODEL'] = os.getenv('CONVERSATION_SUMMARY_MODEL', 'gpt-4o-mini')
+app.config['CONVERSATION_SUMMARY_MAX_TOKENS'] = int(os.getenv('CONVERSATION_SUMMARY_MAX_TOKENS', 800))
+# Gemini explicit prompt caching of stable prefixes (agent prompts, transcripts,
+# summaries); shorter prefixes are below Gemini's minimum and sent as usual.
+app.config['GEMINI_CONTEXT_CACHE_MIN_TOKENS'] = int(os.getenv('GEMINI_CONTEXT_CACHE_MIN_TOKENS', 4096))
+app.config['GEMINI_CONTEXT_CACHE_TTL_SECONDS'] = int(os.getenv('GEMINI_CONTEXT_CACHE_TTL_SECONDS', 3600))
+# Exact-match cache of helper model calls (claim decomposition, TTS parameters,
+# video prompt segmentation and edits); a TTL of 0 disables it.
+app.config['RESPONSE_CACHE_TTL_SECONDS'] = int(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 10000))
+# Where stored media lives: 'local' (UPLOAD_FOLDER, sharded into subdirectories)
+# or 's3' (any S3-compatible bucket, so web and worker nodes need no shared disk).
+app.config['STORAGE_BACKEND'] = os.getenv('STORAGE_BACKEND', 'local').lower()
+app.config['S3_BUCKET'] = os.getenv('S3_BUCKET')
+app.config['S3_PREFIX'] = os.getenv('S3_PREFIX', '')
+app.config['S3_ENDPOINT_URL'] = os.getenv('S3_ENDPOINT_URL')  # e.g. a MinIO server
+app.config['S3_REGION'] = os.getenv('S3_REGION')
+app.config['S3_ACCESS_KEY_ID'] = os.getenv('S3_ACCESS_KEY_ID')
+app.config['S3_SECRET_ACCESS_KEY'] = os.getenv('S3_SECRET_ACCESS_KEY')
+app.config['S3_URL_EXPIRES_SECONDS'] = int(os.getenv('S3_URL_EXPIRES_SECONDS', 3600))
 # Determine if the app is running in a secure context
 is_production = os.getenv("PUBLIC_SERVER_URL", "").startswith("https://")
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-super-secret-jwt-key')
@@ -101,6 +151,73 @@ app.config["RSA_PRIVATE_KEY"] = formatted_key
 # Create Redis client
 app.redis_client = redis.from_url(app.config["REDIS_URL"])
 
+# --- Real-time events Redis ---
+# SSE Pub/Sub, replay Streams, presence and audio buffers can live on their own
+# Redis (or Redis Cluster), separate from the Celery broker and result backend
+# (see CELERY_BROKER_URL / CELERY_RESULT_BACKEND in celery_app.py).
+app.config["REDIS_EVENTS_URL"] = os.getenv("REDIS_EVENTS_URL", app.config["REDIS_URL"])
+app.config["REDIS_EVENTS_CLUSTER"] = os.getenv("REDIS_EVENTS_CLUSTER", "false").lower() == "true"
+# Use SPUBLISH/SSUBSCRIBE so each event only reaches the shard owning the
+# user's channel instead of being broadcast to every cluster node (Redis 7+).
+app.config["SSE_SHARDED_PUBSUB"] = os.getenv("SSE_SHARDED_PUBSUB", "false").lower() == "true"
+if app.config["REDIS_EVENTS_CLUSTER"]:
+    app.events_redis_client = RedisCluster.from_url(app.config["REDIS_EVENTS_URL"])
+else:
+    app.events_redis_client = redis.from_url(app.config["REDIS_EVENTS_URL"])
+
+# --- SSE Config ---
+# Max number of undelivered events buffered per connected SSE client.
+app.config["SSE_CLIENT_QUEUE_SIZE"] = int(os.getenv("SSE_CLIENT_QUEUE_SIZE", 256))
+# Every event is also kept in a capped per-user Redis Stream so reconnecting
+# clients can replay what they missed (Last-Event-ID).
+app.config["SSE_REPLAY_MAXLEN"] = int(os.getenv("SSE_REPLAY_MAXLEN", 2000))
+app.config["SSE_REPLAY_TTL_SECONDS"] = int(os.getenv("SSE_REPLAY_TTL_SECONDS", 3600))
+app.config["SSE_REPLAY_MAX_EVENTS"] = int(os.getenv("SSE_REPLAY_MAX_EVENTS", 2000))
+# Encoding of events between publishers and the SSE tier: 'json' (default) or
+# 'msgpack' (requires the msgpack package). Browsers always receive JSON.
+app.config["SSE_WIRE_FORMAT"] = os.getenv("SSE_WIRE_FORMAT", "json")
+# Quiet streams get a heartbeat comment every SSE_HEARTBEAT_SECONDS; streams
+# whose writes have not completed for SSE_IDLE_TIMEOUT_SECONDS are reaped.
+app.config["SSE_HEARTBEAT_SECONDS"] = int(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+app.config["SSE_IDLE_TIMEOUT_SECONDS"] = int(os.getenv("SSE_IDLE_TIMEOUT_SECONDS", 60))
+app.config["SSE_MAX_CONNECTIONS_PER_USER"] = int(os.getenv("SSE_MAX_CONNECTIONS_PER_USER", 10))
+# SSE processes record which users have an open stream; publishers skip chunk
+# and progress events for everyone else. The presence entry must outlive a
+# heartbeat interval, and publishers cache each lookup for a couple of seconds.
+# After the last stream closes the entry lasts SSE_PRESENCE_TTL_SECONDS more,
+# the window in which a reconnecting client can still replay missed chunks.
+app.config["SSE_PRESENCE_TTL_SECONDS"] = int(os.getenv("SSE_PRESENCE_TTL_SECONDS", 45))
+app.config["SSE_PRESENCE_CACHE_SECONDS"] = float(os.getenv("SSE_PRESENCE_CACHE_SECONDS", 2))
+# Provider tokens are batched into 'stream_chunk' events, flushed every
+# flush_interval_ms or once flush_bytes are pending. Services listed here
+# override the defaults; set either value to 0 to publish every token.
+app.config["SSE_CHUNK_COALESCING"] = {
+    "default": {
+        "flush_interval_ms": int(os.getenv("SSE_CHUNK_FLUSH_INTERVAL_MS", 50)),
+        "flush_bytes": int(os.getenv("SSE_CHUNK_FLUSH_BYTES", 512)),
+    },
+    # Long, non-interactive answers can trade a little more latency.
+    "video-understanding": {"flush_interval_ms": 150, "flush_bytes": 2048},
+    "chat-search": {"flush_interval_ms": 100, "flush_bytes": 1024},
+}
+
+# Instructed TTS audio is buffered per message in a short-lived Redis Stream
+# and served as progressive 'audio/mpeg' instead of base64 SSE events.
+app.config["TTS_AUDIO_STREAM_TTL_SECONDS"] = int(os.getenv("TTS_AUDIO_STREAM_TTL_SECONDS", 300))
+app.config["TTS_AUDIO_STREAM_IDLE_TIMEOUT_MS"] = int(os.getenv("TTS_AUDIO_STREAM_IDLE_TIMEOUT_MS", 30000))
+
+# One shared Pub/Sub subscriber per process, fanning out to every SSE client.
+app.sse_broker = SSEBroker(
+    app.config["REDIS_EVENTS_URL"],
+    queue_size=app.config["SSE_CLIENT_QUEUE_SIZE"],
+    max_connections_per_user=app.config["SSE_MAX_CONNECTIONS_PER_USER"],
+    idle_timeout=app.config["SSE_IDLE_TIMEOUT_SECONDS"],
+    reap_interval=app.config["SSE_HEARTBEAT_SECONDS"],
+    presence_ttl=app.config["SSE_PRESENCE_TTL_SECONDS"],
+    cluster=app.config["REDIS_EVENTS_CLUSTER"],
+    sharded=app.config["SSE_SHARDED_PUBSUB"],
+)
+
 # CORS Configuration
 CORS(
     app,
@@ -126,6 +243,23 @@ jwt = JWTManager(app)
 init_oauth(app) 
 init_celery(app)
 
+# Parse multipart uploads straight into UPLOAD_FOLDER (one disk write per file).
+init_streaming_uploads(app)
+
+# Media storage backend used by uploads, generated media and the Celery tasks.
+init_storage(app)
+
+# Bump the conversation/message list versions behind the list ETags on commit.
+register_list_version_hooks(app)
+
+# Keep the Redis copy of each conversation's history (used for AI context) in step.
+register_context_cache_hooks(app)
+
+# Report the number of SQL statements per request (tests/debugging only).
+app.config["SQL_QUERY_COUNT_HEADER"] = os.getenv("SQL_QUERY_COUNT_HEADER", "false").lower() == "true"
+if app.config["SQL_QUERY_COUNT_HEADER"]:
+    init_query_count_header(app)
+
 # ==============================================================================
 # 4. JWT USER LOOKUP
 # ==============================================================================
@@ -146,6 +280,7 @@ app.register_blueprint(admin_bp, url_prefix='/api/admin') # Register the new adm
 app.register_blueprint(providers_bp, url_prefix='/api/providers')
 app.register_blueprint(team_bp, url_prefix='/api/team') 
 app.register_blueprint(agents_bp, url_prefix='/api')
+app.register_blueprint(uploads_bp, url_prefix='/api/uploads')
 
 # ==============================================================================
 # 6. SETUP DATABASE AND INITIAL DATA
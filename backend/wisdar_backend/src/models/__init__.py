@@ -1,7 +1,10 @@
 # src/models/__init__.py
 from .user import User
 from .chat import Conversation, Message, Attachment
+from .media_blob import MediaBlob
+from .conversation_summary import ConversationSummary
 from .provider import Provider, Service, ProviderService
+from .service_permission import user_service_permissions
 from .service_cost import ServiceCost
 from .agent import Agent
 from .transaction_log import TransactionLog
\ No newline at end of file
@@ -1,12 +1,13 @@
 import os
 # MODIFIED: Import db from the new central database.py file
 from src.database import db
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum  as SQLAlchemyEnum,Float
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Enum  as SQLAlchemyEnum,Float, event
+from sqlalchemy.orm import relationship, Session
 from datetime import datetime
 from flask import url_for
 import enum
 from .agent import Agent 
+from .media_blob import MediaBlob
 
 class MessageStatus(str, enum.Enum):
     """
@@ -22,12 +23,19 @@ class MessageStatus(str, enum.Enum):
 
 class Conversation(db.Model):
     __tablename__ = 'conversations'
+    # Matches the sidebar query: a user's non-deleted conversations, pinned first, newest first.
+    __table_args__ = (
+        db.Index('ix_conversations_user_id_is_deleted_is_pinned_created_at', 'user_id', 'is_deleted', 'is_pinned', 'created_at'),
+        db.Index('ix_conversations_user_id_updated_at', 'user_id', 'updated_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     title = Column(String(255), nullable=False)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     ai_model_id = Column(String(100), nullable=False, comment="The specific model string used, e.g. 'gpt-4o'")
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Set on every change; the sync endpoint returns rows changed after a watermark.
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
     is_deleted = db.Column(db.Boolean, default=False, nullable=False)
     is_pinned = db.Column(db.Boolean, default=False, nullable=False, index=True)
     # This column links the conversation to the provider that was used.
@@ -61,6 +69,12 @@ class Conversation(db.Model):
     def __repr__(self):
         return f"<Conversation {self.id}: {self.title}>"
     
+    # The only columns to_dict() reads; listing queries load just these.
+    LIST_COLUMNS = (
+        'id', 'title', 'ai_model_id', 'created_at', 'updated_at', 'is_deleted', 'is_pinned',
+        'provider_id', 'service_id', 'provider_service_id', 'video_context_url',
+    )
+
     # --- ADD THIS METHOD ---
     def to_dict(self):
         """Returns a dictionary representation of the conversation."""
@@ -69,6 +83,7 @@ class Conversation(db.Model):
             "title": self.title,
             "ai_model_id": self.ai_model_id,
             "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
             'is_deleted': self.is_deleted,
             'is_pinned': self.is_pinned,
             'provider_id': self.provider_id,
@@ -81,12 +96,19 @@ class Conversation(db.Model):
  
 class Message(db.Model):
     __tablename__ = 'messages'
+    # Backs the keyset-paginated message history (newest page first, then older).
+    __table_args__ = (
+        db.Index('ix_messages_conversation_id_created_at_id', 'conversation_id', 'created_at', 'id'),
+        db.Index('ix_messages_conversation_id_updated_at', 'conversation_id', 'updated_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False)
     role = Column(String(50), nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Set on every change; the sync endpoint returns rows changed after a watermark.
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
        # --- NEW FIELD ---
     # This field will track the lifecycle status of the message.
     status = Column(SQLAlchemyEnum(MessageStatus), default=MessageStatus.COMPLETE, nullable=False)
@@ -118,8 +140,11 @@ class Message(db.Model):
     # --- END: ADD NEW COLUMNS ---
 
     
-    # One-to-one relationship with the Attachment model
-    attachment = relationship('Attachment', back_populates='message', uselist=False, cascade="all, delete-orphan")
+    # One-to-one relationship with the Attachment model.
+    # Loaded in the same SELECT as the message (LEFT OUTER JOIN), because
+    # to_dict() always reads it: listing N messages must not cost N+1 queries,
+    # and the reload after a commit in the streaming tasks stays one query.
+    attachment = relationship('Attachment', back_populates='message', uselist=False, cascade="all, delete-orphan", lazy='joined')
 
     def __repr__(self):
         return f"<Message {self.id} in Conversation {self.conversation_id}>"
@@ -130,6 +155,7 @@ class Message(db.Model):
             "role": self.role,
             "content": self.content,
             "timestamp": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
             "attachment": self.attachment.to_dict(host_url) if self.attachment else None,
             # --- ADD THIS LINE ---
             'conversation_id': self.conversation_id,
@@ -160,9 +186,13 @@ class Attachment(db.Model):
     # This will store the job ID from Speechmatics so we can link the webhook notification.
     speechmatics_job_id = Column(String(100), nullable=True, index=True)
     original_size_mb = Column(Float, nullable=True)
+    # The deduplicated file behind storage_url; NULL for files stored before
+    # content addressing and for generated media.
+    blob_sha256 = Column(String(64), ForeignKey('media_blobs.sha256'), nullable=True, index=True)
 
     # Relationship back to the Message model
     message = relationship('Message', back_populates='attachment')
+    blob = relationship('MediaBlob')
 
     def __repr__(self):
         return f"<Attachment for Message {self.message_id}: {self.file_name}>"
@@ -196,4 +226,39 @@ class Attachment(db.Model):
             "speechmatics_job_id": self.speechmatics_job_id,
             'original_size_mb': self.original_size_mb # Added for frontend display
         }
-    
+
+
+@event.listens_for(Session, 'before_flush')
+def _touch_message_on_attachment_change(session, flush_context, instances):
+    """An attachment is part of its message's payload, so changing it counts as changing the message."""
+    with session.no_autoflush:
+        for obj in list(session.new) + list(session.dirty):
+            if not isinstance(obj, Attachment):
+                continue
+            message = obj.message or (obj.message_id and session.get(Message, obj.message_id))
+            if message is not None:
+                message.updated_at = datetime.utcnow()
+
+
+@event.listens_for(Session, 'before_flush')
+def _count_media_blob_references(session, flush_context, instances):
+    """Keeps MediaBlob.ref_count equal to the number of attachments using each blob."""
+    deltas = {}
+    with session.no_autoflush:
+        for objects, step in ((session.new, 1), (session.deleted, -1)):
+            for obj in objects:
+                if not isinstance(obj, Attachment):
+                    continue
+                blob = obj.blob or (obj.blob_sha256 and session.get(MediaBlob, obj.blob_sha256))
+                if blob:
+                    deltas[blob] = deltas.get(blob, 0) + step
+
+    for blob, delta in deltas.items():
+        if not delta:
+            continue
+        if blob in session.new:
+            blob.ref_count = (blob.ref_count or 0) + delta
+        else:
+            # Applied in SQL, so concurrent uploads of the same file cannot lose a count.
+            blob.ref_count = MediaBlob.ref_count + delta
+        blob.last_used_at = datetime.utcnow()
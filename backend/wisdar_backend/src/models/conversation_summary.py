@@ -0,0 +1,39 @@
+# src/models/conversation_summary.py
+
+from datetime import datetime
+
+from src.database import db
+from sqlalchemy import Column, Integer, Text, DateTime, ForeignKey
+
+
+class ConversationSummary(db.Model):
+    """
+    A rolling summary of the older part of a conversation.
+
+    Each summary covers every message up to and including `through_message_id`
+    (in (created_at, id) order) and folds in the previous summary, so only the
+    newest row of a conversation is needed: the context builder sends it
+    followed by the messages after it.
+    """
+    __tablename__ = 'conversation_summaries'
+    __table_args__ = (
+        db.Index('ix_conversation_summaries_conversation_id_id', 'conversation_id', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    conversation_id = Column(Integer, ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
+    content = Column(Text, nullable=False)
+    # The last message covered; its created_at is copied for keyset queries.
+    through_message_id = Column(Integer, ForeignKey('messages.id', ondelete='SET NULL'), nullable=True)
+    through_created_at = Column(DateTime, nullable=False)
+    # Messages folded into this summary across the whole chain.
+    message_count = Column(Integer, nullable=False, default=0)
+    token_estimate = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def latest_for(cls, conversation_id: int):
+        return cls.query.filter_by(conversation_id=conversation_id).order_by(cls.id.desc()).first()
+
+    def __repr__(self):
+        return f"<ConversationSummary {self.id} conversation={self.conversation_id} through={self.through_message_id}>"
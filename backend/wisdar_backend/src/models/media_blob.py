@@ -0,0 +1,39 @@
+# src/models/media_blob.py
+
+from datetime import datetime
+
+from src.database import db
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime
+
+
+class MediaBlob(db.Model):
+    """
+    One stored upload, identified by the SHA-256 of its content.
+
+    Identical files uploaded by different users share a single blob (and a
+    single stored file); `ref_count` is the number of attachments
+    pointing at it. Work derived from the content, such as transcripts and
+    Gemini file handles, is kept in `artifacts` so it is done once per file.
+    """
+    __tablename__ = 'media_blobs'
+
+    sha256 = Column(String(64), primary_key=True)
+    # Name of the file in the media storage (services/storage.py): '<sha256><extension>'.
+    storage_name = Column(String(255), nullable=False)
+    content_type = Column(String(100), nullable=True)
+    size_bytes = Column(BigInteger, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    # Derived results keyed by kind, e.g. 'transcript:<language>' or 'gemini_file'.
+    artifacts = Column(db.JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
+    def get_artifact(self, key: str):
+        return (self.artifacts or {}).get(key)
+
+    def set_artifact(self, key: str, value):
+        # Reassign so SQLAlchemy notices the change to the JSON column.
+        self.artifacts = {**(self.artifacts or {}), key: value}
+
+    def __repr__(self):
+        return f"<MediaBlob {self.sha256[:12]} refs={self.ref_count}>"
@@ -1,11 +1,10 @@
-import json
 from functools import wraps
 from flask import Blueprint, jsonify, request, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import base64
 
 # [MODIFIED] Import Provider model and cryptography libraries
-from src.database import db
+from src.database import db, get_pool_stats
 from src.models.user import User
 from src.models.service_cost import ServiceCost
 from src.models.provider import Provider # <-- NEW
@@ -16,6 +15,9 @@ from src.models.provider import ProviderService, Service
 
 from itsdangerous import URLSafeTimedSerializer
 from ..tasks import send_invitation_email
+from ..services.event_bus import publish_event
+from ..services.sse_protocol import user_channel
+from ..services.prompt_cache import get_stats as get_prompt_cache_stats
 # A simple decorator to protect routes for admin users only
 def admin_required():
     def wrapper(fn):
@@ -34,33 +36,13 @@ def admin_required():
 # Corrected helper function to notify frontend via SSE
 def notify_frontend_of_credit_change(user_id, new_credit_balance):
     """
-    Publishes a credit update event in a consistent, nested format
-    to the user's specific Redis channel.
+    Publishes a credit update event in the same format as all other SSE
+    events to the user's specific Redis channel.
     """
-    try:
-        channel = f'user-{user_id}'
-
-        # 1. Create the inner payload that will be stringified.
-        #    This is the actual data your frontend needs.
-        inner_data = {
-            "type": "credits_update",
-            "credits": new_credit_balance
-        }
-
-        # 2. Create the outer payload which matches the structure of all
-        #    other SSE events. The 'data' key holds the stringified JSON.
-        outer_payload = {
-            "type": "credits_update",
-            "data": json.dumps(inner_data)
-        }
-
-        # 3. Publish the final, correctly formatted event data.
-        #    This payload will now be a JSON string of the 'outer_payload'.
-        event_data = json.dumps(outer_payload)
-        current_app.redis_client.publish(channel, event_data)
-
-    except Exception as e:
-        current_app.logger.error(f"Failed to publish credit update for user {user_id}: {e}")
+    publish_event(user_channel(user_id), {
+        "type": "credits_update",
+        "credits": new_credit_balance
+    }, "credits_update")
 
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
@@ -398,4 +380,31 @@ def resend_invitation(user_id):
 
     except Exception as e:
         current_app.logger.error(f"Failed to resend invitation for user {user.id}: {e}", exc_info=True)
-        return jsonify({"message": "Failed to resend invitation due to a server error."}), 500
\ No newline at end of file
+        return jsonify({"message": "Failed to resend invitation due to a server error."}), 500
+
+@admin_bp.route('/stream/stats', methods=['GET'])
+@admin_required()
+def get_stream_stats():
+    """
+    Returns connection and queue statistics for the SSE broker of the
+    process that served this request, alongside its database pool usage.
+    With streams holding no connection, 'db_pool.checked_out' stays low
+    however many clients are connected.
+    """
+    stats = current_app.sse_broker.stats()
+    stats['db_pool'] = get_pool_stats()
+    return jsonify(stats)
+
+@admin_bp.route('/prompt-cache-stats', methods=['GET'])
+@admin_required()
+def get_prompt_cache_stats_route():
+    """
+    Returns provider prompt cache hits and misses per day and provider, for
+    the last ?days= days (default 7, at most 30).
+    """
+    days = min(max(request.args.get('days', 7, type=int), 1), 30)
+    try:
+        return jsonify(get_prompt_cache_stats(days))
+    except Exception as e:
+        current_app.logger.error(f"Error fetching prompt cache stats: {e}")
+        return jsonify({"message": "Failed to fetch prompt cache stats."}), 500
@@ -1,7 +1,13 @@
 import os
 import logging
-from flask import Blueprint, jsonify, request, current_app, send_from_directory
+import mimetypes
+from urllib.parse import quote
+from datetime import datetime
+from functools import wraps
+from flask import Blueprint, Response, jsonify, request, current_app, send_from_directory, redirect, url_for, g, abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import load_only
 from werkzeug.utils import secure_filename
 import re
 
@@ -15,7 +21,15 @@ from src.models.provider import ProviderService , Provider
 from ..tasks import orchestrate_transcription, generate_text_response, generate_image_task, orchestrate_video_processing, generate_tts_from_message ,orchestrate_long_video_generation,generate_tts_task,apply_contextual_edit_task,orchestrate_video_understanding,process_youtube_summary_task
 
 # Utilities
-from ..utils.audio_utils import allowed_file, save_file_locally, convert_audio_to_wav
+from ..auth_utils import jwt_identity_required, check_identity_user
+from ..services.list_versions import get_list_version, make_list_etag, conversations_version_key, messages_version_key
+from ..utils.audio_utils import allowed_file, convert_audio_to_wav
+from ..utils.upload_utils import save_upload
+from ..services.upload_sessions import UploadSessionError
+from ..services.media_store import store_upload, content_hash_of
+from ..services.storage import get_storage, is_valid_name, STORAGE_S3
+from .uploads import get_upload_store
+from ..services.audio_stream import audio_stream_key, iter_audio_stream
 
 chat_bp = Blueprint('chat', __name__)
 
@@ -23,6 +37,175 @@ chat_bp = Blueprint('chat', __name__)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Message history pagination
+DEFAULT_MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
+# Conversation sidebar pagination
+DEFAULT_CONVERSATION_PAGE_SIZE = 30
+MAX_CONVERSATION_PAGE_SIZE = 100
+
+# Delta sync: max rows of each kind returned per call
+SYNC_MAX_ROWS = 500
+
+
+# ==============================================================================
+#  HELPERS
+# ==============================================================================
+def etag_from_list_version(version_key_for):
+    """
+    Serves a list endpoint with a weak ETag derived from its Redis version
+    counter, and answers a matching If-None-Match with 304 before the view
+    (and therefore the database) runs. Must be applied below
+    jwt_identity_required. `version_key_for(user_id, **view_kwargs)` returns
+    the counter's key.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            etag = None
+            version = get_list_version(current_app.redis_client, version_key_for(g.jwt_identity, **kwargs))
+            if version is not None:
+                etag = make_list_etag(version, request.query_string)
+                if request.if_none_match.contains_weak(etag):
+                    response = current_app.response_class(status=304)
+                    response.set_etag(etag, weak=True)
+                    response.headers['Cache-Control'] = 'private, no-cache'
+                    return response
+
+            # Only the 304 above skips MySQL; a full answer reads the user's
+            # data, so it first checks that the user still exists.
+            denied = check_identity_user()
+            if denied is not None:
+                return denied
+            response = current_app.make_response(fn(*args, **kwargs))
+            if etag and response.status_code == 200:
+                response.set_etag(etag, weak=True)
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def _conversation_list_query(user_id, include_deleted=False):
+    """A user's conversations (without deleted ones by default), projected to the columns to_dict() needs."""
+    query = Conversation.query.options(
+        load_only(*(getattr(Conversation, name) for name in Conversation.LIST_COLUMNS))
+    ).filter(Conversation.user_id == user_id)
+    if not include_deleted:
+        query = query.filter(Conversation.is_deleted == False)
+    return query
+
+
+def _parse_sync_cursor(value):
+    """Parses "<ISO>,<id>,<ISO>,<id>" into the conversation and message cursors."""
+    conv_at, conv_id, msg_at, msg_id = value.split(',')
+    return ((datetime.fromisoformat(conv_at), int(conv_id)),
+            (datetime.fromisoformat(msg_at), int(msg_id)))
+
+
+def _sync_page(query, model, cursor):
+    """
+    Returns (rows, next cursor, truncated): up to SYNC_MAX_ROWS rows changed
+    after the (updated_at, id) cursor, oldest change first.
+
+    updated_at has second precision, so a truncated page continues after its
+    last (updated_at, id) and always makes progress, however many rows share
+    a second. A complete page moves the cursor to (newest updated_at, 0):
+    rows changed later within that second are sent again on the next call.
+    """
+    changed_at, last_id = cursor
+    rows = query.filter(or_(
+        model.updated_at > changed_at,
+        and_(model.updated_at == changed_at, model.id > last_id),
+    )).order_by(model.updated_at.asc(), model.id.asc()).limit(SYNC_MAX_ROWS + 1).all()
+    if len(rows) > SYNC_MAX_ROWS:
+        rows = rows[:SYNC_MAX_ROWS]
+        return rows, (rows[-1].updated_at, rows[-1].id), True
+    newest = max([changed_at] + [row.updated_at for row in rows])
+    return rows, ((newest, 0) if newest > changed_at else cursor), False
+
+
+def _paginate_conversations(user_id, limit, before_id=None):
+    """
+    Keyset pagination over the sidebar ordering (pinned first, then newest),
+    served by ix_conversations_user_id_is_deleted_is_pinned_created_at.
+    `before_id` is the id of the last conversation of the previous page.
+
+    Returns (conversations, has_more), or None if the cursor is not one of
+    the user's conversations.
+    """
+    query = _conversation_list_query(user_id)
+
+    if before_id is not None:
+        cursor = db.session.query(Conversation.is_pinned, Conversation.created_at, Conversation.id).filter(
+            Conversation.id == before_id, Conversation.user_id == user_id
+        ).first()
+        if cursor is None:
+            return None
+        cursor_pinned, cursor_created_at, cursor_id = cursor
+        query = query.filter(or_(
+            Conversation.is_pinned < cursor_pinned,
+            and_(Conversation.is_pinned == cursor_pinned, or_(
+                Conversation.created_at < cursor_created_at,
+                and_(Conversation.created_at == cursor_created_at, Conversation.id < cursor_id),
+            )),
+        ))
+
+    rows = query.order_by(
+        Conversation.is_pinned.desc(), Conversation.created_at.desc(), Conversation.id.desc()
+    ).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+
+def _paginate_messages(conversation_id, limit, before_id=None, after_id=None):
+    """
+    Keyset pagination over a conversation's messages, ordered by
+    (created_at, id) so it is served by ix_messages_conversation_id_created_at_id.
+
+    - no cursor: the newest `limit` messages
+    - before_id: the `limit` messages just older than that message
+    - after_id:  the `limit` messages just newer than that message
+
+    Returns (messages oldest first, has_more) where has_more tells whether
+    further messages exist in the direction being paged. Returns None if the
+    cursor message does not belong to the conversation.
+    """
+    query = Message.query.filter(Message.conversation_id == conversation_id)
+    cursor_id = after_id if after_id is not None else before_id
+
+    if cursor_id is not None:
+        cursor = db.session.query(Message.created_at, Message.id).filter(
+            Message.id == cursor_id, Message.conversation_id == conversation_id
+        ).first()
+        if cursor is None:
+            return None
+        cursor_created_at, cursor_id = cursor
+
+    if after_id is not None:
+        query = query.filter(or_(
+            Message.created_at > cursor_created_at,
+            and_(Message.created_at == cursor_created_at, Message.id > cursor_id),
+        )).order_by(Message.created_at.asc(), Message.id.asc())
+    else:
+        if before_id is not None:
+            query = query.filter(or_(
+                Message.created_at < cursor_created_at,
+                and_(Message.created_at == cursor_created_at, Message.id < cursor_id),
+            ))
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
+
+    # Fetch one extra row to know whether there is another page.
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id is None:
+        rows.reverse()
+    return rows, has_more
+
+
+# Content-addressed files never change, so browsers may keep them for a year.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
 
 
 # ==============================================================================
@@ -31,28 +214,170 @@ logger = logging.getLogger(__name__)
 
 @chat_bp.route('/uploads/<path:filename>')
 def get_uploaded_file(filename):
-    """Serve uploaded files"""
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    """
+    Serve uploaded files.
+
+    Files named after their content hash get that hash as a strong ETag and
+    are cached as immutable. With UPLOAD_DELIVERY_MODE 'x-accel' the bytes,
+    Range requests included, are sent by nginx from the internal location at
+    UPLOAD_ACCEL_PREFIX; with 'x-sendfile' by a server that honours X-Sendfile.
+    With S3 storage the browser is redirected to a short-lived signed URL.
+    """
+    if not is_valid_name(filename):
+        abort(404)
+    storage = get_storage()
+    content_hash = content_hash_of(filename)
+
+    if current_app.config['STORAGE_BACKEND'] == STORAGE_S3:
+        response = redirect(storage.signed_url(filename))
+        # The signed URL expires, so only the redirect itself may be reused, and only briefly.
+        response.cache_control.private = True
+        response.cache_control.max_age = max(storage.url_expires_seconds - 60, 0)
+        return response
+
+    relative_path = storage.relative_path(filename)
+    if not os.path.isfile(os.path.join(storage.root, relative_path)):
+        abort(404)
+
+    if current_app.config['UPLOAD_DELIVERY_MODE'] == 'x-accel':
+        # nginx answers Range and conditional requests itself, with its own
+        # strong ETag; of our headers it keeps Content-Type and Cache-Control.
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = current_app.config['UPLOAD_ACCEL_PREFIX'].rstrip('/') + '/' + quote(relative_path)
+    else:
+        # Also covers 'x-sendfile', which Flask implements through USE_X_SENDFILE.
+        response = send_from_directory(
+            storage.root, relative_path,
+            etag=content_hash or True,
+            max_age=IMMUTABLE_MAX_AGE if content_hash else None,
+        )
+
+    if content_hash:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
 
 
 @chat_bp.route('/conversations', methods=['GET'])
-@jwt_required()
+@jwt_identity_required
+@etag_from_list_version(conversations_version_key)
 def get_conversations():
-    """Get all conversations for the current user"""
-    current_user_id = get_jwt_identity()
-    conversations = Conversation.query.filter_by(user_id=current_user_id, is_deleted=False).order_by(Conversation.is_pinned.desc(), Conversation.created_at.desc()).all()
-    return jsonify([conv.to_dict() for conv in conversations])
+    """
+    Get the current user's conversations, pinned first, then newest first.
+
+    With a `limit` query parameter a single page is returned; pass the id of
+    the last conversation received as `before` to get the next one:
+        {"conversations": [...], "has_more": bool}
+    Without paging parameters every conversation is returned as a plain list.
+    """
+    current_user_id = g.jwt_identity
+    before_id = request.args.get('before', type=int)
+    limit = request.args.get('limit', type=int)
+
+    if limit is None and before_id is None:
+        conversations = _conversation_list_query(current_user_id).order_by(
+            Conversation.is_pinned.desc(), Conversation.created_at.desc(), Conversation.id.desc()
+        ).all()
+        return jsonify([conv.to_dict() for conv in conversations])
+
+    limit = max(1, min(limit or DEFAULT_CONVERSATION_PAGE_SIZE, MAX_CONVERSATION_PAGE_SIZE))
+    page = _paginate_conversations(current_user_id, limit, before_id=before_id)
+    if page is None:
+        return jsonify({"message": "Cursor conversation not found."}), 404
+    conversations, has_more = page
+    return jsonify({
+        "conversations": [conv.to_dict() for conv in conversations],
+        "has_more": has_more,
+    })
 
 
 @chat_bp.route('/conversations/<int:conversation_id>/messages', methods=['GET'])
-@jwt_required()
+@jwt_identity_required
+@etag_from_list_version(messages_version_key)
 def get_messages_for_conversation(conversation_id):
-    """Get messages for a specific conversation"""
-    current_user_id = get_jwt_identity()
+    """
+    Get messages for a specific conversation, oldest first.
+
+    With a `limit` query parameter a single page is returned, newest page
+    first; pass the id of the oldest loaded message as `before` to scroll
+    back, or of the newest as `after` to catch up:
+        {"messages": [...], "has_more": bool}
+    Without any paging parameter every message is returned as a plain list.
+    """
+    current_user_id = g.jwt_identity
     conversation = Conversation.query.filter_by(id=conversation_id, user_id=current_user_id).first_or_404()
-    # Assuming you have a relationship setup for messages in your Conversation model
-    messages = conversation.messages.order_by(Message.created_at.asc()).all()
-    return jsonify([message.to_dict(request.host_url) for message in messages])
+
+    before_id = request.args.get('before', type=int)
+    after_id = request.args.get('after', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is None and before_id is None and after_id is None:
+        # Assuming you have a relationship setup for messages in your Conversation model
+        messages = conversation.messages.order_by(Message.created_at.asc(), Message.id.asc()).all()
+        return jsonify([message.to_dict(request.host_url) for message in messages])
+
+    if before_id is not None and after_id is not None:
+        return jsonify({"message": "Use either 'before' or 'after', not both."}), 400
+    limit = max(1, min(limit or DEFAULT_MESSAGE_PAGE_SIZE, MAX_MESSAGE_PAGE_SIZE))
+
+    page = _paginate_messages(conversation.id, limit, before_id=before_id, after_id=after_id)
+    if page is None:
+        return jsonify({"message": "Cursor message not found in this conversation."}), 404
+    messages, has_more = page
+    return jsonify({
+        "messages": [message.to_dict(request.host_url) for message in messages],
+        "has_more": has_more,
+    })
+
+
+@chat_bp.route('/sync', methods=['GET'])
+# Not jwt_identity_required: this endpoint has no ETag short-circuit and always
+# queries MySQL, so the user lookup costs little and rejects the tokens of
+# deleted users.
+@jwt_required()
+def sync_changes():
+    """
+    Returns the conversations and messages changed since a watermark, so a
+    client can catch up after its event stream dropped without reloading
+    whole conversations:
+        ?since=<ISO timestamp>|cursor=<cursor>[&conversation_id=<id>]
+        -> {"conversations": [...], "messages": [...], "cursor": <cursor>,
+            "watermark": <ISO timestamp>, "has_more": bool}
+
+    Rows changed at or after `since` are returned, oldest change first, so a
+    row may be sent again on a later call; clients apply them as upserts by
+    id. Deleted conversations are included with is_deleted: true. Pass the
+    returned cursor on the next call; if has_more is true, call again right
+    away.
+    """
+    current_user_id = get_jwt_identity()
+    conversation_id = request.args.get('conversation_id', type=int)
+    try:
+        if request.args.get('cursor'):
+            conversation_cursor, message_cursor = _parse_sync_cursor(request.args['cursor'])
+        else:
+            # Timestamps are naive UTC; accept a trailing 'Z' from JavaScript clients.
+            since = datetime.fromisoformat(request.args.get('since').replace('Z', '+00:00')).replace(tzinfo=None)
+            conversation_cursor = message_cursor = (since, 0)
+    except (AttributeError, ValueError):
+        return jsonify({"message": "A valid ISO 'since' timestamp or sync 'cursor' is required."}), 400
+
+    conversation_query = _conversation_list_query(current_user_id, include_deleted=True)
+    message_query = Message.query.join(Conversation).filter(Conversation.user_id == current_user_id)
+    if conversation_id is not None:
+        conversation_query = conversation_query.filter(Conversation.id == conversation_id)
+        message_query = message_query.filter(Message.conversation_id == conversation_id)
+
+    conversations, conversation_cursor, conversations_truncated = _sync_page(conversation_query, Conversation, conversation_cursor)
+    messages, message_cursor, messages_truncated = _sync_page(message_query, Message, message_cursor)
+
+    return jsonify({
+        "conversations": [conv.to_dict() for conv in conversations],
+        "messages": [message.to_dict(request.host_url) for message in messages],
+        "cursor": ",".join(f"{at.isoformat()},{row_id}" for at, row_id in (conversation_cursor, message_cursor)),
+        "watermark": min(conversation_cursor[0], message_cursor[0]).isoformat(),
+        "has_more": conversations_truncated or messages_truncated,
+    })
 
 
 @chat_bp.route('/conversations/initiate', methods=['POST'])
@@ -66,6 +391,7 @@ def initiate_conversation():
     data = request.form
     content = data.get('content', '')
     attachment_file = request.files.get('attachment')
+    upload_id = data.get('upload_id')
     language = data.get('language')
     provider_service_id = data.get('provider_service_id')
     aspect_ratio = data.get('aspect_ratio', '16:9 - Landscape')
@@ -73,7 +399,7 @@ def initiate_conversation():
 
     if not provider_service_id:
         return jsonify({"message": "Provider Service ID is required"}), 400
-    if not content and not attachment_file:
+    if not content and not attachment_file and not upload_id:
         return jsonify({"message": "Content or attachment required"}), 400
 
     try:
@@ -85,6 +411,13 @@ def initiate_conversation():
         if user.parent_id and provider_service not in user.allowed_services:
             return jsonify({"message": "Access denied. You do not have permission to use this AI service."}), 403
 
+        # A finished resumable upload (see routes/uploads.py) stands in for a multipart attachment.
+        if upload_id and not attachment_file:
+            try:
+                attachment_file = get_upload_store().complete(upload_id, current_user_id)
+            except UploadSessionError as e:
+                return jsonify({"message": e.message}), e.status
+
         # Create all necessary database objects first
         title = (content[:30] + '...') if len(content) > 30 else (content or "New Conversation")
         new_conversation = Conversation(
@@ -107,12 +440,15 @@ def initiate_conversation():
         if attachment_file:
             if not allowed_file(attachment_file.filename):
                 return jsonify({"message": "Invalid file type"}), 400
-            file_path, unique_filename = save_file_locally(attachment_file)
+            saved = save_upload(attachment_file)
+            blob = store_upload(saved, attachment_file.content_type)
+            unique_filename = blob.storage_name
             new_attachment = Attachment(
                 file_name=secure_filename(attachment_file.filename),
                 file_type=attachment_file.content_type,
                 storage_url=unique_filename,
-                original_size_mb=(os.path.getsize(file_path)) / (1024 * 1024)
+                original_size_mb=saved.size / (1024 * 1024),
+                blob=blob
             )
             user_message.attachment = new_attachment
         else:
@@ -131,13 +467,14 @@ def initiate_conversation():
             
             # This passes all data directly to the Celery task to avoid race conditions.
             orchestrate_video_understanding.delay(
-                full_video_path=os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename),
+                video_name=unique_filename,
                 prompt=content,
                 model_id=new_conversation.ai_model_id,
                 api_key=api_key,
                 assistant_message_id=assistant_message.id,
                 conversation_id=new_conversation.id,
-                user_id=current_user_id
+                user_id=current_user_id,
+                blob_sha256=new_attachment.blob_sha256 if new_attachment else None
             )
             if attachment_file:
                 new_conversation.video_context_attachment_id = new_attachment.id
@@ -181,6 +518,7 @@ def post_message(conversation_id):
     data = request.form
     content = data.get('content', '')
     attachment_file = request.files.get('attachment')
+    upload_id = data.get('upload_id')
     language = data.get('language')
     
     # Get the service ID from the conversation, not the form, for existing chats
@@ -189,7 +527,7 @@ def post_message(conversation_id):
     
     aspect_ratio = data.get('aspect_ratio', '16:9 - Landscape')
 
-    if not content and not attachment_file:
+    if not content and not attachment_file and not upload_id:
         return jsonify({"message": "Content or attachment required"}), 400
 
     try:
@@ -198,6 +536,13 @@ def post_message(conversation_id):
         if user.parent_id and provider_service and provider_service not in user.allowed_services:
             return jsonify({"message": "Access denied. You do not have permission to use this AI service."}), 403
 
+        # A finished resumable upload (see routes/uploads.py) stands in for a multipart attachment.
+        if upload_id and not attachment_file:
+            try:
+                attachment_file = get_upload_store().complete(upload_id, current_user_id)
+            except UploadSessionError as e:
+                return jsonify({"message": e.message}), e.status
+
         # Your message and attachment creation logic is preserved
         user_message = Message(content=content, role='user', conversation_id=conversation.id)
         db.session.add(user_message)
@@ -211,12 +556,14 @@ def post_message(conversation_id):
             if not allowed_file(attachment_file.filename):
                 return jsonify({"message": "Invalid file type"}), 400
             
-            file_path, unique_filename = save_file_locally(attachment_file)
+            saved = save_upload(attachment_file)
+            blob = store_upload(saved, attachment_file.content_type)
             new_attachment = Attachment(
                 file_name=secure_filename(attachment_file.filename),
                 file_type=attachment_file.content_type,
-                storage_url=unique_filename,
-                original_size_mb=(os.path.getsize(file_path) / (1024 * 1024))
+                storage_url=blob.storage_name,
+                original_size_mb=saved.size / (1024 * 1024),
+                blob=blob
             )
             user_message.attachment = new_attachment
         else:
@@ -294,13 +641,14 @@ def post_message(conversation_id):
             if not api_key: raise ValueError("Google API key not configured.")
 
             orchestrate_video_understanding.delay(
-                full_video_path=os.path.join(current_app.config['UPLOAD_FOLDER'], video_to_use.storage_url),
+                video_name=video_to_use.storage_url,
                 prompt=content,
                 model_id=conversation.ai_model_id,
                 api_key=api_key,
                 assistant_message_id=assistant_message.id,
                 conversation_id=conversation.id,
-                user_id=current_user_id
+                user_id=current_user_id,
+                blob_sha256=video_to_use.blob_sha256
             )
             if is_video_attachment:
                 conversation.video_context_attachment_id = new_attachment.id
@@ -427,4 +775,34 @@ def generate_audio_for_message(message_id):
     generate_tts_from_message.delay(message.id)
 
     # Immediately return a 202 "Accepted" response to the frontend.
-    return jsonify({"message": "TTS generation has started."}), 202
\ No newline at end of file
+    return jsonify({"message": "TTS generation has started."}), 202
+
+
+@chat_bp.route('/messages/<int:message_id>/audio-stream', methods=['GET'])
+@jwt_required()
+def stream_message_audio(message_id):
+    """
+    Streams the audio of an assistant message as it is being generated,
+    as a progressive 'audio/mpeg' response the browser can play directly.
+    Once the buffer has expired, redirects to the saved audio file instead.
+    """
+    current_user_id = get_jwt_identity()
+    message = Message.query.join(Conversation).filter(
+        Message.id == message_id,
+        Conversation.user_id == current_user_id
+    ).first_or_404("Message not found or access denied.")
+
+    redis_client = current_app.events_redis_client
+    if not redis_client.exists(audio_stream_key(message.id)):
+        if message.attachment and message.attachment.file_type == 'audio/mpeg':
+            return redirect(url_for('chat.get_uploaded_file', filename=os.path.basename(message.attachment.storage_url)))
+        return jsonify({"message": "No audio is being generated for this message."}), 404
+
+    idle_timeout_ms = current_app.config['TTS_AUDIO_STREAM_IDLE_TIMEOUT_MS']
+    # Streaming can take a while; do not hold a database connection meanwhile.
+    db.session.remove()
+
+    response = Response(iter_audio_stream(redis_client, message_id, idle_timeout_ms=idle_timeout_ms), mimetype='audio/mpeg')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
\ No newline at end of file
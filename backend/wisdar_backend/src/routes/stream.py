@@ -1,44 +1,94 @@
 # src/routes/stream.py
 
-import redis
-from flask import Blueprint, Response, stream_with_context, session, g, current_app
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, Response, current_app, request, g, jsonify
+from gevent.queue import Empty
+
+from ..auth_utils import jwt_identity_required
+from ..database import db
+from ..services.event_bus import read_events_after
+from ..services.sse_broker import ConnectionLimitExceeded
+from ..services.sse_protocol import HEARTBEAT_FRAME, format_sse, is_valid_event_id, event_id_key
 
 # Create a Blueprint for stream routes
 stream_bp = Blueprint('stream_bp', __name__)
 
 @stream_bp.route('/events')
-@jwt_required()
+@jwt_identity_required
 def stream_events():
     """
-    Listens to a Redis Pub/Sub channel and streams events to the client.
-    This implementation uses a generator with manual flushing to ensure
-    low-latency delivery of events.
+    Streams the user's events to the client.
+    Messages arrive through the process-wide SSE broker, which shares a single
+    Redis Pub/Sub connection between all connected clients.
+
+    Reconnecting clients send the id of the last event they saw, either as the
+    standard 'Last-Event-ID' header or as a 'last_event_id' query parameter,
+    and only the events published after it are replayed.
+
+    The stream never touches the database: authentication only verifies the
+    token, and the request context is not kept alive by the generator, so an
+    open stream does not hold a pooled connection.
+
+    A heartbeat comment is written whenever the stream has been quiet for
+    SSE_HEARTBEAT_SECONDS. Streams whose writes stop completing are reaped by
+    the broker, and each user may hold at most SSE_MAX_CONNECTIONS_PER_USER
+    streams per process.
     """
-    user_id = get_jwt_identity()
-    user_channel = f'user-{user_id}'
+    user_id = g.jwt_identity
+    broker = current_app.sse_broker
+    logger = current_app.logger
+    heartbeat_seconds = current_app.config["SSE_HEARTBEAT_SECONDS"]
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
 
-    # Use the application context to get the Redis URL
-    redis_url = current_app.config["REDIS_URL"]
-    redis_client = redis.from_url(redis_url)
-    pubsub = redis_client.pubsub()
-    pubsub.subscribe(user_channel)
+    # Subscribe before reading the replay so nothing published in between is lost.
+    try:
+        client = broker.subscribe(user_id)
+    except ConnectionLimitExceeded:
+        logger.warning(f"Rejected SSE stream for user {user_id}: too many open streams.")
+        return jsonify({"message": "Too many open event streams"}), 429
 
-    current_app.logger.info(f"User {user_id} connected to SSE stream on channel '{user_channel}'.")
+    replay = []
+    if is_valid_event_id(last_event_id):
+        try:
+            replay = read_events_after(
+                current_app.events_redis_client, client.channel, last_event_id,
+                current_app.config["SSE_REPLAY_MAX_EVENTS"]
+            )
+        except Exception as e:
+            logger.error(f"Failed to read SSE replay for user {user_id}: {e}", exc_info=True)
+
+    logger.info(f"User {user_id} connected to SSE stream on channel '{client.channel}' (replaying {len(replay)} events).")
+
+    # Defensive: return any connection checked out earlier in this request.
+    db.session.remove()
 
     def generate():
         try:
-            for message in pubsub.listen():
-                if message['type'] == 'message':
-                    event_data = message['data'].decode('utf-8')
-                    yield f"data: {event_data}\n\n"
+            newest_seen = event_id_key(last_event_id) if is_valid_event_id(last_event_id) else None
+            for event_id, event_data in replay:
+                newest_seen = event_id_key(event_id)
+                yield format_sse(event_data, event_id)
+            client.touch()
+
+            while True:
+                try:
+                    event_id, event_data = client.queue.get(timeout=heartbeat_seconds)
+                except Empty:
+                    yield HEARTBEAT_FRAME
+                    client.touch()
+                    continue
+                # Skip live events that were already delivered by the replay.
+                if newest_seen is not None and is_valid_event_id(event_id) and event_id_key(event_id) <= newest_seen:
+                    continue
+                yield format_sse(event_data, event_id)
+                client.touch()
         except GeneratorExit:
-            current_app.logger.info(f"Client for user {user_id} disconnected from SSE stream.")
+            logger.info(f"Client for user {user_id} disconnected from SSE stream.")
         finally:
-            pubsub.close()
+            broker.unsubscribe(client)
 
-    # Create a streaming response, explicitly setting the correct content type
-    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    # Create a streaming response, explicitly setting the correct content type.
+    # The generator is deliberately not wrapped in stream_with_context().
+    response = Response(generate(), mimetype='text/event-stream')
     response.headers['Cache-Control'] = 'no-cache'
     response.headers['X-Accel-Buffering'] = 'no' # A hint for Nginx
     return response
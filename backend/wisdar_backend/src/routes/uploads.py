@@ -0,0 +1,102 @@
+# src/routes/uploads.py
+"""
+Resumable upload endpoints.
+
+    POST   /api/uploads               {filename, content_type, size} -> {upload_id, offset, size, chunk_size}
+    PUT    /api/uploads/<upload_id>   raw bytes with 'Content-Range: bytes <start>-<end>/<size>'
+    GET    /api/uploads/<upload_id>   -> {offset, size, complete}, to find where to resume
+    DELETE /api/uploads/<upload_id>   abandons the upload
+
+Once complete, the upload_id is sent to the chat routes in place of the
+'attachment' file. These endpoints never touch MySQL, so a slow range does not
+hold a database connection.
+"""
+
+from flask import Blueprint, jsonify, request, current_app, g
+from werkzeug.http import parse_content_range_header
+
+from ..auth_utils import jwt_identity_required
+from ..services.upload_sessions import UploadSessionStore, UploadSessionError
+from ..utils.audio_utils import allowed_file
+
+uploads_bp = Blueprint('uploads', __name__)
+
+# Suggested range size; clients may use any size up to MAX_CONTENT_LENGTH.
+RECOMMENDED_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def get_upload_store() -> UploadSessionStore:
+    return UploadSessionStore(
+        current_app.redis_client,
+        current_app.config['UPLOAD_FOLDER'],
+        ttl_seconds=current_app.config['UPLOAD_SESSION_TTL_SECONDS'],
+    )
+
+
+def _error_response(e: UploadSessionError):
+    body = {"message": e.message}
+    if e.offset is not None:
+        body["offset"] = e.offset
+    return jsonify(body), e.status
+
+
+# The upload endpoints use jwt_identity_required: chunks go to Redis and disk
+# and never touch MySQL. Sessions are bound to the token identity, and a
+# finished upload is only used through /api/chat, whose @jwt_required() user
+# lookup rejects deleted users.
+@uploads_bp.route('', methods=['POST'])
+@jwt_identity_required
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename')
+    content_type = data.get('content_type') or 'application/octet-stream'
+    size = data.get('size')
+
+    if not filename or not allowed_file(filename):
+        return jsonify({"message": "Invalid file type"}), 400
+    if not isinstance(size, int) or size < 0:
+        return jsonify({"message": "'size' must be a non-negative integer"}), 400
+    if size > current_app.config['UPLOAD_SESSION_MAX_BYTES']:
+        return jsonify({"message": "File is too large"}), 413
+
+    session = get_upload_store().create(g.jwt_identity, filename, content_type, size)
+    session['chunk_size'] = RECOMMENDED_CHUNK_SIZE
+    return jsonify(session), 201
+
+
+@uploads_bp.route('/<upload_id>', methods=['GET'])
+@jwt_identity_required
+def get_upload_status(upload_id):
+    try:
+        return jsonify(get_upload_store().status(upload_id, g.jwt_identity))
+    except UploadSessionError as e:
+        return _error_response(e)
+
+
+@uploads_bp.route('/<upload_id>', methods=['PUT'])
+@jwt_identity_required
+def put_upload_range(upload_id):
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None or content_range.units != 'bytes' or content_range.length is None:
+        return jsonify({"message": "A 'Content-Range: bytes <start>-<end>/<size>' header is required"}), 400
+    length = content_range.stop - content_range.start
+    if request.content_length is not None and request.content_length != length:
+        return jsonify({"message": "Content-Length does not match Content-Range"}), 400
+
+    try:
+        result = get_upload_store().write_range(
+            upload_id, g.jwt_identity, content_range.start, content_range.length, request.stream, length
+        )
+    except UploadSessionError as e:
+        return _error_response(e)
+    return jsonify(result)
+
+
+@uploads_bp.route('/<upload_id>', methods=['DELETE'])
+@jwt_identity_required
+def abort_upload(upload_id):
+    try:
+        get_upload_store().abort(upload_id, g.jwt_identity)
+    except UploadSessionError as e:
+        return _error_response(e)
+    return jsonify({"message": "Upload aborted"})
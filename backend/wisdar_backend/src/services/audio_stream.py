@@ -0,0 +1,91 @@
+# src/services/audio_stream.py
+"""
+Short-lived binary audio buffers for progressive playback.
+
+A worker appends raw MP3 chunks to a per-message Redis Stream and the web app
+relays them to the browser as a chunked 'audio/mpeg' response. The audio
+therefore never goes through Pub/Sub or the SSE stream, and is not base64
+encoded along the way.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Field names of the Stream entries: the start marker, a chunk of audio or the end marker.
+_START_FIELD = b'start'
+_CHUNK_FIELD = b'chunk'
+_END_FIELD = b'end'
+
+
+def audio_stream_key(message_id) -> str:
+    """Returns the key of the Redis Stream that buffers a message's audio."""
+    return f'tts-audio:{message_id}'
+
+
+def audio_stream_url(message_id) -> str:
+    """Returns the path the browser plays a message's audio from."""
+    return f'/api/chat/messages/{message_id}/audio-stream'
+
+
+class AudioStreamWriter:
+    """
+    Appends audio chunks for one message. Every write refreshes the key's
+    expiry, so an abandoned buffer disappears `ttl_seconds` after the last chunk.
+    Call open() before telling clients where to play from, so the buffer
+    exists before the first chunk does, and close() once all audio has been
+    written so readers stop waiting.
+    """
+
+    def __init__(self, redis_client, message_id, ttl_seconds: int = 300):
+        self.redis_client = redis_client
+        self.key = audio_stream_key(message_id)
+        self.ttl_seconds = ttl_seconds
+        self.bytes_written = 0
+
+    def _append(self, fields: dict):
+        pipe = self.redis_client.pipeline()
+        pipe.xadd(self.key, fields)
+        pipe.expire(self.key, self.ttl_seconds)
+        pipe.execute()
+
+    def open(self):
+        """Creates the buffer with a start marker, which readers skip."""
+        self._append({_START_FIELD: ''})
+
+    def write(self, chunk: bytes):
+        if not chunk:
+            return
+        self._append({_CHUNK_FIELD: chunk})
+        self.bytes_written += len(chunk)
+
+    def close(self, error: str = None):
+        """Marks the buffer as complete, optionally recording why it stopped early."""
+        self._append({_END_FIELD: error or ''})
+
+
+def iter_audio_stream(redis_client, message_id, block_ms: int = 5000, idle_timeout_ms: int = 30000):
+    """
+    Yields the audio chunks of a message from the start of its buffer until
+    the end marker. Gives up if no chunk arrives for `idle_timeout_ms`, e.g.
+    because the worker died before closing the buffer.
+    """
+    key = audio_stream_key(message_id)
+    last_id = '0'
+    idle_ms = 0
+    while True:
+        response = redis_client.xread({key: last_id}, count=64, block=block_ms)
+        if not response:
+            idle_ms += block_ms
+            if idle_ms >= idle_timeout_ms:
+                logger.warning(f"Audio stream {key} timed out waiting for data.")
+                return
+            continue
+
+        idle_ms = 0
+        for entry_id, fields in response[0][1]:
+            last_id = entry_id
+            if _END_FIELD in fields:
+                return
+            if _CHUNK_FIELD in fields:
+                yield fields[_CHUNK_FIELD]
@@ -0,0 +1,287 @@
+# src/services/context_builder.py
+"""
+Builds the message history sent to the AI provider for a chat turn.
+
+Instead of loading the whole conversation, messages are read newest-first,
+in small batches and only the columns needed, until the model's token budget
+is filled. The cost of a turn therefore depends on the budget, not on how
+long the conversation is. Messages come from the Redis copy kept by
+services/context_cache.py when there is one, so a turn normally needs no
+MySQL query for its history.
+
+Once a conversation has a rolling summary (services/conversation_summarizer.py),
+the context is the summary followed by the messages after it, and the
+builder reports when the unsummarized tail has grown enough for the next
+summarization run.
+
+Token counts are estimates. The estimator is pluggable per provider
+(register_token_estimator); OpenAI models use tiktoken when it is installed,
+everything else a characters-per-token heuristic.
+"""
+
+import logging
+import time
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from src.database import db
+from src.models.chat import Message
+from src.models.conversation_summary import ConversationSummary
+from src.models.provider import ProviderService
+from src.services import context_cache
+from src.services.prompt_cache import CACHE_FLAG
+
+try:
+    import tiktoken  # Optional: exact token counts for OpenAI models.
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per query while walking back through the history.
+BATCH_SIZE = 50
+# Role markers and separators the providers add around every message.
+MESSAGE_OVERHEAD_TOKENS = 4
+# Rough average for English text; errs on the high side for code and most other languages.
+CHARS_PER_TOKEN = 4
+
+# Per-process cache of model budgets: (provider_id, model_id) -> (budget, checked_at).
+BUDGET_CACHE_SECONDS = 60
+_budget_cache = {}
+
+# How the summary is put in front of the recent messages.
+SUMMARY_PREFIX = "Summary of the earlier part of this conversation:\n\n"
+
+BuiltContext = namedtuple('BuiltContext', ['messages', 'tokens', 'truncated', 'needs_summary'])
+
+
+def estimate_tokens(text: str) -> int:
+    """Heuristic token count used when no exact tokenizer is available."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _openai_estimator(model_id: str):
+    if tiktoken is None:
+        return estimate_tokens
+    try:
+        encoding = tiktoken.encoding_for_model(model_id)
+    except KeyError:
+        encoding = tiktoken.get_encoding('o200k_base')
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+# provider_id -> factory(model_id) returning a function text -> token count.
+_TOKEN_ESTIMATORS = {'openai': _openai_estimator}
+
+
+def register_token_estimator(provider_id: str, factory):
+    """Plugs in a token counter for a provider: factory(model_id) -> (text -> int)."""
+    _TOKEN_ESTIMATORS[provider_id] = factory
+
+
+def get_token_estimator(provider_id: str, model_id: str):
+    factory = _TOKEN_ESTIMATORS.get(provider_id)
+    return factory(model_id) if factory else estimate_tokens
+
+
+def get_context_budget(provider_id: str, model_id: str) -> int:
+    """
+    Prompt-token budget for a model: the 'context_token_budget' capability of
+    its provider service when the admin set one, else CONTEXT_TOKEN_BUDGET.
+    Looked up at most once per BUDGET_CACHE_SECONDS per process.
+    """
+    now = time.monotonic()
+    cached = _budget_cache.get((provider_id, model_id))
+    if cached is not None and now - cached[1] < BUDGET_CACHE_SECONDS:
+        return cached[0]
+    capabilities = db.session.query(ProviderService.capabilities).filter_by(
+        provider_id=provider_id, model_api_id=model_id
+    ).limit(1).scalar()
+    budget = (capabilities or {}).get('context_token_budget')
+    budget = int(budget) if budget else current_app.config['CONTEXT_TOKEN_BUDGET']
+    _budget_cache[(provider_id, model_id)] = (budget, now)
+    return budget
+
+
+def _history_batches(conversation_id: int, exclude_message_id: int = None, cursor=None):
+    """
+    Yields (role, content, created_at, id) rows newest-first, one batch at a
+    time, starting below the (created_at, id) `cursor` if given.
+    """
+    query = db.session.query(Message.role, Message.content, Message.created_at, Message.id).filter(
+        Message.conversation_id == conversation_id,
+        Message.role != 'system',
+        Message.content.isnot(None),
+        Message.content != '',
+    )
+    if exclude_message_id is not None:
+        query = query.filter(Message.id != exclude_message_id)
+    query = query.order_by(Message.created_at.desc(), Message.id.desc())
+
+    while True:
+        page = query
+        if cursor is not None:
+            # Keyset pagination on (created_at, id), served by ix_messages_conversation_id_created_at_id.
+            cursor_created_at, cursor_id = cursor
+            page = page.filter(or_(
+                Message.created_at < cursor_created_at,
+                and_(Message.created_at == cursor_created_at, Message.id < cursor_id),
+            ))
+        rows = page.limit(BATCH_SIZE).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < BATCH_SIZE:
+            return
+        cursor = (rows[-1].created_at, rows[-1].id)
+
+
+def _fill_cache(redis_client, conversation_id: int):
+    """
+    Loads the newest CONTEXT_CACHE_MAX_MESSAGES messages from MySQL into the
+    cache and returns them as cache entries, oldest first.
+    """
+    limit = current_app.config['CONTEXT_CACHE_MAX_MESSAGES']
+    generation = context_cache.get_generation(redis_client, conversation_id)
+    entries = []
+    for rows in _history_batches(conversation_id):
+        for row in rows[:limit - len(entries)]:
+            entries.append(context_cache.make_entry(
+                row.id, row.role, row.content, row.created_at, estimate_tokens(row.content)
+            ))
+        if len(entries) >= limit:
+            break
+    entries.reverse()
+    context_cache.fill(redis_client, conversation_id, generation, entries)
+    return entries
+
+
+def _cached_history(conversation_id: int):
+    """
+    Returns (length, entries newest-first) from the Redis cache, filling it
+    first if needed, or None if Redis cannot be used.
+    """
+    redis_client = current_app.redis_client
+    try:
+        cached = context_cache.iter_cached(redis_client, conversation_id)
+        if cached is None:
+            entries = _fill_cache(redis_client, conversation_id)
+            cached = (len(entries), reversed(entries))
+        return cached
+    except Exception as e:
+        logger.warning(f"Chat context cache unavailable for conversation {conversation_id}, reading MySQL: {e}")
+        return None
+
+
+def _latest_summary(conversation_id: int):
+    """
+    Returns the conversation's newest summary as a dict (content, tokens, and
+    the ts/id of the last message it covers), or None. Cached in Redis.
+    """
+    redis_client = current_app.redis_client
+    try:
+        cached = context_cache.get_cached_summary(redis_client, conversation_id)
+        if cached is not context_cache.MISSING:
+            return cached
+    except Exception as e:
+        logger.warning(f"Summary cache unavailable for conversation {conversation_id}: {e}")
+        redis_client = None
+
+    summary = ConversationSummary.latest_for(conversation_id)
+    entry = context_cache.make_summary_entry(summary) if summary else None
+    if redis_client is not None:
+        try:
+            context_cache.cache_summary(redis_client, conversation_id, entry)
+        except Exception as e:
+            logger.warning(f"Could not cache the summary of conversation {conversation_id}: {e}")
+    return entry
+
+
+def _history_rows(conversation_id: int, count_tokens, exclude_message_id: int = None):
+    """
+    Yields ((created_at, id), role, content, tokens) newest-first, from the
+    cache and then, if it runs out, from MySQL.
+    """
+    cursor = None
+    cached = _cached_history(conversation_id)
+    if cached is not None:
+        length, entries = cached
+        last = None
+        try:
+            for last in entries:
+                if last['id'] == exclude_message_id:
+                    continue
+                tokens = last['tokens'] if count_tokens is estimate_tokens else count_tokens(last['content'])
+                key = (context_cache.timestamp_to_datetime(last['ts']), last['id'])
+                yield key, last['role'], last['content'], tokens
+        except Exception as e:
+            logger.warning(f"Reading the cached context of conversation {conversation_id} failed, continuing from MySQL: {e}")
+        else:
+            if length < current_app.config['CONTEXT_CACHE_MAX_MESSAGES']:
+                return  # The cache holds the whole history.
+        if last is not None:
+            cursor = (context_cache.timestamp_to_datetime(last['ts']), last['id'])
+
+    for rows in _history_batches(conversation_id, exclude_message_id, cursor):
+        for row in rows:
+            yield (row.created_at, row.id), row.role, row.content, count_tokens(row.content)
+
+
+def build_context(conversation_id: int, budget_tokens: int, count_tokens=estimate_tokens,
+                  exclude_message_id: int = None, summary_trigger_tokens: int = None) -> BuiltContext:
+    """
+    Returns the context for a conversation as provider-ready {"role",
+    "content"} dicts, oldest first: its latest summary, if any, followed by
+    the most recent messages after it that fit in `budget_tokens`.
+
+    The newest message is always included, even on its own over budget. The
+    history starts with a user turn, as Anthropic and Gemini require.
+    `needs_summary` is set when the messages after the summary did not all
+    fit, or came to at least `summary_trigger_tokens`.
+    """
+    summary = _latest_summary(conversation_id)
+    boundary, summary_cost = None, 0
+    if summary:
+        boundary = (context_cache.timestamp_to_datetime(summary['ts']), summary['id'])
+        summary_text = SUMMARY_PREFIX + summary['content']
+        summary_cost = count_tokens(summary_text) + MESSAGE_OVERHEAD_TOKENS
+    used = summary_cost
+
+    selected, truncated = [], False
+    for key, role, content, tokens in _history_rows(conversation_id, count_tokens, exclude_message_id):
+        if boundary is not None and key <= boundary:
+            break  # Covered by the summary.
+        cost = tokens + MESSAGE_OVERHEAD_TOKENS
+        if selected and used + cost > budget_tokens:
+            truncated = True
+            break
+        selected.append({"role": role, "content": content})
+        used += cost
+
+    selected.reverse()
+    if summary:
+        # The summary is a user turn, so the messages after it may start with either role.
+        # It only changes when the conversation is summarized again: a cacheable prefix.
+        selected.insert(0, {"role": "user", "content": summary_text, CACHE_FLAG: True})
+    while truncated and selected and selected[0]["role"] != 'user':
+        used -= count_tokens(selected[0]["content"]) + MESSAGE_OVERHEAD_TOKENS
+        selected.pop(0)
+
+    needs_summary = truncated or (summary_trigger_tokens is not None and used - summary_cost >= summary_trigger_tokens)
+    if truncated:
+        logger.info(f"Context for conversation {conversation_id}: {len(selected)} messages, ~{used}/{budget_tokens} tokens.")
+    return BuiltContext(selected, used, truncated, needs_summary)
+
+
+def build_context_for_model(conversation_id: int, provider_id: str, model_id: str,
+                            exclude_message_id: int = None) -> BuiltContext:
+    """build_context() with the budget and token estimator of the given model."""
+    return build_context(
+        conversation_id,
+        get_context_budget(provider_id, model_id),
+        count_tokens=get_token_estimator(provider_id, model_id),
+        exclude_message_id=exclude_message_id,
+        summary_trigger_tokens=current_app.config['CONVERSATION_SUMMARY_TRIGGER_TOKENS'],
+    )
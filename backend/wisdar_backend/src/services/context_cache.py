@@ -0,0 +1,283 @@
+# src/services/context_cache.py
+"""
+Redis cache of the chat history used to build AI context.
+
+Each conversation has a Redis list holding its most recent messages (role,
+content, an estimated token count and the sort key), oldest first, as
+JSON entries. The context builder reads it newest-first, so a chat turn
+normally needs no MySQL query for its history.
+
+The cache is kept in step by session hooks:
+
+- a message that becomes COMPLETE is appended after commit, if the list
+  exists and the message sorts after its last entry;
+- edits, deletes and failures drop the list, and the next reader refills it
+  from MySQL.
+
+Every change also bumps a generation counter, and a fill only succeeds if
+the counter did not move while the rows were read, so a fill racing with a
+commit can never store a stale list.
+
+The list holds at most CONTEXT_CACHE_MAX_MESSAGES entries. A shorter list is
+the whole history; a full one may have been trimmed, and readers that need
+more continue from MySQL.
+
+The conversation's latest rolling summary, or the fact that it has none, is
+cached next to the list and replaced by the summarization task.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from ..models.chat import Conversation, Message, MessageStatus
+
+logger = logging.getLogger(__name__)
+
+# Lists expire an hour after the last change (active conversations append every
+# turn); a missing list is simply refilled.
+CONTEXT_CACHE_TTL_SECONDS = 3600
+# Entries fetched per LRANGE while reading newest-first.
+READ_BATCH_SIZE = 50
+
+_EPOCH = datetime(1970, 1, 1)
+
+# get_cached_summary() result when Redis does not know whether there is a summary.
+MISSING = object()
+
+# Appends an entry if the list exists and the entry sorts after the last one;
+# otherwise the list no longer matches MySQL and is dropped.
+_APPEND_LUA = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local last = redis.call('LINDEX', KEYS[1], -1)
+if last then
+    local entry = cjson.decode(last)
+    local ts, id = tonumber(ARGV[2]), tonumber(ARGV[3])
+    if entry.ts > ts or (entry.ts == ts and entry.id >= id) then
+        redis.call('DEL', KEYS[1])
+        return 0
+    end
+end
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], -tonumber(ARGV[4]), -1)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+# Replaces the list with freshly read entries, unless a commit bumped the
+# generation since the reader started.
+_FILL_LUA = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+if #ARGV > 2 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+
+def context_key(conversation_id) -> str:
+    # The hash tag keeps the list and its generation in one Redis Cluster slot.
+    return f'chat-context:{{conversation:{conversation_id}}}'
+
+
+def generation_key(conversation_id) -> str:
+    return f'{context_key(conversation_id)}:gen'
+
+
+def summary_key(conversation_id) -> str:
+    return f'{context_key(conversation_id)}:summary'
+
+
+def _timestamp(created_at: datetime) -> int:
+    # Microseconds since the epoch: exact, and comparable inside Lua.
+    return (created_at - _EPOCH) // timedelta(microseconds=1)
+
+
+def timestamp_to_datetime(ts: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=ts)
+
+
+def make_entry(message_id: int, role: str, content: str, created_at: datetime, tokens: int) -> dict:
+    return {'id': message_id, 'role': role, 'content': content, 'tokens': tokens, 'ts': _timestamp(created_at)}
+
+
+def make_summary_entry(summary) -> dict:
+    """Cache form of a ConversationSummary; ts/id are the last message it covers."""
+    return {
+        'content': summary.content,
+        'tokens': summary.token_estimate,
+        'ts': _timestamp(summary.through_created_at),
+        'id': summary.through_message_id or 0,
+    }
+
+
+def _get_script(redis_client, attr: str, source: str):
+    script = getattr(redis_client, attr, None)
+    if script is None:
+        script = redis_client.register_script(source)
+        setattr(redis_client, attr, script)
+    return script
+
+
+# ==============================================================================
+#  READING AND FILLING
+# ==============================================================================
+def get_generation(redis_client, conversation_id) -> str:
+    """Read before loading rows from MySQL and pass to fill()."""
+    value = redis_client.get(generation_key(conversation_id))
+    if value is None:
+        return '0'
+    return value.decode('ascii') if isinstance(value, bytes) else str(value)
+
+
+def fill(redis_client, conversation_id, generation: str, entries: list) -> bool:
+    """Stores `entries` (oldest first) as the cached history. Returns False if it lost a race."""
+    script = _get_script(redis_client, '_context_fill_script', _FILL_LUA)
+    payload = [json.dumps(entry, separators=(',', ':')) for entry in entries]
+    stored = script(
+        keys=[context_key(conversation_id), generation_key(conversation_id)],
+        args=[generation, CONTEXT_CACHE_TTL_SECONDS, *payload],
+    )
+    return bool(stored)
+
+
+def get_cached_summary(redis_client, conversation_id):
+    """Returns the cached summary entry, None if there is no summary, or MISSING."""
+    raw = redis_client.get(summary_key(conversation_id))
+    if raw is None:
+        return MISSING
+    return json.loads(raw) or None
+
+
+def cache_summary(redis_client, conversation_id, entry):
+    """Stores the latest summary entry, or None to record that there is none."""
+    redis_client.set(summary_key(conversation_id), json.dumps(entry or {}), ex=CONTEXT_CACHE_TTL_SECONDS)
+
+
+def iter_cached(redis_client, conversation_id):
+    """
+    Returns (length, iterator of entries newest-first), or None if the
+    conversation has no cached history.
+    """
+    key = context_key(conversation_id)
+    length = redis_client.llen(key)
+    if not length:
+        return None
+
+    def _entries():
+        end = -1
+        while True:
+            batch = redis_client.lrange(key, end - READ_BATCH_SIZE + 1, end)
+            for raw in reversed(batch):
+                yield json.loads(raw)
+            if len(batch) < READ_BATCH_SIZE:
+                return
+            end -= READ_BATCH_SIZE
+
+    return length, _entries()
+
+
+# ==============================================================================
+#  KEEPING IN STEP ON COMMIT
+# ==============================================================================
+def _changed(obj, *attributes) -> bool:
+    return any(get_history(obj, name).added for name in attributes)
+
+
+def _collect_changes(session):
+    """Sorts the flushed messages into cache appends and invalidations."""
+    changes = session.info.setdefault('context_cache_changes', {'append': {}, 'invalidate': set()})
+    completed_ids, stale_ids = set(), set()
+
+    for obj in session.new:
+        if isinstance(obj, Message):
+            completed_ids.add(obj.id)
+    for obj in session.dirty:
+        if not isinstance(obj, Message):
+            continue
+        status = get_history(obj, 'status').added
+        if status and status[-1] in (MessageStatus.COMPLETE, MessageStatus.FAILED):
+            completed_ids.add(obj.id)
+        elif _changed(obj, 'content', 'role', 'conversation_id', 'created_at'):
+            # Edited or moved: the cached copy may no longer match.
+            stale_ids.add(obj.id)
+            changes['invalidate'].add(obj.__dict__.get('conversation_id'))
+    for obj in session.deleted:
+        if isinstance(obj, Message):
+            changes['invalidate'].add(obj.__dict__.get('conversation_id'))
+        elif isinstance(obj, Conversation):
+            changes['invalidate'].add(obj.id)
+            changes.setdefault('forget_summary', set()).add(obj.id)
+
+    if completed_ids or stale_ids:
+        # Read back what this flush wrote, including columns expired on the objects.
+        rows = session.connection().execute(
+            select(Message.id, Message.conversation_id, Message.role, Message.content,
+                   Message.status, Message.created_at).where(Message.id.in_(completed_ids | stale_ids))
+        )
+        for row in rows:
+            in_history = row.role != 'system' and bool(row.content)
+            if row.id not in stale_ids and row.status == MessageStatus.COMPLETE and in_history and row.created_at:
+                changes['append'][row.id] = (row.conversation_id, row.role, row.content, row.created_at)
+            elif row.id in stale_ids or row.status == MessageStatus.FAILED or in_history:
+                # Failed, edited, or in the history while still in progress (the
+                # builder reads those from MySQL too): refill on the next turn.
+                changes['invalidate'].add(row.conversation_id)
+    changes['invalidate'].discard(None)
+
+
+def register_context_cache_hooks(app):
+    """Appends completed messages to, and drops stale, cached histories after every commit."""
+    from .context_builder import estimate_tokens
+
+    @event.listens_for(Session, 'after_flush')
+    def _after_flush(session, flush_context):
+        try:
+            _collect_changes(session)
+        except Exception as e:
+            logger.warning(f"Could not collect context cache changes: {e}")
+
+    @event.listens_for(Session, 'after_commit')
+    def _after_commit(session):
+        changes = session.info.pop('context_cache_changes', None)
+        if not changes or not (changes['append'] or changes['invalidate']):
+            return
+        try:
+            redis_client = app.redis_client
+            append = _get_script(redis_client, '_context_append_script', _APPEND_LUA)
+            pipe = redis_client.pipeline(transaction=False)
+            appends = sorted(changes['append'].items(), key=lambda item: (item[1][3], item[0]))
+            for message_id, (conversation_id, role, content, created_at) in appends:
+                entry = make_entry(message_id, role, content, created_at, estimate_tokens(content))
+                append(
+                    keys=[context_key(conversation_id), generation_key(conversation_id)],
+                    args=[json.dumps(entry, separators=(',', ':')), entry['ts'], message_id,
+                          app.config['CONTEXT_CACHE_MAX_MESSAGES'], CONTEXT_CACHE_TTL_SECONDS],
+                    client=pipe,
+                )
+            # Invalidations go last so they win over an append in the same commit.
+            for conversation_id in changes['invalidate']:
+                pipe.incr(generation_key(conversation_id))
+                pipe.expire(generation_key(conversation_id), CONTEXT_CACHE_TTL_SECONDS)
+                pipe.delete(context_key(conversation_id))
+            for conversation_id in changes.get('forget_summary', ()):
+                pipe.delete(summary_key(conversation_id))
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not update cached chat contexts: {e}")
+
+    @event.listens_for(Session, 'after_rollback')
+    def _after_rollback(session):
+        session.info.pop('context_cache_changes', None)
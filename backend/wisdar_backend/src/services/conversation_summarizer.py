@@ -0,0 +1,178 @@
+# src/services/conversation_summarizer.py
+"""
+Rolling summarization of long conversations.
+
+When the messages after a conversation's latest summary no longer fit the
+context budget, or pass CONVERSATION_SUMMARY_TRIGGER_TOKENS, the context
+builder asks for a run of summarize_conversation_task. A run leaves the newest
+CONVERSATION_SUMMARY_KEEP_TOKENS of messages verbatim and folds everything
+older into the summary, oldest first, in segments of at most
+CONVERSATION_SUMMARY_SEGMENT_TOKENS. Each segment produces a new
+ConversationSummary row that includes the previous one, so the chat turn
+only ever needs the newest row plus the messages after it.
+
+Runs happen in Celery, off the request path; a Redis lock keeps a single run
+per conversation queued or in progress.
+"""
+
+import logging
+
+from flask import current_app
+from sqlalchemy import and_, or_
+
+from src.database import db
+from src.models.chat import Message, MessageStatus
+from src.models.conversation_summary import ConversationSummary
+from src.services import context_cache
+from src.services.context_builder import estimate_tokens, CHARS_PER_TOKEN
+from src.utils.ai_integration import summarize_conversation_segment
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per query.
+BATCH_SIZE = 100
+# A run that dies without releasing its lock blocks new runs at most this long.
+SUMMARY_LOCK_SECONDS = 15 * 60
+
+
+def _lock_key(conversation_id) -> str:
+    return f'conversation-summary-lock:{conversation_id}'
+
+
+def claim_summary_run(conversation_id: int) -> bool:
+    """True if the caller should queue a run (none is queued or running)."""
+    try:
+        return bool(current_app.redis_client.set(_lock_key(conversation_id), 1, nx=True, ex=SUMMARY_LOCK_SECONDS))
+    except Exception as e:
+        logger.warning(f"Could not claim a summary run for conversation {conversation_id}: {e}")
+        return False
+
+
+def release_summary_run(conversation_id: int):
+    try:
+        current_app.redis_client.delete(_lock_key(conversation_id))
+    except Exception as e:
+        logger.warning(f"Could not release the summary lock of conversation {conversation_id}: {e}")
+
+
+def _messages(conversation_id: int):
+    """The messages a summary is made of: the chat history, without failures."""
+    return db.session.query(Message.id, Message.role, Message.content, Message.created_at).filter(
+        Message.conversation_id == conversation_id,
+        Message.role != 'system',
+        Message.status != MessageStatus.FAILED,
+        Message.content.isnot(None),
+        Message.content != '',
+    )
+
+
+def _after(query, key):
+    created_at, message_id = key
+    return query.filter(or_(
+        Message.created_at > created_at,
+        and_(Message.created_at == created_at, Message.id > message_id),
+    ))
+
+
+def _before(query, key):
+    created_at, message_id = key
+    return query.filter(or_(
+        Message.created_at < created_at,
+        and_(Message.created_at == created_at, Message.id < message_id),
+    ))
+
+
+def _tail_start(conversation_id: int, boundary, keep_tokens: int):
+    """
+    Returns the (created_at, id) of the oldest message left verbatim, or None
+    if everything after `boundary` fits in `keep_tokens`.
+    """
+    query = _messages(conversation_id).order_by(Message.created_at.desc(), Message.id.desc())
+    if boundary is not None:
+        query = _after(query, boundary)
+    kept, cursor = 0, None
+    while True:
+        page = _before(query, cursor) if cursor is not None else query
+        rows = page.limit(BATCH_SIZE).all()
+        for row in rows:
+            kept += estimate_tokens(row.content)
+            cursor = (row.created_at, row.id)
+            if kept >= keep_tokens:
+                return cursor
+        if len(rows) < BATCH_SIZE:
+            return None
+
+
+def _segments(conversation_id: int, boundary, tail_start, segment_tokens: int):
+    """Yields lists of rows, oldest first, between `boundary` and `tail_start`, each within `segment_tokens`."""
+    query = _before(_messages(conversation_id), tail_start).order_by(Message.created_at.asc(), Message.id.asc())
+    segment, size, cursor = [], 0, boundary
+    while True:
+        page = _after(query, cursor) if cursor is not None else query
+        rows = page.limit(BATCH_SIZE).all()
+        for row in rows:
+            tokens = min(estimate_tokens(row.content), segment_tokens)
+            if segment and size + tokens > segment_tokens:
+                yield segment
+                segment, size = [], 0
+            segment.append(row)
+            size += tokens
+            cursor = (row.created_at, row.id)
+        if len(rows) < BATCH_SIZE:
+            break
+    if segment:
+        yield segment
+
+
+def _transcript(rows, segment_tokens: int) -> str:
+    max_chars = segment_tokens * CHARS_PER_TOKEN
+    return "\n\n".join(
+        f"{'User' if row.role == 'user' else 'Assistant'}: {row.content[:max_chars]}" for row in rows
+    )
+
+
+def summarize_conversation(conversation_id: int) -> int:
+    """
+    Brings the conversation's rolling summary up to date. Returns the number
+    of summaries written (0 if the unsummarized part is still short).
+    """
+    config = current_app.config
+    segment_tokens = config['CONVERSATION_SUMMARY_SEGMENT_TOKENS']
+
+    latest = ConversationSummary.latest_for(conversation_id)
+    boundary = (latest.through_created_at, latest.through_message_id or 0) if latest else None
+    tail_start = _tail_start(conversation_id, boundary, config['CONVERSATION_SUMMARY_KEEP_TOKENS'])
+
+    written = 0
+    previous = latest
+    segments = _segments(conversation_id, boundary, tail_start, segment_tokens) if tail_start else ()
+    for segment in segments:
+        content = summarize_conversation_segment(
+            previous.content if previous else None,
+            _transcript(segment, segment_tokens),
+            model_id=config['CONVERSATION_SUMMARY_MODEL'],
+            max_tokens=config['CONVERSATION_SUMMARY_MAX_TOKENS'],
+        )
+        last = segment[-1]
+        previous = ConversationSummary(
+            conversation_id=conversation_id,
+            content=content,
+            through_message_id=last.id,
+            through_created_at=last.created_at,
+            message_count=(previous.message_count if previous else 0) + len(segment),
+            token_estimate=estimate_tokens(content),
+        )
+        db.session.add(previous)
+        # Commit each step so a failure later in the run keeps the progress made.
+        db.session.commit()
+        written += 1
+
+    if previous is not None:
+        # Also on a run with nothing to do: a reader may have cached an older summary.
+        try:
+            context_cache.cache_summary(current_app.redis_client, conversation_id, context_cache.make_summary_entry(previous))
+        except Exception as e:
+            logger.warning(f"Could not cache the summary of conversation {conversation_id}: {e}")
+    if written:
+        logger.info(f"Conversation {conversation_id}: {written} summary step(s), {previous.message_count} messages summarized.")
+    return written
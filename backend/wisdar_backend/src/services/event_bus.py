@@ -0,0 +1,178 @@
+# src/services/event_bus.py
+"""
+The publishing side of the real-time event pipeline.
+
+Every event is appended to a capped, per-user Redis Stream (so reconnecting
+clients can replay what they missed) and published on the user's Pub/Sub
+channel in the same round-trip. The Stream entry id doubles as the SSE
+event id. With SSE_SHARDED_PUBSUB enabled the event is sent with SPUBLISH, so
+on Redis Cluster it only reaches the shard that owns the user's channel.
+
+Events are encoded once, into the envelope defined in sse_protocol, and the
+SSE tier relays those bytes without re-wrapping them.
+
+Intermediate events (token chunks, progress updates) are only worth sending
+to someone who is watching, so they are dropped for users with no open SSE
+stream. Final-state events are always stored and published; the results
+themselves are persisted in the database either way.
+"""
+
+import logging
+import time
+
+from flask import current_app
+
+from .sse_protocol import encode_event, event_stream_key, presence_key
+
+logger = logging.getLogger(__name__)
+
+# XADD + PUBLISH (or SPUBLISH) in one atomic round-trip. The published message
+# is prefixed with the new Stream id so live and replayed events share the same ids.
+_APPEND_AND_PUBLISH_LUA = """
+local event_id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[1], '*', 'data', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call(ARGV[5], ARGV[4], event_id .. ' ' .. ARGV[2])
+return event_id
+"""
+
+
+# Events that only matter while the user is watching. Everything else is a
+# final state (complete, failed, credits...) and is always delivered.
+TRANSIENT_EVENT_TYPES = frozenset({
+    'stream_chunk',
+    'video_progress_update',
+    'audio_extraction_started',
+})
+
+# channel -> (is_online, checked_at). Per-process, so a worker looks presence
+# up at most once per SSE_PRESENCE_CACHE_SECONDS for each user.
+_presence_cache = {}
+
+
+def is_channel_online(channel: str) -> bool:
+    """
+    True if any SSE process currently holds a stream for the channel.
+    Fails open: if Redis cannot be reached the user is assumed to be online.
+    """
+    now = time.monotonic()
+    cached = _presence_cache.get(channel)
+    if cached is not None and now - cached[1] < current_app.config["SSE_PRESENCE_CACHE_SECONDS"]:
+        return cached[0]
+    try:
+        online = bool(current_app.events_redis_client.exists(presence_key(channel)))
+    except Exception as e:
+        logger.warning(f"Presence lookup failed for {channel}, assuming online: {e}")
+        return True
+    _presence_cache[channel] = (online, now)
+    return online
+
+
+def _get_append_script(redis_client):
+    script = getattr(redis_client, '_sse_append_script', None)
+    if script is None:
+        script = redis_client.register_script(_APPEND_AND_PUBLISH_LUA)
+        redis_client._sse_append_script = script
+    return script
+
+
+def publish_event(channel: str, event_data: dict, event_name: str):
+    """
+    Encodes an SSE event, appends it to the channel's replay Stream and
+    publishes it to connected clients. Returns the event id, or None on failure
+    or if a transient event was skipped because the user is offline.
+    """
+    try:
+        if event_name in TRANSIENT_EVENT_TYPES and not is_channel_online(channel):
+            return None
+
+        formatted_event = encode_event(event_name, event_data, current_app.config["SSE_WIRE_FORMAT"])
+
+        redis_client = current_app.events_redis_client
+        event_id = _get_append_script(redis_client)(
+            keys=[event_stream_key(channel)],
+            args=[
+                current_app.config["SSE_REPLAY_MAXLEN"],
+                formatted_event,
+                current_app.config["SSE_REPLAY_TTL_SECONDS"],
+                channel,
+                'SPUBLISH' if current_app.config["SSE_SHARDED_PUBSUB"] else 'PUBLISH',
+            ],
+        )
+        return event_id.decode('utf-8') if isinstance(event_id, bytes) else event_id
+    except Exception as e:
+        logger.error(f"Failed to publish SSE event '{event_name}' to {channel}: {e}", exc_info=True)
+        return None
+
+
+def read_events_after(redis_client, channel: str, last_event_id: str, limit: int) -> list:
+    """
+    Returns up to `limit` (event_id, payload) pairs stored after `last_event_id`,
+    oldest first. Used to replay missed events when a client reconnects.
+    """
+    entries = redis_client.xrange(event_stream_key(channel), min=f"({last_event_id}", max='+', count=limit)
+    replay = []
+    for entry_id, fields in entries:
+        if isinstance(entry_id, bytes):
+            entry_id = entry_id.decode('utf-8')
+        replay.append((entry_id, fields[b'data']))
+    return replay
+
+
+# ==============================================================================
+#  STREAM CHUNK COALESCING
+# ==============================================================================
+def get_chunk_coalescing_settings(service_id: str = None) -> dict:
+    """Returns the chunk flush settings for a service, falling back to the defaults."""
+    settings = current_app.config["SSE_CHUNK_COALESCING"]
+    merged = dict(settings["default"])
+    merged.update(settings.get(service_id, {}))
+    return merged
+
+
+class StreamChunkCoalescer:
+    """
+    Buffers the 'stream_chunk' text of a single message and publishes it in
+    batches. Limits are checked as chunks arrive: the buffer is published once
+    `flush_interval_ms` have passed since its first chunk or `flush_bytes` of
+    text are pending, whichever comes first.
+    Call flush() before publishing 'stream_end' so no text is left behind.
+
+    Setting either limit to 0 publishes every chunk immediately.
+    """
+
+    def __init__(self, channel: str, message_id: int, service_id: str = None):
+        settings = get_chunk_coalescing_settings(service_id)
+        self.channel = channel
+        self.message_id = message_id
+        self.flush_interval = settings["flush_interval_ms"] / 1000.0
+        self.flush_bytes = settings["flush_bytes"]
+        self.chunks_received = 0
+        self.events_published = 0
+        self._pending = []
+        self._pending_bytes = 0
+        self._first_pending_at = None
+
+    def add(self, text: str):
+        """Buffers a chunk of text and publishes the buffer if a limit was reached."""
+        if not text:
+            return
+        self.chunks_received += 1
+        if not self._pending:
+            self._first_pending_at = time.monotonic()
+        self._pending.append(text)
+        self._pending_bytes += len(text.encode('utf-8'))
+
+        if (self._pending_bytes >= self.flush_bytes
+                or time.monotonic() - self._first_pending_at >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Publishes any buffered text as a single 'stream_chunk' event."""
+        if not self._pending:
+            return
+        content = "".join(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+        self._first_pending_at = None
+        publish_event(self.channel, {"type": "stream_chunk", "message_id": self.message_id, "content": content}, 'stream_chunk')
+        self.events_published += 1
@@ -0,0 +1,141 @@
+# src/services/list_versions.py
+"""
+Version counters for the conversation and message list endpoints.
+
+Every committed change to a Conversation, Message or Attachment bumps a
+counter in Redis: one per user for the conversation list, one per
+(user, conversation) for the message list. The list endpoints derive weak
+ETags from these counters, so a client revalidating with If-None-Match gets
+a 304 without MySQL being touched at all.
+
+Counters start at the current time in milliseconds rather than at 1, so a
+counter that expired and was recreated can never repeat an old ETag.
+"""
+
+import hashlib
+import logging
+import time
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+from ..models.chat import Conversation, Message, Attachment
+
+logger = logging.getLogger(__name__)
+
+# Keys expire a week after the last change; a missing key is simply recreated.
+VERSION_TTL_SECONDS = 7 * 24 * 3600
+
+
+def conversations_version_key(user_id) -> str:
+    return f'list-version:user:{user_id}:conversations'
+
+
+def messages_version_key(user_id, conversation_id) -> str:
+    return f'list-version:user:{user_id}:conversation:{conversation_id}:messages'
+
+
+# ==============================================================================
+#  READING
+# ==============================================================================
+def get_list_version(redis_client, key: str):
+    """
+    Returns the current version for a list, creating it if needed.
+    Returns None if Redis is unavailable, in which case no ETag should be used.
+    """
+    try:
+        pipe = redis_client.pipeline()
+        pipe.set(key, int(time.time() * 1000), nx=True, ex=VERSION_TTL_SECONDS)
+        pipe.get(key)
+        _, version = pipe.execute()
+        return version.decode('ascii') if isinstance(version, bytes) else version
+    except Exception as e:
+        logger.warning(f"Could not read list version {key}: {e}")
+        return None
+
+
+def make_list_etag(version: str, query_string: bytes = b'') -> str:
+    """
+    Builds the (unquoted) ETag for a list version. Different page parameters
+    return different bodies, so the query string is part of the tag.
+    """
+    if not query_string:
+        return version
+    return f"{version}-{hashlib.sha1(query_string).hexdigest()[:10]}"
+
+
+# ==============================================================================
+#  BUMPING ON COMMIT
+# ==============================================================================
+def _lookup(session, model, ids, column):
+    """
+    Maps each id to `column` of that row, using objects already in the
+    session and a single SELECT for the rest.
+    """
+    found, missing = {}, set()
+    for pk in ids:
+        obj = session.identity_map.get(identity_key(model, pk))
+        if obj is not None and column.key in obj.__dict__:
+            found[pk] = obj.__dict__[column.key]
+        else:
+            missing.add(pk)
+    if missing:
+        rows = session.connection().execute(select(model.id, column).where(model.id.in_(missing)))
+        found.update({pk: value for pk, value in rows})
+    return found
+
+
+def _collect_changes(session, flush_context):
+    """Records the version keys of every list touched by the flushed objects."""
+    keys = session.info.setdefault('list_version_changes', set())
+    conversation_ids, attachment_message_ids = set(), set()
+
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Conversation):
+            keys.add(conversations_version_key(obj.user_id))
+            keys.add(messages_version_key(obj.user_id, obj.id))
+        elif isinstance(obj, Message):
+            conversation_ids.add(obj.conversation_id)
+        elif isinstance(obj, Attachment):
+            attachment_message_ids.add(obj.message_id)
+
+    if attachment_message_ids:
+        conversation_ids.update(_lookup(session, Message, attachment_message_ids, Message.conversation_id).values())
+    conversation_ids.discard(None)
+    if conversation_ids:
+        owners = _lookup(session, Conversation, conversation_ids, Conversation.user_id)
+        keys.update(messages_version_key(user_id, cid) for cid, user_id in owners.items())
+
+
+def register_list_version_hooks(app):
+    """Bumps list versions in Redis after every commit that changed chat rows."""
+
+    @event.listens_for(Session, 'after_flush')
+    def _after_flush(session, flush_context):
+        # Primary keys are assigned by now, while new/dirty/deleted still
+        # describe what this flush wrote.
+        try:
+            _collect_changes(session, flush_context)
+        except Exception as e:
+            logger.warning(f"Could not collect list version changes: {e}")
+
+    @event.listens_for(Session, 'after_commit')
+    def _after_commit(session):
+        keys = session.info.pop('list_version_changes', None)
+        if not keys:
+            return
+        try:
+            pipe = app.redis_client.pipeline()
+            now_ms = int(time.time() * 1000)
+            for key in keys:
+                pipe.set(key, now_ms, nx=True)
+                pipe.incr(key)
+                pipe.expire(key, VERSION_TTL_SECONDS)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not bump list versions {sorted(keys)}: {e}")
+
+    @event.listens_for(Session, 'after_rollback')
+    def _after_rollback(session):
+        session.info.pop('list_version_changes', None)
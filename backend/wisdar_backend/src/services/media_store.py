@@ -0,0 +1,155 @@
+# src/services/media_store.py
+"""
+Content-addressed storage for uploaded media.
+
+Uploads are stored once per distinct content, as '<sha256><ext>' in the
+media storage (see services/storage.py), and tracked by a MediaBlob row that attachments reference. The
+same lecture uploaded by thirty team members is therefore written to disk
+once, and the work derived from it (transcripts, Gemini file handles) is done
+once and reused from the blob's artifacts.
+
+Reference counts are maintained by a session hook in models/chat.py. Blobs
+that lose their last reference are kept for a grace period, so a re-upload
+still deduplicates, and then removed by purge_unreferenced_blobs().
+"""
+
+import hashlib
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from ..database import db
+from ..models.media_blob import MediaBlob
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Gemini deletes uploaded files after 48 hours; stop reusing a handle a bit before that.
+GEMINI_FILE_REUSE_SECONDS = 47 * 3600
+
+_CONTENT_ADDRESSED_NAME = re.compile(r'^([0-9a-f]{64})(\.[A-Za-z0-9]+)?$')
+
+
+def content_hash_of(filename: str):
+    """
+    Returns the SHA-256 a stored file is named after, or None for files with
+    other names (older uploads, generated media). A content-addressed file
+    never changes, so its hash is a valid strong ETag.
+    """
+    match = _CONTENT_ADDRESSED_NAME.match(filename)
+    return match.group(1) if match else None
+
+
+def store_upload(saved, content_type: str = None) -> MediaBlob:
+    """
+    Moves a file written by save_upload() into the content-addressed store and
+    returns its blob. If the content is already stored, the new copy is deleted.
+    The caller attaches the blob to an Attachment and commits.
+    """
+    storage = get_storage()
+    extension = os.path.splitext(saved.filename)[1].lower()
+    storage_name = f"{saved.sha256}{extension}"
+
+    # The copy (a full S3 upload for large media) runs before any row is
+    # locked, so it neither blocks concurrent uploads nor pins a connection.
+    # Names are content addressed: a file written twice is the same file.
+    uploaded = False
+    if not storage.exists(storage_name):
+        storage.save_file(storage_name, saved.path, content_type)
+        uploaded = True
+
+    # Short locked step: a concurrent purge of this blob must finish before we
+    # decide which file the row references.
+    blob = db.session.get(MediaBlob, saved.sha256, with_for_update=True)
+    if blob is not None and blob.storage_name != storage_name and storage.exists(blob.storage_name):
+        # Already stored under another extension; keep that copy.
+        if uploaded:
+            storage.delete(storage_name)
+        else:
+            os.remove(saved.path)
+        logger.info(f"Upload deduplicated against {blob!r}.")
+        return blob
+
+    if not storage.exists(storage_name):
+        # Purged between the copy and the lock.
+        if uploaded:
+            raise FileNotFoundError(f"Stored upload {storage_name} was removed by a concurrent purge; retry the upload.")
+        storage.save_file(storage_name, saved.path, content_type)
+    elif not uploaded:
+        os.remove(saved.path)
+        logger.info(f"Upload deduplicated against stored file {storage_name}.")
+
+    if blob is not None:
+        # Either the same file, or the row outlived its file: point it at this copy.
+        blob.storage_name = storage_name
+        return blob
+
+    blob = MediaBlob(
+        sha256=saved.sha256,
+        storage_name=storage_name,
+        content_type=content_type,
+        size_bytes=saved.size,
+        ref_count=0,
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(blob)
+    except IntegrityError:
+        # Someone stored the same content concurrently; both copies are identical.
+        blob = db.session.get(MediaBlob, saved.sha256, with_for_update=True)
+    return blob
+
+
+# ==============================================================================
+#  DERIVED ARTIFACTS
+# ==============================================================================
+def transcript_key(language: str = None) -> str:
+    return f"transcript:{language or 'auto'}"
+
+
+def _api_key_fingerprint(api_key: str) -> str:
+    # Uploaded files belong to the project of the key that uploaded them.
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def get_cached_gemini_file(blob: MediaBlob, api_key: str):
+    """Returns the name of a still-usable Gemini upload of this blob, if any."""
+    cached = blob.get_artifact('gemini_file') if blob else None
+    if not cached or cached.get('key') != _api_key_fingerprint(api_key):
+        return None
+    if datetime.fromisoformat(cached['expires_at']) <= datetime.utcnow():
+        return None
+    return cached['name']
+
+
+def remember_gemini_file(blob: MediaBlob, api_key: str, file_name: str):
+    expires_at = datetime.utcnow() + timedelta(seconds=GEMINI_FILE_REUSE_SECONDS)
+    blob.set_artifact('gemini_file', {
+        'name': file_name,
+        'key': _api_key_fingerprint(api_key),
+        'expires_at': expires_at.isoformat(),
+    })
+
+
+# ==============================================================================
+#  GARBAGE COLLECTION
+# ==============================================================================
+def purge_unreferenced_blobs(grace_seconds: int) -> int:
+    """
+    Deletes blobs, and their files, that have had no attachments for longer
+    than `grace_seconds`. Returns the number of blobs removed.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    blobs = MediaBlob.query.filter(
+        MediaBlob.ref_count <= 0, MediaBlob.last_used_at < cutoff
+    ).with_for_update().all()
+    storage = get_storage()
+    for blob in blobs:
+        # Files go first, while the rows are still locked against store_upload().
+        storage.delete(blob.storage_name)
+        db.session.delete(blob)
+    db.session.commit()
+    return len(blobs)
@@ -0,0 +1,139 @@
+# src/services/prompt_cache.py
+"""
+Provider-side prompt caching.
+
+Agent prompts, YouTube transcripts and conversation summaries are re-sent
+unchanged on every turn. Callers mark the end of such a stable prefix by
+setting "cache": True on a context message; utils/ai_integration.py then
+lets each provider reuse it:
+
+- Anthropic: a cache_control breakpoint on the marked message (and on the
+  last message, so the next turn reads the whole conversation so far from
+  the cache);
+- Gemini: an explicit cached-content handle for the prefix, created once and
+  reused until it expires (registered here, in Redis);
+- OpenAI: caching is automatic for identical prefixes, so the prefix is kept
+  first and a prompt_cache_key derived from it routes follow-ups to the
+  same cache.
+
+Cache hits and misses reported by the providers are counted per provider
+and day (record_usage, get_stats).
+"""
+
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Context message key marking the last message of a stable prefix.
+CACHE_FLAG = 'cache'
+# Daily counters are kept this long.
+STATS_TTL_SECONDS = 30 * 24 * 3600
+STAT_FIELDS = ('requests', 'hits', 'misses', 'input_tokens', 'cached_tokens', 'cache_write_tokens')
+
+
+def split_stable_prefix(messages: list):
+    """Returns (prefix, rest): the messages up to and including the last one marked with CACHE_FLAG, and the others."""
+    end = 0
+    for i, message in enumerate(messages):
+        if message.get(CACHE_FLAG):
+            end = i + 1
+    return messages[:end], messages[end:]
+
+
+def prefix_fingerprint(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or '').encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def prefix_cache_key(model_id: str, prefix: list) -> str:
+    """A short, stable key for a prefix (OpenAI prompt_cache_key)."""
+    return prefix_fingerprint(model_id, *(f"{m['role']}:{m['content']}" for m in prefix))[:32]
+
+
+# ==============================================================================
+#  HIT / MISS STATISTICS
+# ==============================================================================
+def _stats_key(day: str) -> str:
+    return f'prompt-cache-stats:{day}'
+
+
+def record_usage(provider_id: str, input_tokens: int, cached_tokens: int = 0, cache_write_tokens: int = 0):
+    """
+    Counts one model call. A call is a hit when part of its prompt was read
+    from the provider's cache. Never raises.
+    """
+    hit = cached_tokens > 0
+    logger.info(
+        f"[PROMPT_CACHE] provider={provider_id} {'hit' if hit else 'miss'} "
+        f"input={input_tokens} cached={cached_tokens} written={cache_write_tokens}"
+    )
+    try:
+        key = _stats_key(datetime.utcnow().strftime('%Y-%m-%d'))
+        pipe = current_app.redis_client.pipeline()
+        pipe.hincrby(key, f'{provider_id}:requests', 1)
+        pipe.hincrby(key, f"{provider_id}:{'hits' if hit else 'misses'}", 1)
+        pipe.hincrby(key, f'{provider_id}:input_tokens', int(input_tokens or 0))
+        pipe.hincrby(key, f'{provider_id}:cached_tokens', int(cached_tokens or 0))
+        pipe.hincrby(key, f'{provider_id}:cache_write_tokens', int(cache_write_tokens or 0))
+        pipe.expire(key, STATS_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Could not record prompt cache usage: {e}")
+
+
+def get_stats(days: int = 7) -> dict:
+    """Per-day, per-provider counters for the last `days` days, newest first."""
+    today = datetime.utcnow().date()
+    dates = [(today - timedelta(days=offset)).isoformat() for offset in range(days)]
+    pipe = current_app.redis_client.pipeline()
+    for day in dates:
+        pipe.hgetall(_stats_key(day))
+    stats = {}
+    for day, raw in zip(dates, pipe.execute()):
+        providers = {}
+        for field, value in raw.items():
+            field = field.decode('utf-8') if isinstance(field, bytes) else field
+            provider_id, name = field.rsplit(':', 1)
+            providers.setdefault(provider_id, dict.fromkeys(STAT_FIELDS, 0))[name] = int(value)
+        for counters in providers.values():
+            counters['hit_rate'] = round(counters['hits'] / counters['requests'], 3) if counters['requests'] else 0.0
+        stats[day] = providers
+    return stats
+
+
+# ==============================================================================
+#  GEMINI CACHED CONTENT HANDLES
+# ==============================================================================
+def _gemini_handle_key(fingerprint: str) -> str:
+    return f'gemini-cached-content:{fingerprint}'
+
+
+def get_gemini_handle(fingerprint: str):
+    try:
+        name = current_app.redis_client.get(_gemini_handle_key(fingerprint))
+    except Exception as e:
+        logger.warning(f"Could not look up a Gemini cached content handle: {e}")
+        return None
+    return name.decode('utf-8') if isinstance(name, bytes) else name
+
+
+def remember_gemini_handle(fingerprint: str, name: str, ttl_seconds: int):
+    """Registers a cached content handle; forgotten a minute before Gemini expires it."""
+    try:
+        current_app.redis_client.set(_gemini_handle_key(fingerprint), name, ex=max(ttl_seconds - 60, 1))
+    except Exception as e:
+        logger.warning(f"Could not register Gemini cached content {name}: {e}")
+
+
+def forget_gemini_handle(fingerprint: str):
+    try:
+        current_app.redis_client.delete(_gemini_handle_key(fingerprint))
+    except Exception as e:
+        logger.warning(f"Could not forget a Gemini cached content handle: {e}")
@@ -0,0 +1,142 @@
+# src/services/response_cache.py
+"""
+Exact-match cache for model calls that are a function of their input.
+
+Helpers such as claim decomposition or TTS parameter extraction send a fixed
+system prompt and the caller's text to the same model every time. The
+memoize_response decorator stores their results in Redis, keyed by the
+helper, the model, the request parameters and a hash of the arguments, so a
+repeated or retried workflow gets the earlier answer without a round-trip.
+
+Entries expire after RESPONSE_CACHE_TTL_SECONDS (0 disables the cache) and
+at most RESPONSE_CACHE_MAX_ENTRIES are kept: every hit refreshes an entry's
+position in a recency index, and writes beyond the limit evict the least
+recently used entries.
+
+Only helpers that call the model at temperature 0 are memoized: a retried
+sampled call (a creative rewrite, say) is expected to give a new answer.
+
+A helper returns uncached(value) for results that must not be stored, such
+as a fallback used when the model's answer could not be parsed. Redis errors
+never fail the call; the helper simply runs.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import time
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# The hash tag keeps entries and the recency index in one Redis Cluster slot.
+KEY_PREFIX = 'response-cache:{llm}'
+LRU_KEY = f'{KEY_PREFIX}:lru'
+
+# Entries evicted per write, at most; a lowered limit is reached over several writes.
+MAX_EVICTIONS_PER_WRITE = 100
+
+# Stores an entry, records it as most recently used and removes the least
+# recently used entries beyond the limit from the index. Returns the evicted
+# keys; the caller deletes them, since a script may only touch its KEYS.
+_STORE_LUA = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+local overflow = math.min(redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4]), tonumber(ARGV[5]))
+if overflow <= 0 then
+    return {}
+end
+local evicted = redis.call('ZRANGE', KEYS[2], 0, overflow - 1)
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, overflow - 1)
+return evicted
+"""
+
+
+class _Uncached:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def uncached(value):
+    """Wraps a helper's return value so memoize_response returns it without storing it."""
+    return _Uncached(value)
+
+
+def _get_store_script(redis_client):
+    script = getattr(redis_client, '_response_cache_store_script', None)
+    if script is None:
+        script = redis_client.register_script(_STORE_LUA)
+        redis_client._response_cache_store_script = script
+    return script
+
+
+def response_cache_key(name: str, model: str, params: dict, args: tuple, kwargs: dict) -> str:
+    request = json.dumps([model, params, args, kwargs], sort_keys=True, default=str, separators=(',', ':'))
+    return f"{KEY_PREFIX}:{name}:{hashlib.sha256(request.encode('utf-8')).hexdigest()}"
+
+
+def _lookup(redis_client, key: str):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(key)
+    # XX: only an entry that is still indexed has its recency refreshed.
+    pipe.zadd(LRU_KEY, {key: time.time()}, xx=True)
+    raw, _ = pipe.execute()
+    return raw
+
+
+def memoize_response(model: str, version: int = 1, ttl_seconds: int = None, **params):
+    """
+    Caches the decorated helper's results in Redis.
+
+    `model` and `params` (temperature, response_format...) are the request
+    settings the helper uses and are part of the key. Bump `version` when the
+    helper's prompt changes, so answers to the old prompt are not reused.
+    Results must be JSON-serializable.
+    """
+    def decorator(func):
+        name = f"{func.__name__}:v{version}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                config = current_app.config
+                ttl = ttl_seconds if ttl_seconds is not None else config['RESPONSE_CACHE_TTL_SECONDS']
+                max_entries = config['RESPONSE_CACHE_MAX_ENTRIES']
+                redis_client = current_app.redis_client
+            except (RuntimeError, KeyError, AttributeError):
+                # No app context or no cache configured.
+                ttl = 0
+            if ttl <= 0:
+                result = func(*args, **kwargs)
+                return result.value if isinstance(result, _Uncached) else result
+
+            key = response_cache_key(name, model, params, args, kwargs)
+            try:
+                raw = _lookup(redis_client, key)
+                if raw is not None:
+                    logger.info(f"[RESPONSE_CACHE] hit {func.__name__}")
+                    return json.loads(raw)
+            except Exception as e:
+                logger.warning(f"Could not read the response cache for {func.__name__}: {e}")
+
+            result = func(*args, **kwargs)
+            if isinstance(result, _Uncached):
+                return result.value
+            try:
+                evicted = _get_store_script(redis_client)(
+                    keys=[key, LRU_KEY],
+                    args=[json.dumps(result), ttl, time.time(), max_entries, MAX_EVICTIONS_PER_WRITE],
+                )
+                if evicted:
+                    redis_client.delete(*evicted)
+            except Exception as e:
+                logger.warning(f"Could not store a response for {func.__name__}: {e}")
+            return result
+
+        return wrapper
+    return decorator
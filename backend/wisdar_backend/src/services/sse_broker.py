@@ -0,0 +1,313 @@
+# src/services/sse_broker.py
+"""
+A per-process Redis Pub/Sub multiplexer for the SSE endpoint.
+
+Instead of opening one Redis connection per connected browser tab, a single
+listener greenlet pattern-subscribes to every 'user-*' channel and routes each
+message to the in-memory queues of the clients connected to this process.
+The number of Redis connections therefore stays flat no matter how many SSE
+clients are connected.
+
+On Redis Cluster, classic Pub/Sub broadcasts every message to every node, so
+the broker can use sharded Pub/Sub instead: it SSUBSCRIBEs only to the
+channels of users connected to this process, reference-counted by client.
+
+The broker also polices connections: it caps the number of streams per
+user and reaps streams whose client has stopped reading (e.g. a dead TCP
+peer behind a proxy), so zombie subscribers do not pile up.
+
+While a user has a stream open on this process the broker keeps a presence
+entry for them in Redis, which publishers use to skip intermediate events for
+users nobody is listening to. The entry outlives the user's last stream by
+the presence TTL, so a page reload or network blip mid-generation can still
+replay the chunks it missed.
+"""
+
+import itertools
+import logging
+import time
+import uuid
+
+import gevent
+import redis
+from gevent.queue import Queue, Full
+from redis.cluster import RedisCluster
+
+from .sse_protocol import USER_CHANNEL_PATTERN, user_channel, parse_pubsub_message, presence_key
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionLimitExceeded(Exception):
+    """Raised when a user already has the maximum number of open streams."""
+
+
+class SSEClient:
+    """A single connected SSE stream and its pending (event_id, payload) pairs."""
+
+    def __init__(self, client_id: int, user_id, queue_size: int):
+        self.id = client_id
+        self.user_id = user_id
+        self.channel = user_channel(user_id)
+        self.queue = Queue(maxsize=queue_size)
+        self.connected_at = time.time()
+        self.last_active = time.monotonic()
+        self.dropped_events = 0
+        self.reaped = False
+        # The greenlet serving this stream, so a stuck write can be interrupted.
+        self.greenlet = gevent.getcurrent()
+
+    def touch(self):
+        """Records that the client has consumed everything written so far."""
+        self.last_active = time.monotonic()
+
+    def __repr__(self):
+        return f"<SSEClient {self.id} on {self.channel}>"
+
+
+class SSEBroker:
+    """
+    Owns the process-wide Pub/Sub connection and fans messages out to clients.
+
+    The listener greenlet is started lazily on the first subscription, so
+    processes that import the app but never serve SSE (e.g. Celery workers)
+    do not open a subscriber connection.
+    """
+
+    def __init__(self, redis_url: str, queue_size: int = 256, reconnect_delay: float = 1.0,
+                 max_connections_per_user: int = 10, idle_timeout: float = 60.0, reap_interval: float = 15.0,
+                 presence_ttl: int = 45, cluster: bool = False, sharded: bool = False,
+                 poll_interval: float = 0.1):
+        self.redis_url = redis_url
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.max_connections_per_user = max_connections_per_user
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.presence_ttl = presence_ttl
+        self.cluster = cluster
+        self.sharded = sharded
+        self.poll_interval = poll_interval
+        self._clients = {}  # channel -> {client_id: SSEClient}
+        self._ids = itertools.count(1)
+        self._listener = None
+        self._reaper = None
+        self._redis = None
+        self._instance_id = None
+        self._messages_routed = 0
+        self._messages_unrouted = 0
+        self._dropped_events = 0
+        self._streams_opened = 0
+        self._streams_closed = 0
+        self._streams_reaped = 0
+        self._streams_rejected = 0
+
+    # --------------------------------------------------------------------------
+    #  Client registration
+    # --------------------------------------------------------------------------
+    def subscribe(self, user_id) -> SSEClient:
+        """
+        Registers a new client for a user's channel and returns it.
+        Raises ConnectionLimitExceeded if the user already has too many streams.
+        """
+        self.start()
+        channel = user_channel(user_id)
+        if self.max_connections_per_user and len(self._clients.get(channel, {})) >= self.max_connections_per_user:
+            self._streams_rejected += 1
+            raise ConnectionLimitExceeded(f"User {user_id} already has {self.max_connections_per_user} open streams.")
+
+        client = SSEClient(next(self._ids), user_id, self.queue_size)
+        first_for_channel = channel not in self._clients
+        self._clients.setdefault(channel, {})[client.id] = client
+        self._streams_opened += 1
+        if first_for_channel:
+            self._refresh_presence([channel])
+        return client
+
+    def unsubscribe(self, client: SSEClient):
+        """Removes a client. Safe to call more than once."""
+        if self._remove(client) and not client.reaped:
+            self._streams_closed += 1
+
+    def _remove(self, client: SSEClient) -> bool:
+        channel_clients = self._clients.get(client.channel)
+        if not channel_clients or client.id not in channel_clients:
+            return False
+        del channel_clients[client.id]
+        if not channel_clients:
+            self._clients.pop(client.channel, None)
+            # Not deleted: restarting the TTL gives a reconnecting client a
+            # grace period in which chunks still reach the replay Stream.
+            self._refresh_presence([client.channel])
+        return True
+
+    # --------------------------------------------------------------------------
+    #  Listener greenlet
+    # --------------------------------------------------------------------------
+    def start(self):
+        """Spawns the listener and reaper greenlets if they are not already running."""
+        if self._redis is None:
+            # Created here rather than in __init__ so every forked worker gets its own identity.
+            self._redis = self._connect()
+            self._instance_id = uuid.uuid4().hex
+        if self._listener is None or self._listener.dead:
+            self._listener = gevent.spawn(self._listen_forever)
+        if self._reaper is None or self._reaper.dead:
+            self._reaper = gevent.spawn(self._reap_forever)
+
+    def _connect(self):
+        if self.cluster:
+            return RedisCluster.from_url(self.redis_url)
+        return redis.from_url(self.redis_url)
+
+    def _listen_forever(self):
+        if self.sharded:
+            return self._listen_sharded_forever()
+        while True:
+            pubsub = None
+            try:
+                pubsub = self._connect().pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(USER_CHANNEL_PATTERN)
+                logger.info(f"SSE broker subscribed to '{USER_CHANNEL_PATTERN}'.")
+                for message in pubsub.listen():
+                    if message['type'] == 'pmessage':
+                        self._dispatch(message['channel'], message['data'])
+            except Exception as e:
+                logger.error(f"SSE broker listener failed, reconnecting: {e}", exc_info=True)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            gevent.sleep(self.reconnect_delay)
+
+    def _listen_sharded_forever(self):
+        """
+        Sharded Pub/Sub has no pattern subscriptions, so the listener keeps one
+        SSUBSCRIBE per channel with local clients. Subscription changes are
+        applied between polls, from this greenlet only, so the Pub/Sub
+        connection is never used concurrently.
+        """
+        while True:
+            pubsub = None
+            subscribed = set()
+            try:
+                pubsub = self._connect().pubsub()
+                get_message = getattr(pubsub, 'get_sharded_message', pubsub.get_message)
+                logger.info("SSE broker listening with sharded Pub/Sub.")
+                while True:
+                    wanted = set(self._clients)
+                    for channel in wanted - subscribed:
+                        pubsub.ssubscribe(channel)
+                    for channel in subscribed - wanted:
+                        pubsub.sunsubscribe(channel)
+                    subscribed = wanted
+
+                    if not subscribed:
+                        gevent.sleep(self.poll_interval)
+                        continue
+                    message = get_message(ignore_subscribe_messages=True, timeout=self.poll_interval)
+                    if message and message['type'] == 'smessage':
+                        self._dispatch(message['channel'], message['data'])
+            except Exception as e:
+                logger.error(f"SSE broker sharded listener failed, reconnecting: {e}", exc_info=True)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            gevent.sleep(self.reconnect_delay)
+
+    def _dispatch(self, channel, data: bytes):
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+
+        channel_clients = self._clients.get(channel)
+        if not channel_clients:
+            self._messages_unrouted += 1
+            return
+
+        self._messages_routed += 1
+        event = parse_pubsub_message(data)
+        for client in list(channel_clients.values()):
+            try:
+                client.queue.put_nowait(event)
+            except Full:
+                # A slow consumer must never block delivery to everyone else.
+                client.dropped_events += 1
+                self._dropped_events += 1
+
+    # --------------------------------------------------------------------------
+    #  Presence
+    # --------------------------------------------------------------------------
+    def _refresh_presence(self, channels):
+        """Marks this process as holding streams for the given channels."""
+        if not channels or self._redis is None:
+            return
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for channel in channels:
+                pipe.hset(presence_key(channel), self._instance_id, 1)
+                pipe.expire(presence_key(channel), self.presence_ttl)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"SSE broker failed to refresh presence: {e}")
+
+    # --------------------------------------------------------------------------
+    #  Reaper greenlet
+    # --------------------------------------------------------------------------
+    def _reap_forever(self):
+        while True:
+            gevent.sleep(self.reap_interval)
+            try:
+                self.reap_idle_clients()
+                self._refresh_presence(list(self._clients))
+            except Exception as e:
+                logger.error(f"SSE broker reaper failed: {e}", exc_info=True)
+
+    def reap_idle_clients(self) -> int:
+        """
+        Drops every client that has not consumed its stream for longer than
+        `idle_timeout`. Live clients receive heartbeats well within that window,
+        so a stale client is one whose socket writes are no longer completing.
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        stale = [
+            c for channel_clients in self._clients.values()
+            for c in channel_clients.values() if c.last_active < deadline
+        ]
+        for client in stale:
+            client.reaped = True
+            if self._remove(client):
+                self._streams_reaped += 1
+                logger.info(f"Reaped idle SSE stream {client!r} for user {client.user_id}.")
+            if client.greenlet is not None and not client.greenlet.dead:
+                client.greenlet.kill(block=False)
+        return len(stale)
+
+    # --------------------------------------------------------------------------
+    #  Stats
+    # --------------------------------------------------------------------------
+    def stats(self) -> dict:
+        """Returns a snapshot of connection and queue statistics for this process."""
+        clients = [c for channel_clients in self._clients.values() for c in channel_clients.values()]
+        depths = [c.queue.qsize() for c in clients]
+        return {
+            'listener_running': self._listener is not None and not self._listener.dead,
+            'sharded_pubsub': self.sharded,
+            'connected_clients': len(clients),
+            'connected_users': len(self._clients),
+            'max_connections_per_user': self.max_connections_per_user,
+            'streams_opened': self._streams_opened,
+            'streams_closed': self._streams_closed,
+            'streams_reaped': self._streams_reaped,
+            'streams_rejected': self._streams_rejected,
+            'queue_depth_total': sum(depths),
+            'queue_depth_max': max(depths, default=0),
+            'queue_capacity': self.queue_size,
+            'messages_routed': self._messages_routed,
+            'messages_unrouted': self._messages_unrouted,
+            'dropped_events': self._dropped_events,
+        }
@@ -0,0 +1,138 @@
+# src/services/sse_protocol.py
+"""
+Shared naming and framing helpers for the real-time event pipeline.
+
+This module is deliberately free of Flask, Celery and gevent imports so it can
+be used by the web app, the Celery workers and any standalone SSE process.
+"""
+
+import json
+import re
+
+import jwt
+
+try:
+    import msgpack  # Optional: a more compact transport between workers and the SSE tier.
+except ImportError:
+    msgpack = None
+
+# Every user gets their own Redis Pub/Sub channel: 'user-<id>'.
+USER_CHANNEL_PREFIX = 'user-'
+USER_CHANNEL_PATTERN = f'{USER_CHANNEL_PREFIX}*'
+
+# Redis Stream entry ids look like '<milliseconds>-<sequence>'.
+_EVENT_ID_RE = re.compile(r'^\d+-\d+$')
+
+
+def user_channel(user_id) -> str:
+    """Returns the Pub/Sub channel name used for a user's SSE events."""
+    return f'{USER_CHANNEL_PREFIX}{user_id}'
+
+
+# Per-channel keys wrap the channel name in a hash tag, so on Redis Cluster the
+# key lands in the same slot as the channel itself and a script can XADD and
+# SPUBLISH in one call.
+def event_stream_key(channel: str) -> str:
+    """Returns the key of the capped Redis Stream that backs replay for a channel."""
+    return f'sse-events:{{{channel}}}'
+
+
+def presence_key(channel: str) -> str:
+    """
+    Returns the key of the hash recording which SSE processes currently hold
+    a stream for a channel (one field per process). The key expires unless
+    the processes keep refreshing it, so a crashed process cannot leave a
+    user marked online for long.
+    """
+    return f'sse-presence:{{{channel}}}'
+
+
+# ==============================================================================
+#  EVENT IDS
+# ==============================================================================
+def is_valid_event_id(event_id) -> bool:
+    """True if the value is a well-formed Redis Stream id."""
+    return bool(event_id) and bool(_EVENT_ID_RE.match(event_id))
+
+
+def event_id_key(event_id: str) -> tuple:
+    """Turns a Stream id into a tuple that sorts in publication order."""
+    millis, sequence = event_id.split('-', 1)
+    return int(millis), int(sequence)
+
+
+# ==============================================================================
+#  EVENT ENVELOPE
+# ==============================================================================
+WIRE_FORMAT_JSON = 'json'
+WIRE_FORMAT_MSGPACK = 'msgpack'
+
+
+def encode_event(event_name: str, event_data: dict, wire_format: str = WIRE_FORMAT_JSON) -> bytes:
+    """
+    Encodes an event exactly once into its canonical envelope,
+    {"type": <event_name>, **event_data}, as compact JSON or as msgpack.
+    Falls back to JSON if msgpack is requested but not installed.
+    """
+    envelope = {"type": event_name, **event_data}
+    if wire_format == WIRE_FORMAT_MSGPACK and msgpack is not None:
+        return msgpack.packb(envelope, use_bin_type=True)
+    return json.dumps(envelope, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def to_sse_data(payload: bytes) -> bytes:
+    """
+    Returns an encoded envelope as JSON bytes ready for an SSE 'data:' line.
+    JSON payloads (always starting with '{') are passed through untouched;
+    msgpack payloads are transcoded once.
+    """
+    if payload[:1] == b'{' or msgpack is None:
+        return payload
+    return json.dumps(msgpack.unpackb(payload, raw=False), separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+# ==============================================================================
+#  WIRE FORMAT
+# ==============================================================================
+def parse_pubsub_message(data: bytes) -> tuple:
+    """
+    Splits a published message into (event_id, payload).
+    Messages are published as b'<event_id> <payload>'.
+    """
+    event_id, _, payload = data.partition(b' ')
+    return event_id.decode('ascii'), payload
+
+
+# An SSE comment line: ignored by EventSource, but keeps proxies from timing
+# out an idle stream and surfaces dead peers on the next write.
+HEARTBEAT_FRAME = b": heartbeat\n\n"
+
+
+def format_sse(payload: bytes, event_id: str = None) -> bytes:
+    """
+    Frames an encoded envelope as an SSE event, with an optional 'id:' line.
+    The payload bytes are written as-is; compact JSON never contains newlines.
+    """
+    data = to_sse_data(payload)
+    if event_id:
+        return b"id: " + event_id.encode('ascii') + b"\ndata: " + data + b"\n\n"
+    return b"data: " + data + b"\n\n"
+
+
+# ==============================================================================
+#  AUTHENTICATION
+# ==============================================================================
+ACCESS_COOKIE_NAME = 'access_token_cookie'
+
+
+def decode_access_token(token: str, secret_key: str, algorithm: str = 'HS256', identity_claim: str = 'sub'):
+    """
+    Validates an access token issued by flask_jwt_extended and returns its
+    identity, using the same defaults as the web app (HS256, 'sub' claim).
+    Raises jwt.InvalidTokenError if the token is invalid, expired or not an
+    access token.
+    """
+    decoded = jwt.decode(token, secret_key, algorithms=[algorithm])
+    if decoded.get('type') != 'access':
+        raise jwt.InvalidTokenError("Only access tokens are allowed")
+    return decoded[identity_claim]
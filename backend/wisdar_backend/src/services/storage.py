@@ -0,0 +1,194 @@
+# src/services/storage.py
+"""
+Where uploaded and generated media is kept.
+
+Every stored file is addressed by its name (the value kept in
+Attachment.storage_url and in /api/chat/uploads/<name> URLs). Two backends
+implement the same small interface:
+
+- LocalStorage keeps files on disk under UPLOAD_FOLDER, sharded into two
+  levels of subdirectories ('ab/cd/<name>') so no directory grows without
+  bound. Files written before sharding are still found at the top level.
+- S3Storage keeps them in an S3-compatible bucket (AWS S3, MinIO, ...), so
+  web and Celery nodes no longer need a shared filesystem. Files are
+  downloaded to a local scratch copy when a task needs a real path (moviepy,
+  Gemini uploads) and served to browsers through short-lived signed URLs.
+
+The backend is chosen with STORAGE_BACKEND and created once per process by
+init_storage(); code uses get_storage().
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+from flask import current_app
+
+try:
+    import boto3  # Optional: only needed with STORAGE_BACKEND=s3.
+except ImportError:
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+STORAGE_LOCAL = 'local'
+STORAGE_S3 = 's3'
+
+
+def _shard_prefix(name: str) -> str:
+    # Content-addressed names are already uniformly distributed hex; other
+    # names are hashed so uuid prefixes and fixed prefixes ('tts_', 'clip_') spread too.
+    digest = name.split('.', 1)[0].lower()
+    if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        digest = hashlib.sha256(name.encode('utf-8')).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}"
+
+
+def is_valid_name(name: str) -> bool:
+    """Stored names are single path components."""
+    return bool(name) and name == os.path.basename(name) and name not in ('.', '..')
+
+
+class LocalStorage:
+    """Hash-sharded files under a local directory."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def relative_path(self, name: str) -> str:
+        """Path of a stored file relative to the root; falls back to the flat legacy layout."""
+        sharded = f"{_shard_prefix(name)}/{name}"
+        if not os.path.exists(os.path.join(self.root, sharded)) and os.path.exists(os.path.join(self.root, name)):
+            return name
+        return sharded
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, self.relative_path(name))
+
+    def _writable_path(self, name: str) -> str:
+        path = os.path.join(self.root, _shard_prefix(name), name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def save_bytes(self, name: str, data: bytes, content_type: str = None):
+        with open(self._writable_path(name), 'wb') as f:
+            f.write(data)
+
+    def save_file(self, name: str, source_path: str, content_type: str = None):
+        """Moves a finished local file into storage."""
+        os.replace(source_path, self._writable_path(name))
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def delete(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def open_local(self, name: str):
+        """Yields a local filesystem path to the stored file."""
+        path = self._path(name)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Stored file not found: {name}")
+        yield path
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket, optionally under a key prefix."""
+
+    def __init__(self, bucket: str, scratch_dir: str, prefix: str = '', endpoint_url: str = None,
+                 region_name: str = None, access_key_id: str = None, secret_access_key: str = None,
+                 url_expires_seconds: int = 3600):
+        if boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires the 'boto3' package.")
+        self.bucket = bucket
+        self.scratch_dir = scratch_dir
+        self.prefix = prefix.strip('/')
+        self.url_expires_seconds = url_expires_seconds
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region_name,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+        )
+
+    def key_for(self, name: str) -> str:
+        key = f"{_shard_prefix(name)}/{name}"
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def save_bytes(self, name: str, data: bytes, content_type: str = None):
+        extra = {'ContentType': content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self.key_for(name), Body=data, **extra)
+
+    def save_file(self, name: str, source_path: str, content_type: str = None):
+        """Uploads a finished local file (multipart for large files) and deletes the local copy."""
+        extra = {'ContentType': content_type} if content_type else None
+        self.client.upload_file(source_path, self.bucket, self.key_for(name), ExtraArgs=extra)
+        os.remove(source_path)
+
+    def exists(self, name: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key_for(name))
+            return True
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, name: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key_for(name))
+
+    @contextmanager
+    def open_local(self, name: str):
+        """Downloads the object to a scratch file, yields its path and removes it afterwards."""
+        if not self.exists(name):
+            raise FileNotFoundError(f"Stored file not found: {name}")
+        scratch = tempfile.mkdtemp(prefix='storage-', dir=self.scratch_dir)
+        path = os.path.join(scratch, name)
+        try:
+            self.client.download_file(self.bucket, self.key_for(name), path)
+            yield path
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def signed_url(self, name: str) -> str:
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.key_for(name)}, ExpiresIn=self.url_expires_seconds
+        )
+
+
+def init_storage(app):
+    """Creates the configured storage backend for this process."""
+    if app.config['STORAGE_BACKEND'] == STORAGE_S3:
+        storage = S3Storage(
+            bucket=app.config['S3_BUCKET'],
+            scratch_dir=app.config['UPLOAD_FOLDER'],
+            prefix=app.config['S3_PREFIX'],
+            endpoint_url=app.config['S3_ENDPOINT_URL'],
+            region_name=app.config['S3_REGION'],
+            access_key_id=app.config['S3_ACCESS_KEY_ID'],
+            secret_access_key=app.config['S3_SECRET_ACCESS_KEY'],
+            url_expires_seconds=app.config['S3_URL_EXPIRES_SECONDS'],
+        )
+    else:
+        storage = LocalStorage(app.config['UPLOAD_FOLDER'])
+    app.extensions['storage'] = storage
+    logger.info(f"Media storage: {type(storage).__name__}")
+    return storage
+
+
+def get_storage():
+    return current_app.extensions['storage']
+
+
+def scratch_path(suffix: str = '') -> str:
+    """A fresh local path for work files, e.g. files that are later moved into storage."""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}{suffix}")
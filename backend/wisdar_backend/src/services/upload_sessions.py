@@ -0,0 +1,277 @@
+# src/services/upload_sessions.py
+"""
+Resumable uploads for large media.
+
+A client creates an upload session, PUTs the file in byte ranges and then
+passes the session's id to the chat routes in place of a multipart file. A
+dropped connection only costs the range in flight: the client asks for the
+session's offset and carries on from there.
+
+Session state lives in Redis, so any web process can accept the next range.
+The bytes are assembled in place in a '.part' file in UPLOAD_FOLDER, which
+save_upload() later moves to its final name like any streamed upload.
+Ranges must arrive in order, and one session accepts one range at a time.
+"""
+
+import hashlib
+import logging
+import os
+import time
+import uuid
+
+from werkzeug.datastructures import FileStorage
+
+from ..utils.upload_utils import PART_SUFFIX, COPY_CHUNK_SIZE, StreamedUpload, make_unique_filename
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of part files by expiry time, used to delete abandoned uploads.
+_EXPIRY_INDEX_KEY = 'upload-sessions:expiry'
+
+# The range lock holds a random token; only its holder may extend, use or
+# release it, so a request that outlived the lock cannot touch another
+# writer's lock or offset.
+_EXTEND_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_COMMIT_OFFSET_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return -1
+end
+redis.call('HSET', KEYS[2], 'offset', ARGV[2])
+return 1
+"""
+
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class UploadSessionError(Exception):
+    """Raised for requests that do not fit the session. Carries the HTTP status."""
+
+    def __init__(self, message: str, status: int = 400, offset: int = None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.offset = offset
+
+
+def _session_key(upload_id) -> str:
+    # The hash tag keeps a session and its lock in one Redis Cluster slot, for _COMMIT_OFFSET_LUA.
+    return f'upload-session:{{{upload_id}}}'
+
+
+def _lock_key(upload_id) -> str:
+    return f'{_session_key(upload_id)}:lock'
+
+
+def _get_script(redis_client, attr: str, source: str):
+    script = getattr(redis_client, attr, None)
+    if script is None:
+        script = redis_client.register_script(source)
+        setattr(redis_client, attr, script)
+    return script
+
+
+def _decode(session: dict) -> dict:
+    session = {k.decode(): v.decode() for k, v in session.items()}
+    session['size'] = int(session['size'])
+    session['offset'] = int(session['offset'])
+    return session
+
+
+class AssembledUpload(StreamedUpload):
+    """
+    A finished session's part file, presented like a streamed upload so
+    save_upload() moves it into place without copying. The hash is computed
+    here, once, since ranges may have been written by different processes.
+    """
+
+    def __init__(self, path: str, filename: str, size: int):
+        self.filename = filename
+        self.path = path
+        self.part_path = path + PART_SUFFIX
+        self.size = size
+        self.claimed = False
+        self._hash = hashlib.sha256()
+        self._file = open(self.part_path, 'rb')
+        for chunk in iter(lambda: self._file.read(COPY_CHUNK_SIZE), b''):
+            self._hash.update(chunk)
+        self._file.seek(0)
+
+
+class UploadSessionStore:
+    """Creates, fills and completes upload sessions."""
+
+    def __init__(self, redis_client, upload_folder: str, ttl_seconds: int = 24 * 3600, lock_seconds: int = 600):
+        self.redis_client = redis_client
+        self.upload_folder = upload_folder
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+
+    def _part_path(self, filename: str) -> str:
+        return os.path.join(self.upload_folder, filename + PART_SUFFIX)
+
+    def _touch(self, pipe, upload_id, filename):
+        pipe.expire(_session_key(upload_id), self.ttl_seconds)
+        pipe.zadd(_EXPIRY_INDEX_KEY, {filename: time.time() + self.ttl_seconds})
+
+    def create(self, user_id, filename: str, content_type: str, size: int) -> dict:
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        unique_filename = make_unique_filename(filename)
+        # Reserve the part file now so an empty upload can still be finalized.
+        open(self._part_path(unique_filename), 'wb').close()
+
+        pipe = self.redis_client.pipeline()
+        pipe.hset(_session_key(upload_id), mapping={
+            'user_id': str(user_id),
+            'filename': filename,
+            'content_type': content_type,
+            'storage_name': unique_filename,
+            'size': size,
+            'offset': 0,
+        })
+        self._touch(pipe, upload_id, unique_filename)
+        pipe.execute()
+        return {'upload_id': upload_id, 'offset': 0, 'size': size}
+
+    def get(self, upload_id, user_id) -> dict:
+        session = self.redis_client.hgetall(_session_key(upload_id))
+        if not session:
+            raise UploadSessionError("Upload session not found or expired.", 404)
+        session = _decode(session)
+        if session['user_id'] != str(user_id):
+            raise UploadSessionError("Upload session not found or expired.", 404)
+        return session
+
+    def status(self, upload_id, user_id) -> dict:
+        session = self.get(upload_id, user_id)
+        return {
+            'upload_id': upload_id,
+            'offset': session['offset'],
+            'size': session['size'],
+            'complete': session['offset'] == session['size'],
+        }
+
+    def write_range(self, upload_id, user_id, start: int, total: int, stream, length: int) -> dict:
+        """
+        Appends `length` bytes read from `stream` at byte `start`. The range must
+        start at the session's current offset.
+        """
+        session = self.get(upload_id, user_id)
+        if total != session['size']:
+            raise UploadSessionError("Content-Range total does not match the upload size.")
+
+        # One writer per session. The lock is extended after every chunk, so it
+        # only expires under a request that stalled; that request then stops
+        # before writing again, and a retry can take over.
+        lock_key, token = _lock_key(upload_id), uuid.uuid4().hex
+        if not self.redis_client.set(lock_key, token, nx=True, ex=self.lock_seconds):
+            raise UploadSessionError("Another range is being written to this upload.", 409, session['offset'])
+        extend_lock = _get_script(self.redis_client, '_upload_extend_lock_script', _EXTEND_LOCK_LUA)
+        try:
+            # Read the offset again under the lock: the writer that held it may have moved it.
+            session = self.get(upload_id, user_id)
+            if start != session['offset']:
+                raise UploadSessionError("Range does not start at the current offset.", 409, session['offset'])
+            if start + length > session['size']:
+                raise UploadSessionError("Range extends past the end of the upload.")
+
+            written = 0
+            with open(self._part_path(session['storage_name']), 'r+b') as part:
+                part.seek(start)
+                # Drop anything past the offset left by an earlier, interrupted range.
+                part.truncate()
+                while written < length:
+                    try:
+                        chunk = stream.read(min(COPY_CHUNK_SIZE, length - written))
+                    except Exception as e:
+                        # Typically the client disconnected; keep what arrived.
+                        logger.info(f"Upload {upload_id} range interrupted at {start + written}: {e}")
+                        break
+                    if not chunk:
+                        break
+                    if not extend_lock(keys=[lock_key], args=[token, self.lock_seconds]):
+                        raise UploadSessionError("The upload lock expired while the range was written; resume from the current offset.", 409)
+                    part.write(chunk)
+                    written += len(chunk)
+
+            offset = start + written
+            commit_offset = _get_script(self.redis_client, '_upload_commit_offset_script', _COMMIT_OFFSET_LUA)
+            committed = commit_offset(keys=[lock_key, _session_key(upload_id)], args=[token, offset])
+            if committed == -1:
+                # Completed or aborted meanwhile.
+                raise UploadSessionError("Upload session not found or expired.", 404)
+            if not committed:
+                raise UploadSessionError("The upload lock expired while the range was written; resume from the current offset.", 409)
+            pipe = self.redis_client.pipeline()
+            self._touch(pipe, upload_id, session['storage_name'])
+            pipe.execute()
+        finally:
+            release = _get_script(self.redis_client, '_upload_release_lock_script', _RELEASE_LOCK_LUA)
+            release(keys=[lock_key], args=[token])
+
+        if written < length:
+            raise UploadSessionError("The range ended early; resume from the returned offset.", 400, offset)
+        return {'upload_id': upload_id, 'offset': offset, 'size': session['size'], 'complete': offset == session['size']}
+
+    def complete(self, upload_id, user_id) -> FileStorage:
+        """
+        Ends a fully received session and returns its file, ready for
+        save_upload(). The session cannot be used again afterwards.
+        """
+        session = self.get(upload_id, user_id)
+        if session['offset'] != session['size']:
+            raise UploadSessionError("Upload is not complete.", 409, session['offset'])
+
+        # The expiry entry stays: if the caller never moves the file into place,
+        # purge_expired() still deletes it.
+        if not self.redis_client.delete(_session_key(upload_id)):
+            raise UploadSessionError("Upload session not found or expired.", 404)
+
+        path = os.path.join(self.upload_folder, session['storage_name'])
+        return FileStorage(
+            stream=AssembledUpload(path, session['storage_name'], session['size']),
+            filename=session['filename'],
+            content_type=session['content_type'],
+        )
+
+    def abort(self, upload_id, user_id):
+        session = self.get(upload_id, user_id)
+        pipe = self.redis_client.pipeline()
+        pipe.delete(_session_key(upload_id))
+        pipe.zrem(_EXPIRY_INDEX_KEY, session['storage_name'])
+        pipe.execute()
+        self._remove_part(session['storage_name'])
+
+    def purge_expired(self) -> int:
+        """Deletes the part files of sessions that expired without completing."""
+        try:
+            expired = self.redis_client.zrangebyscore(_EXPIRY_INDEX_KEY, 0, time.time())
+            for name in expired:
+                name = name.decode() if isinstance(name, bytes) else name
+                self._remove_part(name)
+                self.redis_client.zrem(_EXPIRY_INDEX_KEY, name)
+            return len(expired)
+        except Exception as e:
+            logger.warning(f"Could not purge expired upload sessions: {e}")
+            return 0
+
+    def _remove_part(self, storage_name: str):
+        try:
+            os.remove(self._part_path(storage_name))
+        except FileNotFoundError:
+            pass
@@ -7,6 +7,12 @@ import re
 import time
 from flask import current_app
 from ..models.provider import Provider
+from ..services.storage import get_storage
+from ..services.response_cache import memoize_response, uncached
+from ..services.prompt_cache import (
+    CACHE_FLAG, split_stable_prefix, prefix_fingerprint, prefix_cache_key, record_usage,
+    get_gemini_handle, remember_gemini_handle, forget_gemini_handle,
+)
 from typing import Dict, List, Generator, Optional
 import importlib
 import logging
@@ -49,8 +55,12 @@ class GeminiSearchClient:
         temperature: float = 0.2,
         top_p: float = 0.9,
         max_output_tokens: int = 1024,
+        client=None,
     ):
-        self.client = genai.Client(api_key=api_key)
+        # `client` lets tests pass a stub in place of the SDK client.
+        self.client = client or genai.Client(api_key=api_key)
+        # Cached contents belong to the key's project.
+        self.key_fingerprint = prefix_fingerprint(api_key)[:16]
         self.model_id = model_id
         self.service_id = service_id
         self.max_retries = max_retries
@@ -78,7 +88,7 @@ class GeminiSearchClient:
                 max_output_tokens=self.max_output_tokens
             )
 
-    def _prepare_contents(self, messages: List[Dict[str, str]]) -> List[types.Content]:
+    def _prepare_contents(self, messages: List[Dict[str, str]], guide: bool = True) -> List[types.Content]:
         """
         Convert simple message dicts into google.genai Content objects.
         """
@@ -89,7 +99,7 @@ class GeminiSearchClient:
             if not text:
                 continue
             # If this is the first user message and we want to guide depth/accuracy, prepend a prompt
-            if msg.get("role") == "user" and not any(c.role == "user" for c in contents):
+            if guide and msg.get("role") == "user" and not any(c.role == "user" for c in contents):
                 guide = (
                     "Please provide accurate, well‑researched, and in‑depth answers, "
                     "grounded in the latest information. "
@@ -104,8 +114,50 @@ class GeminiSearchClient:
             )
         return contents
 
+    def _prefix_fingerprint(self, prefix: List[Dict[str, str]]) -> str:
+        return prefix_fingerprint(self.key_fingerprint, self.model_id, *(f"{m['role']}:{m['content']}" for m in prefix))
+
+    def _cached_prefix(self, prefix: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Returns the name of a cached content holding `prefix`, creating it if
+        needed, or None when the prefix is too short or caching is unavailable.
+        """
+        if sum(len(m.get("content", "")) for m in prefix) // 4 < current_app.config['GEMINI_CONTEXT_CACHE_MIN_TOKENS']:
+            return None
+        fingerprint = self._prefix_fingerprint(prefix)
+        name = get_gemini_handle(fingerprint)
+        if name is not None:
+            return name or None  # '' records that this prefix could not be cached.
+
+        ttl = current_app.config['GEMINI_CONTEXT_CACHE_TTL_SECONDS']
+        try:
+            cache = self.client.caches.create(
+                model=self.model_id,
+                config=types.CreateCachedContentConfig(
+                    contents=self._prepare_contents(prefix),
+                    ttl=f"{ttl}s",
+                    display_name=f"prefix-{fingerprint[:12]}",
+                ),
+            )
+        except Exception as exc:
+            self.logger.warning(f"Could not cache a Gemini prompt prefix for {self.model_id}: {exc}")
+            remember_gemini_handle(fingerprint, '', ttl)
+            return None
+        remember_gemini_handle(fingerprint, cache.name, ttl)
+        return cache.name
+
     def get_response_stream(self, messages: List[Dict[str, str]]) -> Generator[str, None, None]:
-        contents = self._prepare_contents(messages)
+        contents, config = self._prepare_contents(messages), self.config
+        cached_name = None
+
+        # A stable prefix (agent prompt, transcript, summary) is sent as cached
+        # content. Search grounding cannot be combined with cached content.
+        prefix, rest = split_stable_prefix(messages)
+        if prefix and rest and self.service_id != "chat-search":
+            cached_name = self._cached_prefix(prefix)
+            if cached_name:
+                contents = self._prepare_contents(rest, guide=False)
+                config = self.config.model_copy(update={"cached_content": cached_name})
         last_exc = None
 
         for attempt in range(1, self.max_retries + 1):
@@ -113,16 +165,24 @@ class GeminiSearchClient:
                 stream = self.client.models.generate_content_stream(
                     model=self.model_id,
                     contents=contents,
-                    config=self.config
+                    config=config
                 )
+                usage = None
                 for chunk in stream:
+                    usage = getattr(chunk, 'usage_metadata', None) or usage
                     text = getattr(chunk, 'text', None) or getattr(chunk, 'content', None)
                     if text:
                         yield text
+                if usage is not None:
+                    record_usage('google', usage.prompt_token_count or 0, usage.cached_content_token_count or 0)
                 return
             except Exception as exc:
                 last_exc = exc
                 self.logger.warning(f"Gemini attempt {attempt} failed: {exc}")
+                if cached_name:
+                    # The cached content may have expired early; retry with the full prompt.
+                    forget_gemini_handle(self._prefix_fingerprint(prefix))
+                    contents, config, cached_name = self._prepare_contents(messages), self.config, None
                 time.sleep(self.backoff_factor * attempt)
 
         yield f"⚠️ Gemini API Error after {self.max_retries} attempts: {last_exc}"
@@ -329,17 +389,25 @@ def _get_gemini_response(
         yield f"⚠️ Gemini API Error: {str(exc)}"
 
 # --- [MODIFIED] This function now handles the full tool-use lifecycle for OpenAI ---
+def _record_openai_usage(usage):
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    record_usage('openai', usage.prompt_tokens or 0, (getattr(details, 'cached_tokens', 0) or 0) if details else 0)
+
+
 def _get_openai_response(
     api_key: str,
     model_id: str,
     messages: List[Dict[str, str]],
     service_id: Optional[str] = None,
+    client=None,
 ) -> Generator[str, None, None]:
     """
     Handles a full conversation with OpenAI, including multi-step tool use.
     Streams the final response after executing tools.
     """
-    client = openai.OpenAI(api_key=api_key)
+    client = client or openai.OpenAI(api_key=api_key)
     
     # Filter out empty messages
     convo = [
@@ -347,6 +415,11 @@ def _get_openai_response(
         for m in messages if m.get("content", "").strip()
     ]
 
+    # OpenAI caches identical prompt prefixes automatically. The stable part
+    # comes first; its key sends follow-ups to the machines holding that cache.
+    prefix, _ = split_stable_prefix(messages)
+    cache_args = {"extra_body": {"prompt_cache_key": prefix_cache_key(model_id, prefix)}} if prefix else {}
+
     # --- Handle Web Search via Tool Use ---
     if service_id == "chat-search":
         # Define the custom web search tool
@@ -378,7 +451,9 @@ def _get_openai_response(
                 messages=convo,
                 tools=tools,
                 tool_choice={"type": "function", "function": {"name": "web_search"}},
+                **cache_args,
             )
+            _record_openai_usage(initial_response.usage)
             response_message = initial_response.choices[0].message
 
             # Step 2: Check if the model responded with a tool call
@@ -409,10 +484,14 @@ def _get_openai_response(
                     model=model_id,
                     messages=convo,
                     stream=True,
+                    stream_options={"include_usage": True},
+                    **cache_args,
                 )
                 for chunk in stream:
                     if chunk.choices and chunk.choices[0].delta.content:
                         yield chunk.choices[0].delta.content
+                    elif getattr(chunk, 'usage', None):
+                        _record_openai_usage(chunk.usage)
             else:
                 # Fallback: No tool was used, just yield the initial response content
                 current_app.logger.info("No tool use detected by OpenAI. Yielding initial response.")
@@ -429,29 +508,73 @@ def _get_openai_response(
             stream = client.chat.completions.create(
                 model=model_id,
                 messages=convo,
-                stream=True
+                stream=True,
+                stream_options={"include_usage": True},
+                **cache_args
             )
             for chunk in stream:
                 if chunk.choices and chunk.choices[0].delta.content:
                     yield chunk.choices[0].delta.content
+                elif getattr(chunk, 'usage', None):
+                    _record_openai_usage(chunk.usage)
         except Exception as exc:
             logging.exception("OpenAI API stream error")
             yield f"⚠️ OpenAI API Error: {str(exc)}"
             
 # --- [MODIFIED] This function now handles the full tool-use lifecycle ---
+# Anthropic accepts at most this many cache_control breakpoints per request.
+ANTHROPIC_MAX_CACHE_BREAKPOINTS = 4
+
+
+def _anthropic_messages(messages: List[Dict[str, str]]):
+    """
+    Converts context messages for the Anthropic API: system messages go to the
+    `system` parameter, and cache_control breakpoints are set on the marked
+    stable prefixes and on the last message, so the next turn reads the
+    conversation so far from the cache. Returns (system, convo).
+    """
+    system, convo, marked = [], [], []
+    for m in messages:
+        text = m.get("content", "")
+        if not text.strip():
+            continue
+        block = {"type": "text", "text": text}
+        if m["role"] == "system":
+            system.append(block)
+        else:
+            convo.append({"role": m["role"], "content": [block]})
+        if m.get(CACHE_FLAG):
+            marked.append(block)
+    if convo:
+        marked.append(convo[-1]["content"][-1])
+    for block in marked[-ANTHROPIC_MAX_CACHE_BREAKPOINTS:]:
+        block["cache_control"] = {"type": "ephemeral"}
+    return system, convo
+
+
+def _record_anthropic_usage(usage):
+    if usage is None:
+        return
+    cached = getattr(usage, 'cache_read_input_tokens', 0) or 0
+    written = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+    # input_tokens only counts the uncached remainder of the prompt.
+    record_usage('anthropic', (usage.input_tokens or 0) + cached + written, cached, written)
+
+
 def _get_anthropic_response(
     api_key: str,
     model_id: str,
     messages: List[Dict[str, str]],
     service_id: Optional[str] = None,
+    client=None,
 ) -> Generator[str, None, None]:
     """
     Handles a full conversation with Anthropic, including multi-step tool use.
     """
-    client = anthropic.Anthropic(api_key=api_key)
+    client = client or anthropic.Anthropic(api_key=api_key)
     
     # Convert message format for the Anthropic API
-    convo = [{"role": m["role"], "content": m["content"]} for m in messages if m.get("content", "").strip()]
+    system, convo = _anthropic_messages(messages)
 
     # Define the tools if web search is enabled
     tools = []
@@ -481,10 +604,13 @@ def _get_anthropic_response(
             "max_tokens": 4096,
             "messages": convo,
         }
+        if system:
+            api_params["system"] = system
         if tools:  # Only add tools if the list is not empty
             api_params["tools"] = tools
             
         initial_response = client.messages.create(**api_params)
+        _record_anthropic_usage(initial_response.usage)
         current_app.logger.info(f"Initial response received. Stop reason: {initial_response.stop_reason}")
 
         # --- Step 2: Check if the model wants to use a tool ---
@@ -520,9 +646,11 @@ def _get_anthropic_response(
                     model=model_id,
                     max_tokens=4096,
                     messages=convo,
+                    **({"system": system} if system else {}),
                 ) as stream:
                     for text_chunk in stream.text_stream:
                         yield text_chunk
+                    _record_anthropic_usage(stream.get_final_message().usage)
             else:
                 # If for some reason no tool results were generated, yield an error.
                 yield "Error: AI requested a tool but no results were generated."
@@ -554,12 +682,9 @@ def _generate_openai_image(api_key: str, model_id: str, prompt: str, image_conte
             if not filename:
                 raise ValueError(f"Could not extract filename from URL: {image_context_url}")
             
-            local_image_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            if not os.path.exists(local_image_path):
-                raise FileNotFoundError(f"Context image not found: {local_image_path}")
-
             # Step 1: Describe the existing image using the vision model
-            image_description = _describe_image_with_vision(api_key, local_image_path)
+            with get_storage().open_local(filename) as local_image_path:
+                image_description = _describe_image_with_vision(api_key, local_image_path)
             
             # Step 2: Create a new, context-aware prompt
             contextual_prompt = _create_contextual_prompt(api_key, image_description, prompt, original_prompt)
@@ -620,12 +745,9 @@ def _generate_google_image(api_key: str, model_id: str, prompt: str) -> str:
         image_bytes = image_part.inline_data.data
         
         image_filename = f"{uuid.uuid4()}.png"
-        save_path = os.path.join(current_app.config['UPLOAD_FOLDER'], image_filename)
+        get_storage().save_bytes(image_filename, image_bytes, 'image/png')
         
-        with open(save_path, "wb") as f:
-            f.write(image_bytes)
-        
-        current_app.logger.info(f"Successfully saved generated image to {save_path}")
+        current_app.logger.info(f"Successfully saved generated image as {image_filename}")
 
         server_url = current_app.config.get("PUBLIC_SERVER_URL", "").rstrip('/')
         image_url = f"{server_url}/api/chat/uploads/{image_filename}"
@@ -711,6 +833,7 @@ def generate_image(provider_id: str, model_id: str, prompt: str, image_context_u
     else:
         raise ValueError(f"Image generation is not supported for provider '{provider_id}'.")
 
+@memoize_response(model="gpt-4o", temperature=0.0)
 def get_decomposed_claims(claim_text: str) -> list[str]:
     """
     Uses a powerful AI model to decompose a complex claim into a list of
@@ -751,7 +874,7 @@ def get_decomposed_claims(claim_text: str) -> list[str]:
     except (json.JSONDecodeError, ValueError) as e:
         logger.error(f"Failed to parse sub-claims from AI response: {e}", exc_info=True)
         # Fallback: just treat the whole claim as one
-        return [claim_text]
+        return uncached([claim_text])
 
 # =========== ===================================================================
 #  Text-To-Voice implmentation
@@ -783,6 +906,7 @@ def generate_tts_audio(provider_id: str, text_input: str, voice: str = 'alloy')
 
 
 
+@memoize_response(model="gpt-4o", temperature=0.0, response_format="json_object")
 def extract_tts_parameters(prompt: str) -> dict:
     """
     Uses GPT-4o to interpret a natural language prompt and extract structured TTS parameters.
@@ -831,7 +955,7 @@ def extract_tts_parameters(prompt: str) -> dict:
     except Exception as e:
         logger.error(f"Failed to extract TTS parameters from AI response: {e}", exc_info=True)
         # Fallback for simple prompts if JSON parsing fails
-        return {"input": prompt, "instructions": ""}
+        return uncached({"input": prompt, "instructions": ""})
 
 
 def stream_openai_tts_audio(api_key: str, model_id: str, voice: str, input_text: str, instructions: str) -> Generator[bytes, None, None]:
@@ -911,6 +1035,60 @@ def generate_google_video(api_key: str, model_id: str, prompt: str, aspect_ratio
         logger.error(f"Google Video Generation API error on initiation: {e}", exc_info=True)
         raise
 
+@memoize_response(model="gpt-4o", temperature=0.0, response_format="json_object")
+def segment_video_prompt(full_prompt: str) -> list:
+    """
+    Uses GPT-4o to break a long video prompt into a list of 8-second scene descriptions.
+    """
+    try:
+        # For a critical task like this, we hard-code a powerful model
+        provider = Provider.query.get('openai')
+        if not provider or not provider.get_api_key():
+            raise ValueError("OpenAI provider not configured for prompt segmentation.")
+        
+        client = openai.OpenAI(api_key=provider.get_api_key())
+
+        system_prompt = (
+            "You are a film director's assistant. Your task is to analyze a user's video prompt and break it down into a sequence of distinct scenes. "
+            "Each scene should describe about 8 seconds of action. "
+            "Maintain narrative and visual continuity between the scenes. "
+            "Return your response ONLY as a single, valid JSON array of strings, where each string is a detailed prompt for one scene. "
+            "Do not include any other text, markdown, or explanation."
+            'Example input: "A knight finds a sword and raises it to the sky." -> '
+            'Output: ["A knight in shining armor cautiously walking through a dark, misty forest.", "The knight stops, noticing a faint blue glow from behind a tree.", "A close-up of the knight\'s hand pulling a glowing, ornate sword from the ground.", "The knight raises the glowing sword triumphantly towards the sky, light reflecting off his armor."]'
+        )
+
+        response = client.chat.completions.create(
+            model="gpt-4o",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": full_prompt}
+            ],
+            response_format={"type": "json_object"},
+            temperature=0.0
+        )
+
+        # The response content should be a JSON string like '{"scenes": ["scene 1", "scene 2"]}'
+        # We need to parse it to get the list.
+        response_data = json.loads(response.choices[0].message.content)
+        scenes = response_data.get("scenes") # Assuming the model returns a JSON object with a "scenes" key
+
+        if not isinstance(scenes, list) or not all(isinstance(s, str) for s in scenes):
+            raise ValueError("AI did not return a valid list of scene strings.")
+            
+        logger.info(f"Prompt successfully segmented into {len(scenes)} scenes.")
+        return scenes
+
+    except Exception as e:
+        logger.error(f"Failed to segment prompt with AI: {e}", exc_info=True)
+        # Fallback: if AI fails, split by sentence or comma as a last resort
+        scenes = [scene.strip() for scene in full_prompt.split(',') if scene.strip()]
+        if not scenes:
+            scenes = [full_prompt]
+        return uncached(scenes)
+
+
+@memoize_response(model="gpt-4o", temperature=0.0, response_format="json_object")
 def parse_edit_request(edit_prompt: str, original_scenes: list) -> dict:
     """
     Uses GPT-4o to parse a natural language edit request and identify
@@ -980,13 +1158,50 @@ def rewrite_scene_prompt(original_prompt: str, modification: str) -> str:
     logger.info(f"--- Successfully rewrote prompt: '{rewritten_prompt[:60]}...' ---")
     return rewritten_prompt
 
-def get_gemini_video_understanding_response(api_key: str, model_id: str, video_path: str, prompt: str) -> Generator[dict, None, None]:
+def summarize_conversation_segment(previous_summary: str, transcript: str, model_id: str, max_tokens: int) -> str:
+    """
+    Folds the next part of a conversation into its running summary, so the
+    model can keep answering without the original messages.
+    """
+    provider = Provider.query.get('openai')
+    if not provider or not provider.get_api_key():
+        raise ValueError("OpenAI provider not configured for conversation summaries.")
+
+    client = openai.OpenAI(api_key=provider.get_api_key())
+
+    system_prompt = (
+        "You maintain the running summary of a conversation between a user and an AI assistant. "
+        "You will be given the current summary (possibly empty) and the next part of the conversation. "
+        "Return an updated summary that keeps the user's goals, preferences and constraints, facts and "
+        "figures, decisions, open questions and any code or names referred to later. Drop pleasantries. "
+        "Write in the language of the conversation. Return ONLY the summary."
+    )
+
+    response = client.chat.completions.create(
+        model=model_id,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"Current summary:\n{previous_summary or '(none)'}\n\nNext part of the conversation:\n{transcript}"}
+        ],
+        max_tokens=max_tokens,
+        temperature=0.2
+    )
+    return response.choices[0].message.content.strip()
+
+def get_gemini_video_understanding_response(api_key: str, model_id: str, video_path: str, prompt: str,
+                                            cached_file_name: str = None, on_file_uploaded=None) -> Generator[dict, None, None]:
     """
     Uploads a video, asks a question about it using the Gemini API,
     streams the text response, and cleans up the uploaded file.
+
+    If `cached_file_name` names an earlier upload that is still active, it is
+    used instead of uploading again. If `on_file_uploaded` is given, a new
+    upload is kept for reuse and its name is passed to the callback.
     """
     logger.info("--- VIDEO UNDERSTANDING TASK STARTED ---") # <-- ADDED LOGGING
     video_file = None
+    # Files that may be reused by later requests are left for Gemini to expire.
+    keep_file = cached_file_name is not None or on_file_uploaded is not None
     try:
         client = genai.Client(api_key=api_key)
         
@@ -995,25 +1210,39 @@ def get_gemini_video_understanding_response(api_key: str, model_id: str, video_p
         logger.info(f"  Video Path: {video_path}")
         logger.info(f"  Initial Prompt: {prompt}")
 
-        yield {"type": "status", "data": "1/3: Uploading video..."}
-        
-        logger.info("Step 1: Uploading file to Google AI File API...") # <-- ADDED LOGGING
-        video_file = client.files.upload(file=video_path)
-        logger.info(f"Step 1 COMPLETE. File Name: {video_file.name}, URI: {video_file.uri}") # <-- ADDED LOGGING
-        
-        yield {"type": "status", "data": "2/3: Processing video..."}
-        
-        logger.info("Step 2: Polling for file processing status...") # <-- ADDED LOGGING
-        while video_file.state.name == "PROCESSING":
-            time.sleep(5) # Shortened for faster debugging
-            video_file = client.files.get(name=video_file.name)
-            logger.info(f"  Polling... Current state is: {video_file.state.name}") # <-- ADDED LOGGING
-
-        if video_file.state.name == "FAILED":
-            logger.error(f"Step 2 FAILED. Google AI could not process the file: {video_file.name}") # <-- ADDED LOGGING
-            raise ValueError("Google AI failed to process the video file.")
-
-        logger.info(f"Step 2 COMPLETE. File state is ACTIVE.") # <-- ADDED LOGGING
+        if cached_file_name:
+            try:
+                video_file = client.files.get(name=cached_file_name)
+                if video_file.state.name != "ACTIVE":
+                    video_file = None
+            except Exception as e:
+                logger.info(f"Cached file {cached_file_name} is no longer usable, uploading again: {e}")
+                video_file = None
+            if video_file:
+                logger.info(f"Steps 1-2 SKIPPED. Reusing uploaded file {video_file.name}.")
+
+        if video_file is None:
+            yield {"type": "status", "data": "1/3: Uploading video..."}
+            
+            logger.info("Step 1: Uploading file to Google AI File API...") # <-- ADDED LOGGING
+            video_file = client.files.upload(file=video_path)
+            logger.info(f"Step 1 COMPLETE. File Name: {video_file.name}, URI: {video_file.uri}") # <-- ADDED LOGGING
+            
+            yield {"type": "status", "data": "2/3: Processing video..."}
+            
+            logger.info("Step 2: Polling for file processing status...") # <-- ADDED LOGGING
+            while video_file.state.name == "PROCESSING":
+                time.sleep(5) # Shortened for faster debugging
+                video_file = client.files.get(name=video_file.name)
+                logger.info(f"  Polling... Current state is: {video_file.state.name}") # <-- ADDED LOGGING
+
+            if video_file.state.name == "FAILED":
+                logger.error(f"Step 2 FAILED. Google AI could not process the file: {video_file.name}") # <-- ADDED LOGGING
+                raise ValueError("Google AI failed to process the video file.")
+
+            logger.info(f"Step 2 COMPLETE. File state is ACTIVE.") # <-- ADDED LOGGING
+            if on_file_uploaded:
+                on_file_uploaded(video_file.name)
         yield {"type": "status", "data": "3/3: Analyzing content..."}
         
 
@@ -1040,7 +1269,7 @@ def get_gemini_video_understanding_response(api_key: str, model_id: str, video_p
         logger.error(f"An exception occurred in Gemini video understanding: {e}", exc_info=True) # <-- ADDED LOGGING
         raise
     finally:
-        if video_file:
+        if video_file and not keep_file:
             logger.info(f"Step 4: Cleaning up file {video_file.name}.") # <-- ADDED LOGGING
             client.files.delete(name=video_file.name)
 
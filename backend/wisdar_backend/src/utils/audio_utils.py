@@ -1,15 +1,14 @@
 # In backend/wisdar_backend/src/utils/audio_utils.py
 
 import os
-import uuid
 import json
 import requests
 from flask import current_app
-from werkzeug.utils import secure_filename
 import librosa
 import soundfile as sf
 import math
 from pydub import AudioSegment
+from .upload_utils import save_upload
 
 ALLOWED_EXTENSIONS = {
     # Audio
@@ -26,13 +25,9 @@ def allowed_file(filename: str) -> bool:
 
 def save_file_locally(file) -> tuple:
     """Save uploaded file with a unique filename"""
-    filename = secure_filename(file.filename)
-    # --- CHANGE IS HERE ---
-    unique_filename = f"{uuid.uuid4()}-{filename}"
-    save_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-    file.save(save_path)
+    saved = save_upload(file)
     # Return both the full path for backend use and the filename for DB storage
-    return save_path, unique_filename 
+    return saved.path, saved.filename
 
 def convert_audio_to_wav(file_path: str, original_filename: str) -> str:
     """Convert audio to 16kHz mono WAV format optimized for ASR"""
@@ -0,0 +1,125 @@
+# In backend/wisdar_backend/src/utils/upload_utils.py
+"""
+Single-pass handling of multipart uploads.
+
+By default Werkzeug spools every uploaded file to a temporary file, which the
+routes then copy into UPLOAD_FOLDER and stat again for its size. With the
+request class below, file parts are written straight into UPLOAD_FOLDER while
+being parsed, and their size and SHA-256 are computed on the way through, so a
+large video costs one disk write instead of two.
+
+Parts are written under a '.part' name, so nothing half-uploaded is ever
+visible under its final name. save_upload() renames a part into place;
+parts no route claimed (rejected or failed requests) are deleted when the
+request ends.
+"""
+
+import hashlib
+import os
+import uuid
+from collections import namedtuple
+
+from flask import Request, current_app, request
+from werkzeug.utils import secure_filename
+
+PART_SUFFIX = '.part'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+SavedUpload = namedtuple('SavedUpload', ['path', 'filename', 'size', 'sha256'])
+
+
+def make_unique_filename(filename: str) -> str:
+    """Returns the name an upload is stored under in UPLOAD_FOLDER."""
+    return f"{uuid.uuid4()}-{secure_filename(filename)}"
+
+
+class StreamedUpload:
+    """
+    The file object Werkzeug's form parser writes a file part into. Every write
+    goes straight to disk and into the running size and hash; everything else
+    is delegated to the underlying file.
+    """
+
+    def __init__(self, upload_folder: str, original_filename: str):
+        self.filename = make_unique_filename(original_filename)
+        self.path = os.path.join(upload_folder, self.filename)
+        self.part_path = self.path + PART_SUFFIX
+        self.size = 0
+        self.claimed = False
+        self._hash = hashlib.sha256()
+        self._file = open(self.part_path, 'w+b')
+
+    def write(self, data) -> int:
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class StreamingUploadRequest(Request):
+    """Request class that parses multipart file parts directly into UPLOAD_FOLDER."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.streamed_uploads = []
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        upload = StreamedUpload(current_app.config['UPLOAD_FOLDER'], filename)
+        self.streamed_uploads.append(upload)
+        return upload
+
+
+def save_upload(file) -> SavedUpload:
+    """
+    Stores an uploaded file in UPLOAD_FOLDER under a unique name and returns
+    where it went along with its size and SHA-256.
+    """
+    stream = file.stream
+    if isinstance(stream, StreamedUpload):
+        # Already on disk: flush and move it into place, no copy needed.
+        stream.flush()
+        os.replace(stream.part_path, stream.path)
+        stream.claimed = True
+        stream.close()
+        return SavedUpload(stream.path, stream.filename, stream.size, stream.sha256)
+
+    # Fallback for uploads parsed by the default stream factory: copy once,
+    # hashing and counting as we go.
+    unique_filename = make_unique_filename(file.filename)
+    save_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+    digest, size = hashlib.sha256(), 0
+    stream.seek(0)
+    with open(save_path, 'wb') as dst:
+        for chunk in iter(lambda: stream.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+            dst.write(chunk)
+    return SavedUpload(save_path, unique_filename, size, digest.hexdigest())
+
+
+def _discard_unclaimed_uploads(exc=None):
+    for upload in getattr(request, 'streamed_uploads', ()):
+        if upload.claimed:
+            continue
+        try:
+            upload.close()
+            os.remove(upload.part_path)
+        except OSError:
+            pass
+
+
+def init_streaming_uploads(app):
+    """Makes the app parse uploads straight into UPLOAD_FOLDER."""
+    app.request_class = StreamingUploadRequest
+    app.teardown_request(_discard_unclaimed_uploads)
@@ -34,13 +34,14 @@ def split_video_into_chunks(video_path: str, chunk_duration_sec: int = 360) -> l
     
     return chunk_paths
 
-def extract_audio_from_video(video_path: str) -> str:
+def extract_audio_from_video(video_path: str, audio_path: str = None) -> str:
     """
-    Extracts audio from a video file and saves it as a WAV file.
+    Extracts audio from a video file and saves it as a WAV file, next to the
+    video unless `audio_path` is given.
     Returns the path to the new audio file.
     """
     try:
-        audio_path = os.path.splitext(video_path)[0] + ".wav"
+        audio_path = audio_path or os.path.splitext(video_path)[0] + ".wav"
         with VideoFileClip(video_path) as video_clip:
             video_clip.audio.write_audiofile(audio_path, codec='pcm_s16le')
         return audio_path
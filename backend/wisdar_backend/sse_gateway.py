@@ -0,0 +1,350 @@
+# sse_gateway.py
+"""
+Standalone asyncio SSE gateway.
+
+Serves /api/stream/events exactly like the Flask app (same JWT cookie, same
+'user-<id>' channels, same Last-Event-ID replay) but without loading Flask,
+Celery, SQLAlchemy or any of the media/AI libraries. Route /api/stream/ to
+this process in the reverse proxy to scale the fan-out tier independently:
+
+    python sse_gateway.py
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+import uuid
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit, parse_qs
+
+import jwt
+import redis.asyncio as aioredis
+from dotenv import load_dotenv
+
+from src.services.sse_protocol import (
+    ACCESS_COOKIE_NAME,
+    HEARTBEAT_FRAME,
+    USER_CHANNEL_PATTERN,
+    decode_access_token,
+    event_id_key,
+    event_stream_key,
+    format_sse,
+    is_valid_event_id,
+    parse_pubsub_message,
+    presence_key,
+    user_channel,
+)
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('sse_gateway')
+
+STREAM_PATH = '/api/stream/events'
+MAX_REQUEST_HEAD_BYTES = 16 * 1024
+
+
+class GatewayClient:
+    """A single connected SSE stream and its pending (event_id, payload) pairs."""
+
+    def __init__(self, client_id: int, user_id, queue_size: int):
+        self.id = client_id
+        self.user_id = user_id
+        self.channel = user_channel(user_id)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+
+class SSEGateway:
+    """Owns one Pub/Sub subscription and fans events out to every connected client."""
+
+    def __init__(self, redis_url: str, jwt_secret_key: str, queue_size: int = 256, replay_max_events: int = 2000,
+                 heartbeat_seconds: float = 15.0, idle_timeout: float = 60.0, max_connections_per_user: int = 10,
+                 presence_ttl: int = 45):
+        self.redis = aioredis.from_url(redis_url)
+        self.jwt_secret_key = jwt_secret_key
+        self.queue_size = queue_size
+        self.replay_max_events = replay_max_events
+        self.heartbeat_seconds = heartbeat_seconds
+        self.idle_timeout = idle_timeout
+        self.max_connections_per_user = max_connections_per_user
+        self.presence_ttl = presence_ttl
+        self.instance_id = uuid.uuid4().hex
+        self._clients = {}  # channel -> {client_id: GatewayClient}
+        self._ids = itertools.count(1)
+        self._messages_routed = 0
+        self._dropped_events = 0
+        self._streams_opened = 0
+        self._streams_closed = 0
+        self._streams_reaped = 0
+        self._streams_rejected = 0
+
+    # --------------------------------------------------------------------------
+    #  Pub/Sub listener
+    # --------------------------------------------------------------------------
+    async def listen_forever(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(USER_CHANNEL_PATTERN)
+                logger.info(f"Gateway subscribed to '{USER_CHANNEL_PATTERN}'.")
+                async for message in pubsub.listen():
+                    if message['type'] == 'pmessage':
+                        self._dispatch(message['channel'], message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Gateway listener failed, reconnecting: {e}", exc_info=True)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(1)
+
+    def _dispatch(self, channel, data: bytes):
+        if isinstance(channel, bytes):
+            channel = channel.decode('utf-8')
+        channel_clients = self._clients.get(channel)
+        if not channel_clients:
+            return
+
+        self._messages_routed += 1
+        event = parse_pubsub_message(data)
+        for client in list(channel_clients.values()):
+            try:
+                client.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._dropped_events += 1
+
+    # --------------------------------------------------------------------------
+    #  Presence
+    # --------------------------------------------------------------------------
+    async def _refresh_presence(self, channels):
+        """Marks this gateway as holding streams for the given channels."""
+        if not channels:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for channel in channels:
+                pipe.hset(presence_key(channel), self.instance_id, 1)
+                pipe.expire(presence_key(channel), self.presence_ttl)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Gateway failed to refresh presence: {e}")
+
+    async def refresh_presence_forever(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            await self._refresh_presence(list(self._clients))
+
+    # --------------------------------------------------------------------------
+    #  HTTP handling
+    # --------------------------------------------------------------------------
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            method, target, headers = self._parse_request_head(head)
+            url = urlsplit(target)
+
+            if method == 'GET' and url.path == STREAM_PATH:
+                await self._serve_stream(writer, headers, parse_qs(url.query))
+            elif method == 'GET' and url.path == '/healthz':
+                await self._write_json(writer, 200, self.stats())
+            else:
+                await self._write_json(writer, 404, {'error': 'Not found'})
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logger.error(f"Gateway connection failed: {e}", exc_info=True)
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _parse_request_head(head: bytes):
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, _ = lines[0].split(' ', 2)
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    def _authenticate(self, headers: dict):
+        cookie = SimpleCookie()
+        cookie.load(headers.get('cookie', ''))
+        morsel = cookie.get(ACCESS_COOKIE_NAME)
+        if morsel is None:
+            return None
+        try:
+            return decode_access_token(morsel.value, self.jwt_secret_key)
+        except jwt.InvalidTokenError:
+            return None
+
+    @staticmethod
+    def _cors_headers(headers: dict) -> str:
+        origin = headers.get('origin')
+        if not origin:
+            return ''
+        return f"Access-Control-Allow-Origin: {origin}\r\nAccess-Control-Allow-Credentials: true\r\nVary: Origin\r\n"
+
+    async def _write_json(self, writer, status: int, body: dict):
+        reasons = {200: 'OK', 401: 'Unauthorized', 404: 'Not Found', 429: 'Too Many Requests'}
+        payload = json.dumps(body).encode('utf-8')
+        writer.write(
+            f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1')
+            + payload
+        )
+        await writer.drain()
+
+    async def _send(self, writer, frame: bytes):
+        """
+        Writes a frame and waits for it to be flushed. A peer that has not
+        accepted the data within `idle_timeout` is treated as dead.
+        """
+        writer.write(frame)
+        await asyncio.wait_for(writer.drain(), timeout=self.idle_timeout)
+
+    async def _serve_stream(self, writer, headers: dict, query: dict):
+        user_id = self._authenticate(headers)
+        if user_id is None:
+            await self._write_json(writer, 401, {'msg': 'Missing or invalid access token'})
+            return
+
+        last_event_id = headers.get('last-event-id') or query.get('last_event_id', [None])[0]
+
+        channel = user_channel(user_id)
+        if self.max_connections_per_user and len(self._clients.get(channel, {})) >= self.max_connections_per_user:
+            self._streams_rejected += 1
+            await self._write_json(writer, 429, {'message': 'Too many open event streams'})
+            return
+
+        # Register before reading the replay so nothing published in between is lost.
+        client = GatewayClient(next(self._ids), user_id, self.queue_size)
+        first_for_channel = channel not in self._clients
+        self._clients.setdefault(channel, {})[client.id] = client
+        self._streams_opened += 1
+        reaped = False
+        try:
+            if first_for_channel:
+                await self._refresh_presence([channel])
+            writer.write(
+                ("HTTP/1.1 200 OK\r\n"
+                 "Content-Type: text/event-stream\r\n"
+                 "Cache-Control: no-cache\r\n"
+                 "X-Accel-Buffering: no\r\n"
+                 "Connection: close\r\n"
+                 f"{self._cors_headers(headers)}\r\n").encode('latin-1')
+            )
+
+            newest_seen = None
+            if is_valid_event_id(last_event_id):
+                newest_seen = event_id_key(last_event_id)
+                entries = await self.redis.xrange(
+                    event_stream_key(client.channel), min=f"({last_event_id}", max='+', count=self.replay_max_events
+                )
+                for entry_id, fields in entries:
+                    entry_id = entry_id.decode('ascii')
+                    newest_seen = event_id_key(entry_id)
+                    writer.write(format_sse(fields[b'data'], entry_id))
+            await asyncio.wait_for(writer.drain(), timeout=self.idle_timeout)
+
+            while True:
+                try:
+                    event_id, event_data = await asyncio.wait_for(client.queue.get(), timeout=self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    await self._send(writer, HEARTBEAT_FRAME)
+                    continue
+                if newest_seen is not None and is_valid_event_id(event_id) and event_id_key(event_id) <= newest_seen:
+                    continue
+                await self._send(writer, format_sse(event_data, event_id))
+        except asyncio.TimeoutError:
+            reaped = True
+            logger.info(f"Reaped idle SSE stream {client.id} for user {client.user_id}.")
+        finally:
+            if reaped:
+                self._streams_reaped += 1
+            else:
+                self._streams_closed += 1
+            channel_clients = self._clients.get(client.channel, {})
+            channel_clients.pop(client.id, None)
+            if not channel_clients:
+                self._clients.pop(client.channel, None)
+                # Left to expire, as in SSEBroker: a reconnect grace period for replay.
+                await self._refresh_presence([client.channel])
+
+    # --------------------------------------------------------------------------
+    #  Stats
+    # --------------------------------------------------------------------------
+    def stats(self) -> dict:
+        clients = [c for channel_clients in self._clients.values() for c in channel_clients.values()]
+        depths = [c.queue.qsize() for c in clients]
+        return {
+            'connected_clients': len(clients),
+            'connected_users': len(self._clients),
+            'max_connections_per_user': self.max_connections_per_user,
+            'streams_opened': self._streams_opened,
+            'streams_closed': self._streams_closed,
+            'streams_reaped': self._streams_reaped,
+            'streams_rejected': self._streams_rejected,
+            'queue_depth_total': sum(depths),
+            'queue_depth_max': max(depths, default=0),
+            'messages_routed': self._messages_routed,
+            'dropped_events': self._dropped_events,
+        }
+
+
+async def main():
+    # Sharded Pub/Sub and Redis Cluster are only supported by the Flask SSE
+    # tier (src/services/sse_broker.py); this gateway pattern-subscribes.
+    for flag in ('REDIS_EVENTS_CLUSTER', 'SSE_SHARDED_PUBSUB'):
+        if os.getenv(flag, 'false').lower() == 'true':
+            raise SystemExit(f"{flag} is not supported by the SSE gateway; serve /api/stream/events from the Flask app instead.")
+
+    gateway = SSEGateway(
+        redis_url=os.getenv("REDIS_EVENTS_URL") or os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        jwt_secret_key=os.getenv('JWT_SECRET_KEY', 'your-super-secret-jwt-key'),
+        queue_size=int(os.getenv("SSE_CLIENT_QUEUE_SIZE", 256)),
+        replay_max_events=int(os.getenv("SSE_REPLAY_MAX_EVENTS", 2000)),
+        heartbeat_seconds=int(os.getenv("SSE_HEARTBEAT_SECONDS", 15)),
+        idle_timeout=int(os.getenv("SSE_IDLE_TIMEOUT_SECONDS", 60)),
+        max_connections_per_user=int(os.getenv("SSE_MAX_CONNECTIONS_PER_USER", 10)),
+        presence_ttl=int(os.getenv("SSE_PRESENCE_TTL_SECONDS", 45)),
+    )
+    host = os.getenv('SSE_GATEWAY_HOST', '0.0.0.0')
+    port = int(os.getenv('SSE_GATEWAY_PORT', 5001))
+
+    listener = asyncio.create_task(gateway.listen_forever())
+    presence = asyncio.create_task(gateway.refresh_presence_forever())
+    server = await asyncio.start_server(gateway.handle_connection, host, port, limit=MAX_REQUEST_HEAD_BYTES)
+    logger.info(f"SSE gateway listening on {host}:{port}{STREAM_PATH}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows
+
+    async with server:
+        await stop.wait()
+    listener.cancel()
+    presence.cancel()
+    logger.info("SSE gateway stopped.")
+
+
+if __name__ == '__main__':
+    try:
+        import uvloop  # Optional: a faster event loop where available.
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(main())
@@ -0,0 +1,220 @@
+# tests/test_prompt_cache.py
+"""Provider prompt caching, exercised with stubbed SDK clients."""
+
+from types import SimpleNamespace
+
+import pytest
+
+from src.services import prompt_cache
+from src.utils.ai_integration import (
+    ANTHROPIC_MAX_CACHE_BREAKPOINTS, GeminiSearchClient, _anthropic_messages,
+    _get_anthropic_response, _get_openai_response,
+)
+
+TRANSCRIPT = "A long video transcript. " * 200
+
+
+@pytest.fixture
+def config(app, redis_client):
+    app.config.update(GEMINI_CONTEXT_CACHE_MIN_TOKENS=100, GEMINI_CONTEXT_CACHE_TTL_SECONDS=3600)
+    return app.config
+
+
+def _today_stats(provider_id):
+    (day_stats,) = prompt_cache.get_stats(days=1).values()
+    return day_stats[provider_id]
+
+
+def _conversation(question):
+    return [
+        {"role": "user", "content": TRANSCRIPT, "cache": True},
+        {"role": "user", "content": question},
+    ]
+
+
+# ==============================================================================
+#  HIT / MISS STATISTICS
+# ==============================================================================
+def test_record_usage_counts_hits_and_misses(config):
+    prompt_cache.record_usage('openai', 2000, cached_tokens=1536)
+    prompt_cache.record_usage('openai', 2000)
+    prompt_cache.record_usage('openai', 2000, cached_tokens=1024, cache_write_tokens=0)
+
+    stats = _today_stats('openai')
+    assert stats['requests'] == 3
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+    assert stats['input_tokens'] == 6000
+    assert stats['cached_tokens'] == 2560
+    assert stats['hit_rate'] == pytest.approx(0.667)
+
+
+# ==============================================================================
+#  ANTHROPIC
+# ==============================================================================
+def _breakpoints(system, convo):
+    blocks = system + [block for message in convo for block in message["content"]]
+    return [block["text"] for block in blocks if "cache_control" in block]
+
+
+def test_anthropic_breakpoints_on_marked_prefix_and_last_message():
+    system, convo = _anthropic_messages([
+        {"role": "system", "content": "You are a video assistant.", "cache": True},
+        {"role": "user", "content": "Earlier question"},
+        {"role": "assistant", "content": "Earlier answer"},
+        {"role": "user", "content": "New question"},
+    ])
+    assert [block["text"] for block in system] == ["You are a video assistant."]
+    assert [message["role"] for message in convo] == ["user", "assistant", "user"]
+    assert _breakpoints(system, convo) == ["You are a video assistant.", "New question"]
+
+
+def test_anthropic_breakpoints_are_capped_keeping_the_newest():
+    messages = [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"prefix {i}", "cache": True}
+        for i in range(6)
+    ] + [{"role": "user", "content": "New question"}]
+
+    system, convo = _anthropic_messages(messages)
+    breakpoints = _breakpoints(system, convo)
+    assert len(breakpoints) == ANTHROPIC_MAX_CACHE_BREAKPOINTS
+    assert breakpoints == ["prefix 3", "prefix 4", "prefix 5", "New question"]
+
+
+class _StubAnthropicClient:
+    def __init__(self, cache_read_tokens):
+        self.requests = []
+        self.messages = SimpleNamespace(create=self._create)
+        self._cache_read_tokens = cache_read_tokens
+
+    def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        return SimpleNamespace(
+            stop_reason="end_turn",
+            content=[SimpleNamespace(type="text", text="answer")],
+            usage=SimpleNamespace(input_tokens=20, cache_read_input_tokens=self._cache_read_tokens,
+                                  cache_creation_input_tokens=0),
+        )
+
+
+def test_anthropic_response_sends_breakpoints_and_records_hit(config):
+    client = _StubAnthropicClient(cache_read_tokens=1500)
+    messages = [{"role": "system", "content": "Be brief."}] + _conversation("What happens at the end?")
+
+    assert "".join(_get_anthropic_response("key", "claude-model", messages, client=client)) == "answer"
+
+    (request,) = client.requests
+    assert request["system"] == [{"type": "text", "text": "Be brief."}]
+    assert _breakpoints([], request["messages"]) == [TRANSCRIPT, "What happens at the end?"]
+    stats = _today_stats('anthropic')
+    assert (stats['hits'], stats['cached_tokens'], stats['input_tokens']) == (1, 1500, 1520)
+
+
+# ==============================================================================
+#  OPENAI
+# ==============================================================================
+class _StubOpenAIClient:
+    def __init__(self, cached_tokens):
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self._cached_tokens = list(cached_tokens)
+
+    def _create(self, **kwargs):
+        self.requests.append(kwargs)
+        usage = SimpleNamespace(prompt_tokens=1800,
+                                prompt_tokens_details=SimpleNamespace(cached_tokens=self._cached_tokens.pop(0)))
+        return iter([
+            SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="answer"))], usage=None),
+            SimpleNamespace(choices=[], usage=usage),
+        ])
+
+
+def _cache_key(request):
+    return request.get("extra_body", {}).get("prompt_cache_key")
+
+
+def test_openai_prompt_cache_key_is_stable_for_the_same_prefix(config):
+    client = _StubOpenAIClient(cached_tokens=[0, 1536, 0, 0])
+
+    for messages in (
+        _conversation("First question"),
+        _conversation("Second question"),
+        [{"role": "user", "content": "Another transcript", "cache": True}, {"role": "user", "content": "First question"}],
+        [{"role": "user", "content": "No stable prefix"}],
+    ):
+        assert "".join(_get_openai_response("key", "gpt-4o", messages, client=client)) == "answer"
+
+    same_first, same_second, other_prefix, no_prefix = client.requests
+    assert _cache_key(same_first) and _cache_key(same_first) == _cache_key(same_second)
+    assert _cache_key(other_prefix) != _cache_key(same_first)
+    assert "extra_body" not in no_prefix
+    # The marker is not sent to the API.
+    assert all("cache" not in message for message in same_first["messages"])
+
+    stats = _today_stats('openai')
+    assert (stats['requests'], stats['hits'], stats['misses']) == (4, 1, 3)
+
+
+# ==============================================================================
+#  GEMINI
+# ==============================================================================
+class _StubGeminiClient:
+    def __init__(self, failing_cached_calls=0):
+        self.created = []
+        self.stream_configs = []
+        self.caches = SimpleNamespace(create=self._create_cache)
+        self.models = SimpleNamespace(generate_content_stream=self._stream)
+        self._failing_cached_calls = failing_cached_calls
+
+    def _create_cache(self, model, config):
+        self.created.append(config)
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+    def _stream(self, model, contents, config):
+        self.stream_configs.append(config)
+        if config.cached_content and self._failing_cached_calls:
+            self._failing_cached_calls -= 1
+            raise RuntimeError("cached content not found")
+        usage = SimpleNamespace(prompt_token_count=1500,
+                                cached_content_token_count=1400 if config.cached_content else 0)
+        return iter([SimpleNamespace(text="answer", usage_metadata=usage)])
+
+
+def _gemini(stub, service_id="chat"):
+    return GeminiSearchClient("key", model_id="gemini-model", service_id=service_id, backoff_factor=0, client=stub)
+
+
+def test_gemini_reuses_the_cached_prefix_handle(config):
+    stub = _StubGeminiClient()
+    gemini = _gemini(stub)
+
+    assert "".join(gemini.get_response_stream(_conversation("First question"))) == "answer"
+    assert "".join(gemini.get_response_stream(_conversation("Second question"))) == "answer"
+
+    assert len(stub.created) == 1
+    assert [config.cached_content for config in stub.stream_configs] == ["cachedContents/1"] * 2
+    assert _today_stats('google')['hits'] == 2
+
+
+def test_gemini_forgets_the_handle_and_retries_in_full_on_failure(config):
+    stub = _StubGeminiClient(failing_cached_calls=1)
+    gemini = _gemini(stub)
+    messages = _conversation("First question")
+
+    assert "".join(gemini.get_response_stream(messages)) == "answer"
+
+    assert [config.cached_content for config in stub.stream_configs] == ["cachedContents/1", None]
+    assert prompt_cache.get_gemini_handle(gemini._prefix_fingerprint(messages[:1])) is None
+    # The next turn caches the prefix again.
+    assert "".join(gemini.get_response_stream(messages)) == "answer"
+    assert len(stub.created) == 2
+    assert stub.stream_configs[-1].cached_content == "cachedContents/2"
+
+
+def test_gemini_search_does_not_use_cached_content(config):
+    stub = _StubGeminiClient()
+
+    assert "".join(_gemini(stub, service_id="chat-search").get_response_stream(_conversation("Question"))) == "answer"
+
+    assert stub.created == []
+    assert stub.stream_configs[0].cached_content is None
@@ -0,0 +1,66 @@
+# tests/test_query_counts.py
+"""
+Message.attachment is loaded with lazy='joined', so serializing messages
+costs no query per message: the statement count of the history and
+stream_start paths must not grow with the number of messages.
+"""
+
+import pytest
+
+from src.database import db, QueryCounter, assert_max_queries
+from src.models import User, Conversation, Message, Attachment
+from src.models.chat import MessageStatus
+from src.routes.chat import _paginate_messages
+
+N = 10
+
+
+def _seed(message_count: int) -> int:
+    """Creates a conversation of `message_count` messages, each with an attachment; returns its id."""
+    user = User(full_name='Test User', email=f'user{message_count}@example.com')
+    conversation = Conversation(title='History', user=user, ai_model_id='gpt-4o')
+    db.session.add(conversation)
+    for i in range(message_count):
+        message = Message(conversation=conversation, role='user' if i % 2 == 0 else 'assistant', content=f'message {i}')
+        message.attachment = Attachment(file_name=f'file{i}.wav', file_type='audio/wav', storage_url=f'ab/file{i}.wav')
+        db.session.add(message)
+    db.session.commit()
+    return conversation.id
+
+
+def _history_statements(conversation_id: int, paged: bool) -> int:
+    # Start from an empty identity map, as a new request would.
+    db.session.expunge_all()
+    with QueryCounter() as counter:
+        if paged:
+            messages, _ = _paginate_messages(conversation_id, limit=200)
+        else:
+            conversation = Conversation.query.get(conversation_id)
+            messages = conversation.messages.order_by(Message.created_at.asc(), Message.id.asc()).all()
+        payload = [message.to_dict('http://localhost/') for message in messages]
+    assert payload and all(item['attachment'] for item in payload)
+    return counter.count
+
+
+def _stream_start_statements(conversation_id: int) -> int:
+    """The steps generate_text_response takes before publishing stream_start."""
+    assistant_message_id = Message.query.filter_by(conversation_id=conversation_id, role='assistant').first().id
+    db.session.expunge_all()
+    with assert_max_queries(3) as counter:
+        assistant_message = Message.query.get(assistant_message_id)
+        assistant_message.status = MessageStatus.STREAMING
+        db.session.commit()
+        payload = assistant_message.to_dict('http://localhost/')
+    assert payload['attachment'] is not None
+    return counter.count
+
+
+@pytest.mark.parametrize('paged', [True, False])
+def test_history_statement_count_does_not_grow_with_messages(app, paged):
+    small, large = _seed(N), _seed(3 * N)
+    assert _history_statements(small, paged) == _history_statements(large, paged)
+
+
+def test_stream_start_statement_count_does_not_grow_with_messages(app):
+    small, large = _seed(N), _seed(3 * N)
+    assert _stream_start_statements(small) == _stream_start_statements(large)
@@ -16,10 +16,13 @@ import { useConversationStore } from './store/conversationStore';
 import { Routes, Route, Navigate } from 'react-router-dom';
 import InvitationPage from './pages/InvitationPage';
 import { Toaster } from "@/components/ui/sonner";
-import { authUpload } from '@/lib/api';
+import { authUpload, resumableUpload, RESUMABLE_UPLOAD_THRESHOLD } from '@/lib/api';
 
 type View = 'chat' | 'settings' | 'admin'| 'team';
 
+// Number of messages loaded per history page
+const MESSAGE_PAGE_SIZE = 50;
+
 // Add interface for SSE message queue
 interface QueuedSSEMessage {
     type: string;
@@ -39,6 +42,7 @@ const MainApplication = () => {
         conversations,
         setConversations: setStoreConversations,
         updateMessage,
+        upsertMessages,
         startStreaming,
         appendStreamChunk,
         endStreaming,
@@ -47,7 +51,6 @@ const MainApplication = () => {
         setConversationContext,
         activeProviderServiceId, // UPDATED
         startStreamingAudio,
-        appendAudioChunk,
         finishStreamingAudio,
         setConversationActiveState, // This is our good atomic action
         updateVideoJobProgress,
@@ -58,6 +61,8 @@ const MainApplication = () => {
     const [isLoading, setIsLoading] = useState<boolean>(true);
     
     const sseRef = useRef<EventSource | null>(null);
+    // Id of the last SSE event received, so a manual reconnect only replays what was missed.
+    const lastEventIdRef = useRef<string | null>(null);
     
     // FIX: Add refs for memory leak prevention and race condition handling
     const tempUrlsRef = useRef<string[]>([]);
@@ -90,12 +95,64 @@ const MainApplication = () => {
 
     // FIX: Enhanced SSE handler with race condition prevention
     useEffect(() => {        
+        // Upper bound on /chat/sync pages fetched per reconnect; the next reconnect resumes from `since`.
+        const MAX_SYNC_PAGES = 20;
+
+        // After the stream was down, fetch only what changed in the open
+        // conversation since the newest change we already have.
+        const syncActiveConversation = async () => {
+            const active = useConversationStore.getState().conversations.find(c => c.active);
+            if (!active || active.id === 'new') return;
+            const since = active.messages.reduce((latest, m) => (m.updated_at && m.updated_at > latest ? m.updated_at : latest), '');
+            if (!since) return;
+
+            try {
+                let cursor: string | null = null;
+                let hasMore = true;
+                for (let page = 0; hasMore && page < MAX_SYNC_PAGES; page++) {
+                    const position: string = cursor ? `cursor=${encodeURIComponent(cursor)}` : `since=${encodeURIComponent(since)}`;
+                    const response = await authFetch(`/chat/sync?${position}&conversation_id=${active.id}`);
+                    if (!response.ok) return;
+                    const data: {
+                        conversations: { id: number; title: string; is_pinned: boolean; is_deleted: boolean }[];
+                        messages: (Message & { status: string })[];
+                        cursor: string;
+                        has_more: boolean;
+                    } = await response.json();
+                    const { conversations: known, removeConversation } = useConversationStore.getState();
+                    data.conversations.forEach(({ id, title, is_pinned, is_deleted }) => {
+                        const local = known.find(c => String(c.id) === String(id));
+                        if (!local) return;
+                        if (is_deleted) {
+                            removeConversation(local.id);
+                        } else {
+                            setConversationContext(local.id, { title, is_pinned });
+                        }
+                    });
+                    if (data.conversations.some(c => c.is_deleted && String(c.id) === String(active.id))) return;
+                    upsertMessages(active.id, data.messages.map(({ status, ...rest }) => {
+                        // Only final server states are mapped; in-flight messages keep their live UI state.
+                        if (status === 'COMPLETE') return { ...rest, status: MessageStatus.COMPLETE } as Message;
+                        if (status === 'FAILED') return { ...rest, status: MessageStatus.FAILED } as Message;
+                        return rest as Message;
+                    }));
+                    cursor = data.cursor;
+                    hasMore = data.has_more;
+                }
+            } catch (error) {
+                console.error("Failed to sync conversation after reconnect:", error);
+            }
+        };
+
         const setupSSEConnection = () => {
             if (sseRef.current) {
                 sseRef.current.close();
             }
             
-            sseRef.current = new EventSource(`/api/stream/events`, { withCredentials: true });
+            const streamUrl = lastEventIdRef.current
+                ? `/api/stream/events?last_event_id=${encodeURIComponent(lastEventIdRef.current)}`
+                : `/api/stream/events`;
+            sseRef.current = new EventSource(streamUrl, { withCredentials: true });
             const eventSource = sseRef.current;
             
             eventSource.onopen = () => {
@@ -105,6 +162,9 @@ const MainApplication = () => {
             };
 
             eventSource.onmessage = (event: MessageEvent) => {
+                if (event.lastEventId) {
+                    lastEventIdRef.current = event.lastEventId;
+                }
                 try {
                     const outerData = JSON.parse(event.data);
                     
@@ -115,19 +175,9 @@ const MainApplication = () => {
                     const eventType = eventData.type || outerData.type;
 
                     // Handle streaming audio events
+                    // The audio itself is fetched from streamUrl, not sent over SSE.
                     if (eventType === 'instructed_tts_start') {
-                        startStreamingAudio(eventData.message_id);
-                        return;
-                    }
-
-                    if (eventType === 'instructed_tts_chunk') {
-                        const binaryString = atob(eventData.chunk);
-                        const len = binaryString.length;
-                        const bytes = new Uint8Array(len);
-                        for (let i = 0; i < len; i++) {
-                            bytes[i] = binaryString.charCodeAt(i);
-                        }
-                        appendAudioChunk(bytes);
+                        startStreamingAudio(eventData.message_id, eventData.streamUrl);
                         return;
                     }
 
@@ -309,6 +359,7 @@ const MainApplication = () => {
                             console.log("Attempting to reconnect SSE...");
                         }
                         setupSSEConnection();
+                        syncActiveConversation();
                     }, 5000); // Retry after 5 seconds
                 }
             };
@@ -350,13 +401,14 @@ const MainApplication = () => {
         
         if (id !== 'new') {
             try {
-                const response = await authFetch(`/chat/conversations/${id}/messages`);
+                // Only the newest page is loaded; older messages are fetched on demand.
+                const response = await authFetch(`/chat/conversations/${id}/messages?limit=${MESSAGE_PAGE_SIZE}`);
                 if (!response.ok) throw new Error('Failed to fetch messages.');
-                const messagesData: Message[] = await response.json();
+                const page: { messages: Message[]; has_more: boolean } = await response.json();
                 
                 setStoreConversations(prev => prev.map(c => 
                     c.id === id 
-                        ? { ...c, messages: messagesData.map(m => ({ ...m, status: MessageStatus.COMPLETE })) }
+                        ? { ...c, messages: page.messages.map(m => ({ ...m, status: MessageStatus.COMPLETE })), hasOlderMessages: page.has_more }
                         : c
                 ));
             } catch (error) {
@@ -365,6 +417,27 @@ const MainApplication = () => {
             }
         }
     }, [setStoreConversations, setConversationActiveState]);
+
+    const handleLoadOlderMessages = useCallback(async () => {
+        const active = useConversationStore.getState().conversations.find(c => c.active);
+        if (!active || active.id === 'new' || !active.hasOlderMessages || active.messages.length === 0) return;
+
+        const oldestId = active.messages[0].id;
+        try {
+            const response = await authFetch(`/chat/conversations/${active.id}/messages?limit=${MESSAGE_PAGE_SIZE}&before=${oldestId}`);
+            if (!response.ok) throw new Error('Failed to fetch messages.');
+            const page: { messages: Message[]; has_more: boolean } = await response.json();
+
+            setStoreConversations(prev => prev.map(c =>
+                c.id === active.id
+                    ? { ...c, messages: [...page.messages.map(m => ({ ...m, status: MessageStatus.COMPLETE })), ...c.messages], hasOlderMessages: page.has_more }
+                    : c
+            ));
+        } catch (error) {
+            console.error(`Error fetching older messages for conversation ${active.id}:`, error);
+            toast.error("Failed to load earlier messages.");
+        }
+    }, [setStoreConversations]);
     
     // FIX: Enhanced initial data setup with granular error handling
     useEffect(() => {
@@ -681,7 +754,8 @@ const MainApplication = () => {
                 }
             };
 
-            formData.append('attachment', file);
+            // Large files go through the resumable upload API before the message is posted.
+            if (file.size < RESUMABLE_UPLOAD_THRESHOLD) formData.append('attachment', file);
             if (language) formData.append('language', language);
         } else {
             if (process.env.NODE_ENV === 'development') {
@@ -742,7 +816,14 @@ const MainApplication = () => {
                 console.log('[App.tsx] Step 4: Sending request to backend endpoint:', endpoint);
             }
             
-            const response = attachments && attachments.length > 0
+            const largeFile = attachments && attachments.length > 0 && attachments[0].size >= RESUMABLE_UPLOAD_THRESHOLD
+                ? attachments[0] : null;
+            if (largeFile) {
+                const uploadId = await resumableUpload(largeFile, (progress) => updateMessageUploadProgress(userMessageId, progress));
+                formData.append('upload_id', uploadId);
+            }
+
+            const response = attachments && attachments.length > 0 && !largeFile
                 ? await authUpload(endpoint, formData, (progress) => updateMessageUploadProgress(userMessageId, progress))
                 : await authFetch(endpoint, { method: 'POST', body: formData });
 
@@ -806,6 +887,8 @@ const MainApplication = () => {
                                     messages={activeConversation.messages || []}
                                     onSendMessage={handleSendMessage}
                                     isExistingConversation={(activeConversation.messages || []).length > 0}
+                                    hasOlderMessages={activeConversation.hasOlderMessages}
+                                    onLoadOlderMessages={handleLoadOlderMessages}
                                 />
                             </div>
                         ) : (
@@ -39,6 +39,8 @@ interface ChatAreaProps {
     messages: Message[];
     onSendMessage: (content: string, attachments?: File[], language?: string) => void;
     isExistingConversation: boolean;
+    hasOlderMessages?: boolean;
+    onLoadOlderMessages?: () => Promise<void>;
 }
 interface YouTubeSettings {
   url: string;
@@ -52,6 +54,8 @@ const ChatArea: React.FC<ChatAreaProps> = ({
     messages,
     onSendMessage,
     isExistingConversation,
+    hasOlderMessages = false,
+    onLoadOlderMessages,
 }) => {
     const { t, i18n } = useTranslation();
     const [inputValue, setInputValue] = useState('');
@@ -60,6 +64,8 @@ const ChatArea: React.FC<ChatAreaProps> = ({
     const [isLoading, setIsLoading] = useState(false);
     const fileInputRef = useRef<HTMLInputElement>(null);
     const messagesEndRef = useRef<HTMLDivElement>(null);
+    const lastMessageIdRef = useRef<string | number | undefined>(undefined);
+    const [isLoadingOlder, setIsLoadingOlder] = useState(false);
     const audioChunksRef = useRef<Blob[]>([]);
     const mediaRecorderRef = useRef<MediaRecorder | null>(null);
     const audioStreamRef = useRef<MediaStream | null>(null);
@@ -90,6 +96,10 @@ const ChatArea: React.FC<ChatAreaProps> = ({
     useEffect(() => {
         const lastMessage = messages[messages.length - 1];
         const isStreaming = lastMessage?.role === 'assistant' && lastMessage.status === 'streaming';
+        // Loading older history prepends messages; keep the scroll position then.
+        const lastMessageChanged = lastMessage?.id !== lastMessageIdRef.current;
+        lastMessageIdRef.current = lastMessage?.id;
+        if (!lastMessageChanged && !isStreaming) return;
         if (isStreaming) {
             scrollToBottom('auto');
         } else {
@@ -220,7 +230,23 @@ const ChatArea: React.FC<ChatAreaProps> = ({
                     {messages.length === 0 ? (
                         <EmptyChatView onPromptClick={handlePromptClick} />
                     ) : (
-                        messages.map((message, index) => {
+                        <>
+                        {hasOlderMessages && onLoadOlderMessages && (
+                            <div className="flex justify-center pt-4">
+                                <Button
+                                    variant="ghost"
+                                    size="sm"
+                                    disabled={isLoadingOlder}
+                                    onClick={async () => {
+                                        setIsLoadingOlder(true);
+                                        try { await onLoadOlderMessages(); } finally { setIsLoadingOlder(false); }
+                                    }}
+                                >
+                                    {t('loadEarlierMessages')}
+                                </Button>
+                            </div>
+                        )}
+                        {messages.map((message, index) => {
                              const currentMessageDate = new Date(message.timestamp);
                              const previousMessage = messages[index - 1];
                              const previousMessageDate = previousMessage ? new Date(previousMessage.timestamp) : null;
@@ -237,7 +263,8 @@ const ChatArea: React.FC<ChatAreaProps> = ({
                                     <ChatMessage {...message} onImageClick={handleImageClick} onSendMessage={onSendMessage} onEditClick={handleEditClick} />
                                 </React.Fragment>
                             );
-                        })
+                        })}
+                        </>
                     )}
                 </div>
                 <div ref={messagesEndRef} />
@@ -164,4 +164,57 @@ export const authUpload = (
 
     xhr.send(formData);
   });
+};
+
+/**
+ * Files at least this large are sent through the resumable upload API.
+ */
+export const RESUMABLE_UPLOAD_THRESHOLD = 20 * 1024 * 1024;
+
+const MAX_RANGE_RETRIES = 5;
+
+/**
+ * Uploads a file in byte ranges through /api/uploads and returns the upload id,
+ * which is then sent to the chat endpoints instead of the file itself.
+ * A failed range is retried from the offset the server reports, so a network
+ * hiccup only costs the range in flight.
+ */
+export const resumableUpload = async (
+  file: File,
+  onUploadProgress: (progress: number) => void
+): Promise<string> => {
+  const createResponse = await authFetch('/uploads', {
+    method: 'POST',
+    body: JSON.stringify({ filename: file.name, content_type: file.type, size: file.size }),
+  });
+  if (!createResponse.ok) {
+    const errorData = await createResponse.json().catch(() => ({ message: 'Failed to start upload' }));
+    throw new Error(errorData.message);
+  }
+  const { upload_id: uploadId, chunk_size: chunkSize } = await createResponse.json();
+
+  let offset = 0;
+  let failures = 0;
+  while (offset < file.size) {
+    const end = Math.min(offset + chunkSize, file.size);
+    try {
+      const response = await authFetch(`/uploads/${uploadId}`, {
+        method: 'PUT',
+        headers: { 'Content-Range': `bytes ${offset}-${end - 1}/${file.size}` },
+        body: file.slice(offset, end),
+      });
+      const data = await response.json().catch(() => ({}));
+      if (!response.ok) throw new Error(data.message || 'Upload failed');
+      offset = data.offset;
+      failures = 0;
+    } catch (error) {
+      if (++failures > MAX_RANGE_RETRIES) throw error;
+      await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+      // Ask the server where to resume from; part of the range may have arrived.
+      const statusResponse = await authFetch(`/uploads/${uploadId}`).catch(() => null);
+      if (statusResponse?.ok) offset = (await statusResponse.json()).offset;
+    }
+    onUploadProgress(Math.round((offset * 100) / Math.max(file.size, 1)));
+  }
+  return uploadId;
 };
\ No newline at end of file
@@ -18,6 +18,8 @@ interface ConversationState {
     addOptimisticMessages: (conversationId: string | number, userMessage: Message, assistantMessage: Message) => void;
     // NEW: A flexible action to update any part of a message
     updateMessage: (messageId: string | number, updates: Partial<Message>) => void;
+    // Applies messages returned by the delta-sync endpoint: updates known ones, appends new ones.
+    upsertMessages: (conversationId: string | number, messages: Message[]) => void;
     // --- NEW: Action to update conversation-level properties ---
     setConversationContext: (conversationId: string | number, updates: Partial<Conversation>) => void;
     syncRealMessage: (payload: { isNewConversation: boolean; tempUserMessageId: string | number; realUserMessage: Message; newConversationData?: Conversation & { temp_conversation_id?: string }; assistantMessage?: Message; }) => void;
@@ -51,11 +53,11 @@ interface ConversationState {
         // --- START: ADD NEW STREAMING AUDIO STATE & ACTIONS ---
     streamingAudio: {
         messageId: string | number;
-        audioChunks: Uint8Array[];
+        // Progressive audio/mpeg endpoint the audio is played from while it is generated.
+        streamUrl: string;
         isPlaying: boolean;
     } | null;
-    startStreamingAudio: (messageId: string | number) => void;
-    appendAudioChunk: (chunk: Uint8Array) => void;
+    startStreamingAudio: (messageId: string | number, streamUrl: string) => void;
     finishStreamingAudio: () => void;
     // --- END: ADD NEW STREAMING AUDIO STATE & ACTIONS ---
 
@@ -336,6 +338,16 @@ export const useConversationStore = create<ConversationState>((set, get) => ({
         }))
     })),
     // --------------------------------------------------------
+    upsertMessages: (conversationId, messages) => set(state => ({
+        conversations: state.conversations.map(convo => {
+            if (convo.id !== conversationId) return convo;
+            const byId = new Map(convo.messages.map(msg => [msg.id, msg]));
+            messages.forEach(msg => byId.set(msg.id, { ...byId.get(msg.id), ...msg }));
+            const merged = Array.from(byId.values());
+            merged.sort((a, b) => new Date(a.timestamp).getTime() - new Date(b.timestamp).getTime());
+            return { ...convo, messages: merged };
+        })
+    })),
     // --- START: ADD NEW ACTION IMPLEMENTATIONS ---
     // Add these new properties at the end, before the final closing bracket
     videoAspectRatio: null,
@@ -346,22 +358,13 @@ export const useConversationStore = create<ConversationState>((set, get) => ({
         // --- START: ADD NEW ACTION IMPLEMENTATIONS ---
     // Add these new properties at the end
     streamingAudio: null,
-    startStreamingAudio: (messageId) => set({ 
+    startStreamingAudio: (messageId, streamUrl) => set({ 
         streamingAudio: { 
             messageId, 
-            audioChunks: [],
+            streamUrl,
             isPlaying: true // Start playing immediately
         } 
     }),
-    appendAudioChunk: (chunk) => set(state => {
-        if (!state.streamingAudio) return {};
-        return {
-            streamingAudio: {
-                ...state.streamingAudio,
-                audioChunks: [...state.streamingAudio.audioChunks, chunk],
-            }
-        };
-    }),
     finishStreamingAudio: () => set(state => {
         if (!state.streamingAudio) return {};
         return {
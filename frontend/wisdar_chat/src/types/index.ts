@@ -61,6 +61,7 @@ export interface Message {
   content: string;               // Text content of the message
   role: MessageRole;             // Author of the message
   timestamp: string;             // ISO 8601 timestamp of creation
+  updated_at?: string | null;    // ISO 8601 timestamp of the last server-side change
   status?: MessageStatus;        // Current processing state
   
   // --- ADD THIS NEW PROPERTY ---
@@ -115,6 +116,7 @@ export interface Conversation {
   userId?: number;               // Optional user ID for multi-user systems
   imageContextUrl?: string | null;
   providerServiceId?: number; // Add this line
+  hasOlderMessages?: boolean;   // More history can be loaded before the first message
 }
 
 /**